@@ -0,0 +1,202 @@
+import logging
+import math
+import os
+import random
+import re
+import struct
+import time
+import zlib
+from array import array
+from pathlib import Path
+from typing import Optional
+
+from ai_cache import normalize_text
+
+log = logging.getLogger(__name__)
+
+_MAGIC = b"XADM"
+_VERSION = 1
+_WORD_RE = re.compile(r"\w+")
+_URL_RE = re.compile(r"https?://|t\.me/|www\.")
+_MENTION_RE = re.compile(r"@\w+")
+_PERCENT_RE = re.compile(r"\d+\s?%")
+_PRICE_RE = re.compile(r"\d[\d\s]*(?:₽|руб|\$|€)")
+
+
+class AdClassifier:
+    """
+    Локальный предклассификатор рекламы перед DeepSeek: логистическая
+    регрессия на хэшированных словах, биграммах и нескольких маркерах
+    (ссылки, упоминания, проценты, цены). Учится онлайн на вердиктах LLM,
+    веса лежат в бинарном файле и переживают перезапуск.
+
+    Решение принимается локально, только если модель видела min_samples
+    вердиктов (и оба класса) и уверенность >= confidence. Долю audit_rate
+    уверенных решений всё равно проверяем у LLM — так меряется согласие.
+
+    Таблица весов — 2^dim_bits double (2 МБ при 18 битах), поэтому на диск
+    она пишется не чаще раза в save_interval секунд: snapshot() снимает
+    копию в цикле событий, write() пишет её (можно из потока).
+    """
+
+    def __init__(
+            self,
+            path: Path,
+            dim_bits: int = 18,
+            confidence: float = 0.95,
+            min_samples: int = 200,
+            audit_rate: float = 0.05,
+            lr: float = 0.5,
+            seed: int = 1,
+            save_interval: float = 60.0,
+    ):
+        self.path = Path(path)
+        self.dim_bits = dim_bits
+        self.mask = (1 << dim_bits) - 1
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self.audit_rate = audit_rate
+        self.lr = lr
+        self.save_interval = save_interval
+        self._rnd = random.Random(seed)
+
+        self.weights = array("d", bytes(8 * (1 << dim_bits)))
+        self.bias = 0.0
+        self.samples = 0
+        self.positives = 0
+        self._dirty = False
+        self._saved = time.monotonic()
+
+        self.local_decisions = 0
+        self.llm_checks = 0
+        self.audits = 0
+        self.agree = 0
+        self.compared = 0
+        self.audit_compared = 0
+        self.audit_agree = 0
+
+        self._load()
+
+    def _header(self) -> bytes:
+        return _MAGIC + struct.pack("<HH", _VERSION, self.dim_bits)
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        data = self.path.read_bytes()
+        header = self._header()
+        expected = len(header) + struct.calcsize("<dqq") + len(self.weights) * 8
+        if data[:len(header)] != header or len(data) != expected:
+            log.warning(f"⚠️ Модель рекламы {self.path} несовместима с текущими параметрами, обучаем заново")
+            return
+        self.bias, self.samples, self.positives = struct.unpack_from("<dqq", data, len(header))
+        self.weights = array("d")
+        self.weights.frombytes(data[len(header) + struct.calcsize("<dqq"):])
+        log.info(f"🧠 Модель рекламы загружена: {self.samples} вердиктов ({self.positives} реклама)")
+
+    def snapshot(self, force: bool = False) -> Optional[bytes]:
+        """Содержимое файла модели, если пора сохранять (или force), иначе None."""
+        if not self._dirty or (not force and time.monotonic() - self._saved < self.save_interval):
+            return None
+        self._dirty = False
+        self._saved = time.monotonic()
+        return (
+            self._header()
+            + struct.pack("<dqq", self.bias, self.samples, self.positives)
+            + self.weights.tobytes()
+        )
+
+    def write(self, data: bytes) -> None:
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, self.path)
+
+    def save(self, force: bool = False) -> None:
+        data = self.snapshot(force)
+        if data is not None:
+            self.write(data)
+
+    def features(self, text: str) -> list[int]:
+        text = normalize_text(text)[:4000]
+        words = _WORD_RE.findall(text)
+        feats = [f"w:{w}" for w in words]
+        feats += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        if _URL_RE.search(text):
+            feats.append("m:url")
+        if _MENTION_RE.search(text):
+            feats.append("m:mention")
+        if _PERCENT_RE.search(text):
+            feats.append("m:percent")
+        if _PRICE_RE.search(text):
+            feats.append("m:price")
+        return [zlib.crc32(f.encode("utf-8")) & self.mask for f in feats]
+
+    def _score(self, idx: list[int]) -> float:
+        if not idx:
+            return 0.5
+        scale = 1 / math.sqrt(len(idx))
+        z = self.bias + scale * sum(self.weights[i] for i in idx)
+        return 1 / (1 + math.exp(-max(-30.0, min(30.0, z))))
+
+    @property
+    def ready(self) -> bool:
+        return self.samples >= self.min_samples and 0 < self.positives < self.samples
+
+    def predict(self, text: str) -> float:
+        """Вероятность того, что текст — реклама."""
+        return self._score(self.features(text))
+
+    def decide(self, text: str) -> tuple[Optional[bool], float]:
+        """
+        (вердикт, вероятность). Вердикт None — модель не уверена
+        (или выпал аудит), нужно спросить LLM и потом вызвать learn().
+        """
+        prob = self.predict(text)
+        if not self.ready or max(prob, 1 - prob) < self.confidence:
+            return None, prob
+        if self._rnd.random() < self.audit_rate:
+            self.audits += 1
+            return None, prob
+        self.local_decisions += 1
+        return prob >= 0.5, prob
+
+    def learn(self, text: str, is_ad: bool, prob: Optional[float] = None) -> None:
+        """Шаг SGD по вердикту LLM; prob — предсказание из decide() для учёта согласия."""
+        self.llm_checks += 1
+        if prob is not None and self.ready:
+            agree = (prob >= 0.5) == is_ad
+            self.compared += 1
+            self.agree += agree
+            if max(prob, 1 - prob) >= self.confidence:
+                self.audit_compared += 1
+                self.audit_agree += agree
+
+        idx = self.features(text)
+        if not idx:
+            return
+        grad = self._score(idx) - (1.0 if is_ad else 0.0)
+        step = self.lr * grad
+        scale = 1 / math.sqrt(len(idx))
+        for i in idx:
+            self.weights[i] -= step * scale
+        self.bias -= step
+        self.samples += 1
+        self.positives += bool(is_ad)
+        self._dirty = True
+
+    def close(self) -> None:
+        self.save(force=True)
+
+    def stats(self) -> dict:
+        decided = self.local_decisions + self.llm_checks
+        return {
+            "samples": self.samples,
+            "positives": self.positives,
+            "ready": self.ready,
+            "local_decisions": self.local_decisions,
+            "llm_checks": self.llm_checks,
+            "saved_ratio": round(self.local_decisions / decided, 3) if decided else 0.0,
+            "agreement": round(self.agree / self.compared, 3) if self.compared else 0.0,
+            "audits": self.audits,
+            "audit_agreement": round(self.audit_agree / self.audit_compared, 3) if self.audit_compared else 0.0,
+        }
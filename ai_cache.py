@@ -0,0 +1,125 @@
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+
+def normalize_text(text: str) -> str:
+    """
+    Нормализация для ключа кэша: регистр, пробелы и переносы не должны
+    давать разные ключи для одного и того же репоста.
+    """
+    return re.sub(r"\s+", " ", (text or "").lower()).strip()
+
+
+def prompt_version(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+class AICache:
+    """
+    Персистентный кэш ответов DeepSeek (SQLite), ключ — sha256 от
+    нормализованного текста + модели + версии промпта.
+    Вытеснение: TTL по времени записи и LRU по времени последнего чтения
+    при превышении max_entries. Время чтения копится в памяти и пишется
+    одной транзакцией в flush() — попадание в кэш не трогает диск и не
+    ждёт блокировку записи SQLite.
+    """
+
+    def __init__(self, path: Path, ttl: float = 7 * 24 * 3600, max_entries: int = 50000):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._puts = 0
+        self._accessed: dict[str, float] = {}
+
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ai_cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS ai_cache_accessed ON ai_cache(accessed)")
+        self.db.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(kind: str, text: str, model: str, version: str) -> str:
+        raw = "\x00".join([kind, model, version, normalize_text(text)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        row = self.db.execute("SELECT value, created FROM ai_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.ttl and now - row[1] > self.ttl):
+            self.misses += 1
+            return None
+        self._accessed[key] = now
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, kind: str, value: Any) -> None:
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO ai_cache(key, kind, value, created, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, kind, json.dumps(value, ensure_ascii=False), now, now),
+        )
+        self.db.commit()
+        self._puts += 1
+        # полная проверка лимитов не на каждую запись
+        if self._puts % 100 == 0:
+            self.evict()
+
+    def flush(self) -> None:
+        """Записывает накопленное время последнего чтения."""
+        if not self._accessed:
+            return
+        pending, self._accessed = self._accessed, {}
+        self.db.executemany("UPDATE ai_cache SET accessed = ? WHERE key = ?", [(t, k) for k, t in pending.items()])
+        self.db.commit()
+
+    def evict(self) -> None:
+        self.flush()
+        removed = 0
+        if self.ttl:
+            cur = self.db.execute("DELETE FROM ai_cache WHERE created < ?", (time.time() - self.ttl,))
+            removed += cur.rowcount
+        (count,) = self.db.execute("SELECT COUNT(*) FROM ai_cache").fetchone()
+        if count > self.max_entries:
+            cur = self.db.execute(
+                "DELETE FROM ai_cache WHERE key IN (SELECT key FROM ai_cache ORDER BY accessed LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            removed += cur.rowcount
+        self.db.commit()
+        self.evicted += removed
+
+    def stats(self) -> dict:
+        (count,) = self.db.execute("SELECT COUNT(*) FROM ai_cache").fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries": count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "evicted": self.evicted,
+        }
+
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Optional, Union
+
+import httpx
+
+log = logging.getLogger(__name__)
+
+# ответы, после которых имеет смысл повторить запрос
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """API считается недоступным, запрос не отправлялся."""
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Экспоненциальная задержка с полным джиттером: uniform(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold ошибок подряд) -> open: запросы сразу
+    отклоняются -> (через reset_timeout) half_open: пропускаем один пробный,
+    успех закрывает, ошибка снова открывает.
+    Пробный запрос, который отменили (или который упал не сетевой ошибкой),
+    возвращается через release(); на всякий случай проба, висящая дольше
+    reset_timeout, тоже считается потерянной и выдаётся заново.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probe = False
+        self._probe_at = 0.0
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probe = False
+        if self.state == "half_open":
+            if self._probe and now - self._probe_at < self.reset_timeout:
+                return False
+            self._probe = True
+            self._probe_at = now
+            return True
+        return self.state == "closed"
+
+    def release(self) -> None:
+        """Запрос завершился без ответа API (отмена): пробу можно выдать снова."""
+        self._probe = False
+
+    def success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probe = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+                log.warning(f"🔌 DeepSeek: circuit breaker открыт на {self.reset_timeout:.0f}s")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe = False
+
+
+class AIClient:
+    """
+    Один долгоживущий HTTP-клиент для DeepSeek на весь процесс.
+    Держит пул keep-alive соединений (опционально HTTP/2) и ограничивает
+    число одновременных запросов к API, чтобы всплеск постов не открывал
+    десятки TLS-рукопожатий разом.
+
+    Устойчивость: повторы с экспоненциальной задержкой и джиттером,
+    circuit breaker на модель, hedged-запрос, если ответ дольше
+    hedge_percentile недавних задержек, и запасная модель fallback_model.
+    """
+
+    def __init__(
+            self,
+            base_url: str,
+            api_key: str,
+            max_connections: int = 10,
+            max_keepalive: int = 10,
+            keepalive_expiry: float = 60.0,
+            max_in_flight: int = 4,
+            http2: bool = False,
+            timeout: float = 30.0,
+            retries: int = 2,
+            backoff_base: float = 0.5,
+            backoff_max: float = 8.0,
+            breaker_failures: int = 5,
+            breaker_reset: float = 30.0,
+            hedge_percentile: float = 0.0,
+            hedge_min_delay: float = 0.5,
+            fallback_model: str = "",
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.fallback_model = fallback_model
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._sem = asyncio.Semaphore(max_in_flight)
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._latencies: deque = deque(maxlen=200)
+
+        self.requests = 0
+        self.errors = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.wait_time = 0.0
+        self.retried = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self.short_circuits = 0
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+            try:
+                self._client = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    headers=headers,
+                    limits=self.limits,
+                    timeout=self.timeout,
+                    http2=self.http2,
+                )
+            except ImportError:
+                # http2=True требует пакет h2 (pip install httpx[http2])
+                log.warning("⚠ HTTP/2 недоступен (нет пакета h2), используем HTTP/1.1")
+                self.http2 = False
+                self._client = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    headers=headers,
+                    limits=self.limits,
+                    timeout=self.timeout,
+                )
+        return self._client
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+        return self._breakers[model]
+
+    async def chat(self, payload: dict, timeout: Optional[float] = None, retries: Optional[int] = None) -> httpx.Response:
+        """
+        POST /chat/completions с повторами, breaker'ом и запасной моделью.
+        Возвращает ответ (в т.ч. последний неуспешный по статусу);
+        CircuitOpenError — если ни одна модель сейчас не принимает запросы.
+        """
+        retries = self.retries if retries is None else retries
+        models = [payload.get("model", "")]
+        if self.fallback_model and self.fallback_model not in models:
+            models.append(self.fallback_model)
+
+        last: Union[httpx.Response, Exception, None] = None
+        for model in models:
+            if model != models[0]:
+                self.fallbacks += 1
+                log.warning(f"↪️ DeepSeek: переключаемся на запасную модель {model}")
+            body = payload if model == models[0] else {**payload, "model": model}
+            breaker = self.breaker(model)
+            for attempt in range(retries + 1):
+                if not breaker.allow():
+                    self.short_circuits += 1
+                    last = CircuitOpenError(f"circuit open for {model}")
+                    break
+                try:
+                    resp = await self._send(body, timeout)
+                except httpx.TransportError as e:
+                    breaker.failure()
+                    last = e
+                except BaseException:
+                    # отмена (спекуляция, правки) — не вердикт о доступности API
+                    breaker.release()
+                    raise
+                else:
+                    if resp.status_code not in RETRY_STATUSES:
+                        breaker.success()
+                        return resp
+                    breaker.failure()
+                    last = resp
+                if attempt < retries:
+                    self.retried += 1
+                    await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+
+        if isinstance(last, httpx.Response):
+            return last
+        raise last
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge_percentile or len(self._latencies) < 20:
+            return None
+        ordered = sorted(self._latencies)
+        idx = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+        return max(self.hedge_min_delay, ordered[idx])
+
+    async def _send(self, body: dict, timeout: Optional[float]) -> httpx.Response:
+        """
+        Запрос с хеджированием: если ответа нет дольше hedge-порога,
+        параллельно уходит второй такой же, берём первый удачный.
+        """
+        hedge_after = self._hedge_delay()
+        if hedge_after is None:
+            return await self._post(body, timeout)
+
+        first = asyncio.create_task(self._post(body, timeout))
+        pending = {first}
+        result = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=hedge_after)
+            if done:
+                return first.result()
+
+            self.hedges += 1
+            second = asyncio.create_task(self._post(body, timeout))
+            pending.add(second)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code not in RETRY_STATUSES:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    result = task
+            return result.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _post(self, body: dict, timeout: Optional[float]) -> httpx.Response:
+        """
+        POST /chat/completions через общий пул.
+        Новое ли соединение — узнаём по trace-событиям httpcore.
+        """
+        http = self._ensure_client()
+        connected = False
+
+        async def trace(event_name: str, info: dict) -> None:
+            nonlocal connected
+            if event_name == "connection.connect_tcp.complete":
+                connected = True
+
+        t0 = time.monotonic()
+        async with self._sem:
+            self.wait_time += time.monotonic() - t0
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.requests += 1
+            try:
+                t1 = time.monotonic()
+                resp = await http.post(
+                    "/chat/completions",
+                    json=body,
+                    timeout=timeout if timeout is not None else self.timeout,
+                    extensions={"trace": trace},
+                )
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.in_flight -= 1
+                if connected:
+                    self.new_connections += 1
+                else:
+                    self.reused_connections += 1
+        if resp.status_code == 200:
+            self._latencies.append(time.monotonic() - t1)
+        return resp
+
+    def stats(self) -> dict:
+        total = self.new_connections + self.reused_connections
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "reuse_ratio": self.reused_connections / total if total else 0.0,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "max_in_flight": self.max_in_flight,
+            "wait_time": round(self.wait_time, 3),
+            "http2": self.http2,
+            "retried": self.retried,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+            "short_circuits": self.short_circuits,
+            "breakers": {model: b.state for model, b in self._breakers.items()},
+        }
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,102 @@
+import logging
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+
+class WatermarkTracker:
+    """
+    Отметка «обработано до id» по каждому источнику. Посты завершаются не по
+    порядку, поэтому отметка сдвигается только до поста, перед которым нет
+    незавершённых: после падения пропущенное будет догнано, а уже
+    отправленное отсечёт карта соответствий.
+    Ошибка поста тоже считается завершением (как и в живом режиме, повтора нет);
+    отменённые при остановке посты отметку не двигают.
+    Если историю источника прочитать не удалось, hold() не даёт отметке
+    уйти выше старой до перезапуска — иначе живые посты перешагнули бы
+    пробел и он не догнался бы никогда.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._inflight: dict[str, dict[int, int]] = {}  # source -> {min id поста: сколько}
+        self._done_max: dict[str, int] = {}
+        self._holds: dict[str, int] = {}  # source -> отметка, выше которой не сдвигаемся
+
+    def hold(self, source: str, msg_id: int) -> None:
+        self._holds[source] = msg_id
+
+    def begin(self, source: str, ids: list[int]) -> None:
+        inflight = self._inflight.setdefault(source, {})
+        key = min(ids)
+        inflight[key] = inflight.get(key, 0) + 1
+
+    def done(self, source: str, ids: list[int]) -> None:
+        inflight = self._inflight.setdefault(source, {})
+        key = min(ids)
+        if inflight.get(key, 0) > 1:
+            inflight[key] -= 1
+        else:
+            inflight.pop(key, None)
+
+        top = max(self._done_max.get(source, 0), max(ids))
+        self._done_max[source] = top
+        if inflight:
+            top = min(top, min(inflight) - 1)
+        if source in self._holds:
+            top = min(top, self._holds[source])
+        if top > (self.store.get_watermark(source) or 0):
+            self.store.set_watermark(source, top)
+
+    def in_flight(self, source: str) -> int:
+        return sum(self._inflight.get(source, {}).values())
+
+
+def group_posts(msgs: list) -> list[list]:
+    """Сообщения по возрастанию id -> посты: одиночные и альбомы по grouped_id."""
+    posts: list[list] = []
+    albums: dict[int, list] = {}
+    for m in msgs:
+        if not m.grouped_id:
+            posts.append([m])
+        elif m.grouped_id in albums:
+            albums[m.grouped_id].append(m)
+        else:
+            albums[m.grouped_id] = [m]
+            posts.append(albums[m.grouped_id])
+    return posts
+
+
+async def fetch_missed(
+        client,
+        source: str,
+        after_id: int,
+        limit: int,
+        since: Optional[float] = None,
+        wait_time: float = 1.0,
+) -> list[list]:
+    """
+    Посты источника новее after_id в хронологическом порядке: не больше limit
+    сообщений (самые свежие) и не старше since (unix time). История читается
+    пачками по 100 от новых к старым, wait_time — пауза между запросами.
+    """
+    msgs = []
+    boundary = None  # первое сообщение, на котором чтение остановилось
+    async for m in client.iter_messages(source, min_id=after_id, wait_time=wait_time):
+        if since and m.date and m.date.timestamp() < since:
+            boundary = m
+            break
+        if len(msgs) >= limit:
+            boundary = m
+            break
+        if getattr(m, "action", None):
+            continue  # служебные сообщения (закреп, смена названия) не зеркалим
+        msgs.append(m)
+    msgs.reverse()
+
+    posts = group_posts(msgs)
+    # самый старый альбом мог обрезаться границей — отправлять его частью нельзя
+    if boundary and posts and boundary.grouped_id and posts[0][0].grouped_id == boundary.grouped_id:
+        dropped = posts.pop(0)
+        log.info(f"⏪ {source}: альбом #{dropped[0].grouped_id} на границе догона пропущен")
+    return posts
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Склеивает одиночные вызовы в пачки: пачка уходит, когда набралось
+    max_items элементов или прошло max_delay секунд с первого из них.
+    func(items) возвращает результаты в том же порядке; каждый вызывающий
+    получает свой результат, а исключение func — все участники пачки.
+    """
+
+    def __init__(self, func: Callable[[list], Awaitable[list]], max_items: int = 8, max_delay: float = 0.03):
+        self.func = func
+        self.max_items = max_items
+        self.max_delay = max_delay
+
+        self._pending: list[tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+        self.batches = 0
+        self.items = 0
+        self.max_size = 0
+        self.failures = 0
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((item, fut))
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # отменённые вызывающие в пачку не попадают
+        batch = [(item, fut) for item, fut in self._pending if not fut.done()]
+        self._pending = []
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[Any, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        self.max_size = max(self.max_size, len(batch))
+        try:
+            results = await self.func([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"ожидалось {len(batch)} результатов, получено {len(results)}")
+        except Exception as e:
+            self.failures += 1
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def close(self) -> None:
+        if self._pending:
+            self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_size": self.max_size,
+            "failures": self.failures,
+        }
+
+
+class Debouncer:
+    """
+    Обработка по ключу через delay секунд после последнего обновления:
+    из серии быстрых правок до handler(key, value) доходит только последняя.
+    Вызовы handler по одному ключу идут строго по очереди.
+    """
+
+    def __init__(self, handler: Callable[[Any, Any], Awaitable], delay: float = 3.0):
+        self.handler = handler
+        self.delay = delay
+
+        self._pending: dict[Any, tuple[Any, asyncio.Task]] = {}
+        self._running: dict[Any, asyncio.Task] = {}
+
+        self.pushed = 0
+        self.requeued = 0
+        self.fired = 0
+        self.failures = 0
+
+    def push(self, key: Any, value: Any) -> None:
+        self.pushed += 1
+        self._schedule(key, value)
+
+    def requeue(self, key: Any, value: Any) -> None:
+        """
+        Повтор из handler (ещё рано обрабатывать): снова через delay, в pushed
+        не считается. Если за это время пришло новое значение, остаётся оно.
+        """
+        if key in self._pending:
+            return
+        self.requeued += 1
+        self._schedule(key, value)
+
+    def _schedule(self, key: Any, value: Any) -> None:
+        old = self._pending.get(key)
+        if old is not None:
+            old[1].cancel()
+        self._pending[key] = (value, asyncio.create_task(self._fire(key)))
+
+    def cancel(self, key: Any) -> None:
+        old = self._pending.pop(key, None)
+        if old is not None:
+            old[1].cancel()
+
+    async def _fire(self, key: Any) -> None:
+        await asyncio.sleep(self.delay)
+        value, task = self._pending.pop(key)
+        previous = self._running.get(key)
+        self._running[key] = task
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            self.fired += 1
+            await self.handler(key, value)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            log.warning(f"⚠️ Ошибка отложенной обработки {key}: {e!r}")
+        finally:
+            if self._running.get(key) is task:
+                del self._running[key]
+
+    async def close(self) -> None:
+        """Отложенное, но не начатое отменяется; начатое — тоже (остановка)."""
+        tasks = [task for _, task in self._pending.values()] + list(self._running.values())
+        self._pending.clear()
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "pushed": self.pushed,
+            "requeued": self.requeued,
+            "fired": self.fired,
+            "coalesced": self.pushed + self.requeued - self.fired - len(self._pending),
+            "failures": self.failures,
+        }
@@ -0,0 +1,118 @@
+"""
+Микро-бенчмарк дедупликации: линейный проход calculate_similarity по истории
+против DedupIndex (MinHash/LSH + точная проверка кандидатов).
+Индекс обязан решать так же, как линейный проход: при любом расхождении
+(fp — лишний дубликат, fn — пропущенный) бенчмарк завершается с кодом 1.
+
+    python bench/bench_dedup.py --sizes 100 1000 10000 --queries 200
+"""
+import argparse
+import itertools
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dedup_index import DedupIndex, calculate_similarity  # noqa: E402
+
+ALPHABET = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+
+
+ZIPF = list(itertools.accumulate(1 / (i + 1) for i in range(20000)))
+
+
+def make_vocab(rnd: random.Random, size: int = 20000) -> list[str]:
+    return ["".join(rnd.choice(ALPHABET) for _ in range(rnd.randint(2, 9))) for _ in range(size)]
+
+
+def make_text(rnd: random.Random, vocab: list[str], words: int = 60) -> str:
+    # распределение слов по Ципфу: частые служебные слова дают фоновое сходство, как в живых текстах
+    return " ".join(rnd.choices(vocab, cum_weights=ZIPF[:len(vocab)], k=words))
+
+
+def mutate(rnd: random.Random, vocab: list[str], text: str, ratio: float) -> str:
+    words = text.split()
+    for i in range(len(words)):
+        if rnd.random() < ratio:
+            words[i] = rnd.choices(vocab, cum_weights=ZIPF[:len(vocab)])[0]
+    return " ".join(words)
+
+
+def linear_is_dup(text: str, history: list[str], threshold: float) -> bool:
+    for hist_text in history:
+        if calculate_similarity(text, hist_text) > threshold:
+            return True
+    return False
+
+
+def run(size: int, queries: int, threshold: float, num_perm: int, seed: int) -> tuple[int, int]:
+    rnd = random.Random(seed)
+    vocab = make_vocab(rnd)
+    history = [make_text(rnd, vocab) for _ in range(size)]
+
+    index = DedupIndex(threshold=threshold, capacity=size, num_perm=num_perm)
+    t0 = time.perf_counter()
+    for text in history:
+        index.add(text)
+    build = time.perf_counter() - t0
+
+    # половина запросов — перефразированные репосты из истории, половина — новые тексты
+    probes = []
+    for i in range(queries):
+        if i % 2 == 0:
+            probes.append(mutate(rnd, vocab, rnd.choice(history), ratio=rnd.uniform(0.05, 0.6)))
+        else:
+            probes.append(make_text(rnd, vocab))
+
+    lin_times, idx_times = [], []
+    agree = tp = fp = fn = 0
+    for text in probes:
+        t0 = time.perf_counter()
+        exact = linear_is_dup(text, history, threshold)
+        lin_times.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        approx = index.query(text) > 0
+        idx_times.append(time.perf_counter() - t0)
+
+        agree += exact == approx
+        tp += exact and approx
+        fp += approx and not exact
+        fn += exact and not approx
+
+    def ms(values: list[float], q: float) -> float:
+        return statistics.quantiles(values, n=100)[int(q) - 1] * 1000 if len(values) > 1 else values[0] * 1000
+
+    print(
+        f"{size:>7} | linear p50 {ms(lin_times, 50):8.2f} ms p99 {ms(lin_times, 99):8.2f} ms"
+        f" | index p50 {ms(idx_times, 50):6.2f} ms p99 {ms(idx_times, 99):6.2f} ms"
+        f" | build {build:6.2f} s | agree {agree / len(probes):.1%} (fp {fp}, fn {fn})"
+    )
+    return fp, fn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument("--num-perm", type=int, default=128)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    index = DedupIndex(threshold=args.threshold, capacity=1, num_perm=args.num_perm)
+    print(f"threshold={args.threshold} num_perm={args.num_perm} bands={index.bands} rows={index.rows}")
+    failed = False
+    for size in args.sizes:
+        fp, fn = run(size, args.queries, args.threshold, args.num_perm, args.seed)
+        failed |= bool(fp or fn)
+    if failed:
+        print("FAIL: индекс расходится с точным Жаккаром")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
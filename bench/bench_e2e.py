@@ -0,0 +1,281 @@
+"""
+Офлайн end-to-end бенчмарк main.py: без Telegram и без DeepSeek.
+Поток событий (записанный JSONL или синтетический) проигрывается через
+FakeTelegramClient в настоящие обработчики, AI отвечает FakeDeepSeek.
+
+    python bench/bench_e2e.py --posts 300 --rate 20
+    python bench/bench_e2e.py --events stream.jsonl --speed 0 --json report.json --max-p99 5
+    AI_COMBINED=1 python bench/bench_e2e.py --posts 300 --ai-bad-json-rate 0.05
+    SPECULATIVE_PIPELINE=1 python bench/bench_e2e.py --posts 300 --download
+
+Остальные параметры main.py (SCHED_WORKERS, SEND_RATE, ...) берутся из окружения.
+--max-p99 / --min-throughput дают ненулевой код выхода для CI.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+import metrics  # noqa: E402
+from bench_dedup import make_text, make_vocab  # noqa: E402
+from fakes import FakeDeepSeek, FakeTelegramClient, generate_events, load_events, save_events  # noqa: E402
+
+
+class SampleHistogram(metrics.Histogram):
+    """Гистограмма, которая ещё и хранит сырые значения — для точных перцентилей."""
+
+    def __init__(self, name: str, doc: str):
+        super().__init__(name, doc)
+        self.samples: dict[str, list[float]] = defaultdict(list)
+
+    def observe(self, value: float, **labels) -> None:
+        super().observe(value, **labels)
+        self.samples[labels.get("stage", "")].append(value)
+
+
+def pct(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+def configure_env(args, workdir: Path, base_url: str) -> None:
+    defaults = {
+        "API_ID": "1",
+        "API_HASH": "bench",
+        "PHONE": "+10000000000",
+        "SOURCE_CHANNELS": ",".join(f"@bench_{i}" for i in range(args.sources)),
+        "TARGET_CHANNEL_ID": "-1000000000001",
+        "DEEPSEEK_API_KEY": "bench",
+        "SEND_RATE": "1000",
+        "SEND_BURST": "1000",
+        "LOG_LEVEL": args.log_level,
+        "METRICS_PORT": "0",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    # пути и адрес API всегда свои, чтобы бенчмарк не трогал рабочее состояние
+    os.environ.update({
+        "DEEPSEEK_BASE_URL": base_url,
+        "WORKDIR": str(workdir / "media"),
+        "MAP_FILE": str(workdir / "mirror_map.json"),
+        "STATE_DB_FILE": str(workdir / "state.sqlite3"),
+        "DEDUP_INDEX_FILE": str(workdir / "dedup_index.bin"),
+        "AI_CACHE_FILE": str(workdir / "ai_cache.sqlite3"),
+        "AD_LOCAL_MODEL_FILE": str(workdir / "ad_model.bin"),
+        "AI_CACHE_ENABLED": "1" if args.ai_cache else "0",
+        "REUPLOAD_BY_REFERENCE": "0" if args.download else "1",
+    })
+
+
+async def replay(app, fake: FakeTelegramClient, stream: list, speed: float, timeout: float) -> dict:
+    arrivals: dict[tuple, float] = {}
+    latencies: list[float] = []
+    all_done = asyncio.Event()
+
+    def done(key: tuple) -> None:
+        t0 = arrivals.pop(key, None)
+        if t0 is not None:
+            latencies.append(time.monotonic() - t0)
+        if len(latencies) == len(stream):
+            all_done.set()
+
+    orig_single, orig_album = app.process_single, app.reupload_album
+
+    async def process_single(msg, source):
+        try:
+            await orig_single(msg, source)
+        finally:
+            done((source, "m", msg.id))
+
+    async def reupload_album(msgs, source):
+        try:
+            await orig_album(msgs, source)
+        finally:
+            done((source, "g", msgs[0].grouped_id))
+
+    app.process_single = process_single
+    app.reupload_album = reupload_album
+
+    app.scheduler.start()
+    flusher = asyncio.create_task(app.flush_state_periodically())
+    t_start = time.monotonic()
+    try:
+        for ev in stream:
+            if speed:
+                delay = t_start + ev.t / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            arrivals[ev.key] = time.monotonic()
+            await fake.dispatch(ev)
+        await asyncio.wait_for(all_done.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"!! timeout: обработано {len(latencies)} из {len(stream)}")
+    elapsed = time.monotonic() - t_start
+
+    flusher.cancel()
+    await app.scheduler.stop()
+    if app.ad_batcher:
+        await app.ad_batcher.close()
+    app.store.flush()
+    await app.ai.aclose()
+    return {"elapsed": elapsed, "latencies": latencies}
+
+
+def report(args, app, fake, server, stream, result, stage_hist, post_hist) -> dict:
+    lat = result["latencies"]
+    elapsed = result["elapsed"]
+    outcomes = {dict(k).get("result"): int(v) for k, v in metrics.posts_total.values.items()}
+    stages = {
+        stage: {
+            "count": len(values),
+            "total": round(sum(values), 3),
+            "p50_ms": round(pct(values, 50) * 1000, 2),
+            "p99_ms": round(pct(values, 99) * 1000, 2),
+        }
+        for stage, values in sorted(stage_hist.samples.items())
+    }
+    data = {
+        "events": len(stream),
+        "completed": len(lat),
+        "elapsed": round(elapsed, 3),
+        "posts_per_sec": round(len(lat) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50": round(pct(lat, 50), 3),
+        "latency_p99": round(pct(lat, 99), 3),
+        "latency_max": round(max(lat, default=0.0), 3),
+        "job_p50": round(pct(post_hist.samples[""], 50), 3),
+        "outcomes": outcomes,
+        "stages": stages,
+        "scheduler": app.scheduler.stats(),
+        "limiter": app.limiter.stats(),
+        "ai": app.ai.stats(),
+        "ad_model": app.ad_model.stats() if app.ad_model else None,
+        "ad_batcher": app.ad_batcher.stats() if app.ad_batcher else None,
+        "fake_deepseek": server.stats(),
+        "fake_telegram": fake.stats(),
+    }
+
+    print(
+        f"events {data['events']} | done {data['completed']} in {data['elapsed']:.2f} s"
+        f" | {data['posts_per_sec']:.2f} posts/s"
+        f" | e2e p50 {data['latency_p50'] * 1000:.0f} ms p99 {data['latency_p99'] * 1000:.0f} ms"
+        f" max {data['latency_max'] * 1000:.0f} ms"
+    )
+    print(f"outcomes: {outcomes}")
+    print(f"queue wait avg {data['scheduler']['wait_avg']} s, max {data['scheduler']['wait_max']} s")
+    print(f"{'stage':<12} {'count':>6} {'total s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for stage, s in stages.items():
+        print(f"{stage:<12} {s['count']:>6} {s['total']:>9.2f} {s['p50_ms']:>9.2f} {s['p99_ms']:>9.2f}")
+    if data["ad_batcher"]:
+        print(f"ad check batches: {data['ad_batcher']}")
+    if data["ad_model"]:
+        print(f"local ad model: {data['ad_model']}")
+    print(f"ai: {data['ai']['requests']} requests, fake server errors {server.errors}; telegram: {fake.stats()}")
+    return data
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=Path, help="JSONL с записанным потоком событий")
+    parser.add_argument("--record", type=Path, help="сохранить сгенерированный поток в JSONL")
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--sources", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=0, help="событий/с в синтетическом потоке (0 — все сразу)")
+    parser.add_argument("--ad-ratio", type=float, default=0.1)
+    parser.add_argument("--dup-ratio", type=float, default=0.1)
+    parser.add_argument("--speed", type=float, default=1.0, help="множитель времени проигрывания (0 — без пауз)")
+    parser.add_argument("--ai-latency", type=float, default=0.3)
+    parser.add_argument("--ai-jitter", type=float, default=0.1)
+    parser.add_argument("--ai-error-rate", type=float, default=0.0)
+    parser.add_argument("--ai-bad-json-rate", type=float, default=0.0)
+    parser.add_argument("--tg-send-latency", type=float, default=0.05)
+    parser.add_argument("--tg-rpc-latency", type=float, default=0.05)
+    parser.add_argument("--tg-download-mbps", type=float, default=20)
+    parser.add_argument("--tg-upload-mbps", type=float, default=10)
+    parser.add_argument("--download", action="store_true", help="без отправки по ссылке (скачивание/загрузка)")
+    parser.add_argument("--ai-cache", action="store_true")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", type=Path, help="записать отчёт в JSON")
+    parser.add_argument("--max-p99", type=float, help="порог e2e p99 (с) для CI")
+    parser.add_argument("--min-throughput", type=float, help="порог posts/s для CI")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    # дальше рабочий каталог меняется на временный
+    args.json = args.json.resolve() if args.json else None
+
+    rnd = random.Random(args.seed)
+    server = FakeDeepSeek(args.ai_latency, args.ai_jitter, args.ai_error_rate, args.ai_bad_json_rate, seed=args.seed)
+    base_url = server.start()
+    workdir = Path(tempfile.mkdtemp(prefix="xoster_bench_"))
+    configure_env(args, workdir, base_url)
+
+    if args.events:
+        stream = load_events(args.events)
+    else:
+        vocab = make_vocab(rnd)
+        sources = [ch.strip() for ch in os.environ["SOURCE_CHANNELS"].split(",") if ch.strip()]
+        stream = generate_events(
+            rnd, lambda: make_text(rnd, vocab), args.posts, sources, args.rate, args.ad_ratio, args.dup_ratio
+        )
+    if args.record:
+        save_events(args.record, stream)
+    os.environ["SOURCE_CHANNELS"] = ",".join(sorted({ev.source for ev in stream}))
+
+    stage_hist = metrics.REGISTRY.metrics["xoster_stage_seconds"] = SampleHistogram(
+        metrics.stage_seconds.name, metrics.stage_seconds.doc
+    )
+    post_hist = metrics.REGISTRY.metrics["xoster_post_seconds"] = SampleHistogram(
+        metrics.post_seconds.name, metrics.post_seconds.doc
+    )
+    metrics.stage_seconds, metrics.post_seconds = stage_hist, post_hist
+
+    # main.py настраивается при импорте; сессия Telethon создаётся в рабочем каталоге
+    os.chdir(workdir)
+    import main as app  # noqa: E402
+
+    fake = FakeTelegramClient(
+        send_latency=args.tg_send_latency,
+        rpc_latency=args.tg_rpc_latency,
+        download_bps=args.tg_download_mbps * 1e6,
+        upload_bps=args.tg_upload_mbps * 1e6,
+    )
+    app.client = fake
+    for ch in app.SOURCE_CHANNELS:
+        app.register_handlers_for_source(ch)
+
+    try:
+        result = asyncio.run(replay(app, fake, stream, args.speed, args.timeout))
+    finally:
+        server.stop()
+        app.dedup.close()
+        app.store.close()
+        app.log_listener.stop()
+
+    data = report(args, app, fake, server, stream, result, stage_hist, post_hist)
+    if args.json:
+        args.json.write_text(json.dumps(data, ensure_ascii=False, indent=2), "utf-8")
+
+    failed = data["completed"] < data["events"]
+    if args.max_p99 is not None and data["latency_p99"] > args.max_p99:
+        print(f"!! e2e p99 {data['latency_p99']} s > {args.max_p99} s")
+        failed = True
+    if args.min_throughput is not None and data["posts_per_sec"] < args.min_throughput:
+        print(f"!! {data['posts_per_sec']} posts/s < {args.min_throughput}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Локальные заглушки для офлайн-бенчмарка main.py:
+
+- FakeDeepSeek — HTTP-сервер с /chat/completions (задержка, ошибки);
+- FakeTelegramClient — вместо TelegramClient: хранит обработчики client.on(...)
+  и проигрывает в них события NewMessage/Album из записанного потока;
+- load_events/save_events/generate_events — поток событий в JSONL.
+
+Формат строки потока:
+    {"t": 0.25, "source": "@a", "id": 17, "text": "...", "grouped_id": null,
+     "media": [{"type": "photo", "size": 250000}]}
+t — секунды от начала записи; альбом — одно событие с grouped_id и
+несколькими media (текст у первого сообщения).
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Optional
+
+from telethon import events
+
+AD_MARKER = "промокод"
+
+
+class FakeDeepSeek:
+    """
+    Имитация DeepSeek /chat/completions в отдельном потоке.
+    Классификатор отвечает РЕКЛАМА, если в тексте есть AD_MARKER;
+    переписывание возвращает текст, обрезанный до 600 символов;
+    запросы с response_format=json_object (объединённый и пачка
+    классификации) получают JSON; с вероятностью bad_json_rate — битый,
+    для проверки отката.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.3,
+            jitter: float = 0.1,
+            error_rate: float = 0.0,
+            bad_json_rate: float = 0.0,
+            seed: int = 1,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bad_json_rate = bad_json_rate
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+        self.requests = 0
+        self.errors = 0
+
+    def _delay_and_fail(self) -> tuple[float, bool]:
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self._rnd.uniform(self.latency - self.jitter, self.latency + self.jitter))
+            fail = self._rnd.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        return delay, fail
+
+    def reply(self, payload: dict) -> str:
+        messages = payload.get("messages") or []
+        system = messages[0]["content"] if messages else ""
+        user = messages[-1]["content"] if messages else ""
+        text = user.split("\n\n", 1)[-1]
+        is_ad = AD_MARKER in text.lower()
+        if (payload.get("response_format") or {}).get("type") == "json_object":
+            with self._lock:
+                if self._rnd.random() < self.bad_json_rate:
+                    return '{"verdict": "НОВОСТЬ", "post": '
+            if '"verdicts"' in system:
+                texts = user.split("### Текст ")[1:]
+                return json.dumps({"verdicts": ["РЕКЛАМА" if AD_MARKER in t.lower() else "НОВОСТЬ" for t in texts]})
+            return json.dumps({"verdict": "РЕКЛАМА" if is_ad else "НОВОСТЬ", "post": "" if is_ad else text[:600]})
+        if "классификатор" in system:
+            return "РЕКЛАМА" if is_ad else "НОВОСТЬ"
+        return text[:600]
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                delay, fail = fake._delay_and_fail()
+                time.sleep(delay)
+                if fail:
+                    status, data = 500, {"error": {"message": "fake error"}}
+                else:
+                    content = fake.reply(json.loads(body or b"{}"))
+                    status, data = 200, {"choices": [{"message": {"role": "assistant", "content": content}}]}
+                raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._server.server_address[1]}"
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "errors": self.errors}
+
+
+@dataclass
+class ReplayEvent:
+    t: float
+    source: str
+    id: int
+    text: str = ""
+    grouped_id: Optional[int] = None
+    media: list = field(default_factory=list)
+
+    @property
+    def key(self) -> tuple:
+        return (self.source, "g", self.grouped_id) if self.grouped_id else (self.source, "m", self.id)
+
+
+def load_events(path: Path) -> list[ReplayEvent]:
+    with open(path, encoding="utf-8") as f:
+        return [ReplayEvent(**json.loads(line)) for line in f if line.strip()]
+
+
+def save_events(path: Path, stream: list[ReplayEvent]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for ev in stream:
+            f.write(json.dumps(vars(ev), ensure_ascii=False) + "\n")
+
+
+def generate_events(
+        rnd: random.Random,
+        make_text,
+        posts: int,
+        sources: list[str],
+        rate: float,
+        ad_ratio: float = 0.1,
+        dup_ratio: float = 0.1,
+) -> list[ReplayEvent]:
+    """
+    Синтетический поток: текст / фото / видео / альбом, часть постов — реклама,
+    часть — перепосты уже опубликованного из другого источника.
+    rate — событий в секунду (0 — все сразу).
+    """
+    stream: list[ReplayEvent] = []
+    published: list[str] = []
+    next_id = {source: 1 for source in sources}
+    grouped_id = 10 ** 12
+    t = 0.0
+
+    for _ in range(posts):
+        source = rnd.choice(sources)
+        if published and rnd.random() < dup_ratio:
+            text = rnd.choice(published)
+        else:
+            text = make_text()
+            if rnd.random() < ad_ratio:
+                text = f"{text} {AD_MARKER} SALE"
+            published.append(text)
+
+        kind = rnd.choices(["text", "photo", "video", "album"], weights=[50, 25, 10, 15])[0]
+        media = []
+        if kind == "photo":
+            media = [{"type": "photo", "size": rnd.randint(150_000, 400_000)}]
+        elif kind == "video":
+            media = [{"type": "video", "size": rnd.randint(2_000_000, 20_000_000)}]
+        elif kind == "album":
+            for _ in range(rnd.randint(2, 6)):
+                if rnd.random() < 0.3:
+                    media.append({"type": "video", "size": rnd.randint(2_000_000, 10_000_000)})
+                else:
+                    media.append({"type": "photo", "size": rnd.randint(150_000, 400_000)})
+
+        msg_id = next_id[source]
+        next_id[source] += max(1, len(media))
+        ev = ReplayEvent(t=round(t, 4), source=source, id=msg_id, text=text, media=media)
+        if kind == "album":
+            grouped_id += 1
+            ev.grouped_id = grouped_id
+        stream.append(ev)
+        if rate:
+            t += rnd.expovariate(rate)
+    return stream
+
+
+@dataclass
+class FakeMessage:
+    id: int
+    chat_id: Any
+    message: str = ""
+    grouped_id: Optional[int] = None
+    photo: Any = None
+    video: Any = None
+    media: Any = None
+    file: Any = None
+    noforwards: bool = False
+    chat: Any = field(default_factory=lambda: SimpleNamespace(noforwards=False))
+
+
+def event_messages(ev: ReplayEvent) -> list[FakeMessage]:
+    if not ev.media:
+        return [FakeMessage(id=ev.id, chat_id=ev.source, message=ev.text)]
+    msgs = []
+    for i, item in enumerate(ev.media):
+        media = SimpleNamespace(kind=item["type"], size=item["size"])
+        msgs.append(FakeMessage(
+            id=ev.id + i,
+            chat_id=ev.source,
+            message=ev.text if i == 0 else "",
+            grouped_id=ev.grouped_id,
+            photo=media if item["type"] == "photo" else None,
+            video=media if item["type"] == "video" else None,
+            media=media,
+            file=SimpleNamespace(size=item["size"], ext=".mp4" if item["type"] == "video" else ".jpg"),
+        ))
+    return msgs
+
+
+class FakeTelegramClient:
+    """
+    Подменяет TelegramClient в main: обработчики из client.on(...) вызываются
+    напрямую, сетевые вызовы — asyncio.sleep по заданной задержке и скорости канала.
+    """
+
+    def __init__(
+            self,
+            send_latency: float = 0.05,
+            rpc_latency: float = 0.05,
+            download_bps: float = 20e6,
+            upload_bps: float = 10e6,
+    ):
+        self.send_latency = send_latency
+        self.rpc_latency = rpc_latency
+        self.download_bps = download_bps
+        self.upload_bps = upload_bps
+
+        self.handlers: list[tuple[Any, Any]] = []
+        self.messages: dict[tuple, FakeMessage] = {}
+        self._next_id = 1
+
+        self.sent = 0
+        self.downloaded = 0
+        self.uploaded = 0
+
+    def on(self, builder):
+        def decorator(callback):
+            self.handlers.append((builder, callback))
+            return callback
+        return decorator
+
+    @staticmethod
+    def _matches(builder, source: str) -> bool:
+        chats = getattr(builder, "chats", None)
+        if chats is None:
+            return True
+        if isinstance(chats, str):
+            chats = [chats]
+        return source in chats
+
+    async def dispatch(self, ev: ReplayEvent) -> None:
+        """Как Telethon: NewMessage приходит на каждое сообщение, Album — на группу целиком."""
+        msgs = event_messages(ev)
+        for m in msgs:
+            self.messages[(ev.source, m.id)] = m
+        for builder, callback in self.handlers:
+            if not self._matches(builder, ev.source):
+                continue
+            if isinstance(builder, (events.MessageEdited, events.MessageDeleted)):
+                continue  # MessageEdited наследует NewMessage; в потоке только новые посты
+            if isinstance(builder, events.Album):
+                if ev.grouped_id:
+                    await callback(SimpleNamespace(messages=msgs, grouped_id=ev.grouped_id))
+            elif isinstance(builder, events.NewMessage):
+                for m in msgs:
+                    await callback(SimpleNamespace(message=m))
+
+    def _new_message(self, entity, text: str = "") -> FakeMessage:
+        msg = FakeMessage(id=self._next_id, chat_id=entity, message=text)
+        self._next_id += 1
+        self.sent += 1
+        return msg
+
+    async def send_message(self, entity, message: str = "", **kwargs):
+        await asyncio.sleep(self.send_latency)
+        return self._new_message(entity, message)
+
+    async def send_file(self, entity, file, caption: str = "", **kwargs):
+        await asyncio.sleep(self.send_latency)
+        if isinstance(file, list):
+            return [self._new_message(entity, caption if i == 0 else "") for i in range(len(file))]
+        return self._new_message(entity, caption)
+
+    async def download_media(self, message, file=".", thumb=None):
+        if thumb is not None:
+            # превью в заглушке нет — дедупликация медиа просто пропускается
+            await asyncio.sleep(self.rpc_latency)
+            return None
+        size = message.file.size if message.file else 0
+        await asyncio.sleep(self.rpc_latency + size / self.download_bps)
+        path = Path(file) / f"{message.chat_id.strip('@')}_{message.id}{message.file.ext}"
+        with open(path, "wb") as f:
+            f.truncate(size)  # разреженный файл: размер есть, диск не тратим
+        self.downloaded += size
+        return str(path)
+
+    async def upload_file(self, file):
+        size = os.path.getsize(file)
+        await asyncio.sleep(self.rpc_latency + size / self.upload_bps)
+        self.uploaded += size
+        return SimpleNamespace(name=Path(file).name, size=size)
+
+    async def get_messages(self, chat, ids: list[int]):
+        await asyncio.sleep(self.rpc_latency)
+        return [self.messages.get((chat, i)) for i in ids]
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "downloaded": self.downloaded, "uploaded": self.uploaded}
@@ -0,0 +1,183 @@
+"""
+Координатор шардов: запускает SHARD_COUNT процессов main.py, каждому —
+SHARD_INDEX; источники делятся между ними консистентным хэшированием
+(sharding.HashRing), состояние и дедупликация — общие (SQLite).
+
+    SHARD_COUNT=3 python coordinator.py
+
+Каждый шард работает со своей сессией Telethon (TG_SESSION_shardN): перед
+первым запуском войдите в неё один раз, например
+SHARD_COUNT=3 SHARD_INDEX=0 python main.py.
+
+Координатор следит за шардами: упавший процесс перезапускается с
+нарастающей паузой, процесс без пульса в базе дольше
+COORD_HEARTBEAT_TIMEOUT — останавливается и перезапускается. Пока шард
+стартует (подключение, резолв каналов), ему даётся COORD_STARTUP_GRACE. Список
+SOURCE_CHANNELS перечитывается из .env: при добавлении/удалении каналов
+перезапускаются только шарды, чьи источники изменились (новые каналы
+догоняются по отметкам, как после простоя).
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from dotenv import dotenv_values, load_dotenv
+
+from sharding import HashRing
+from storage import read_heartbeats
+
+load_dotenv()
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "2"))
+STATE_DB_FILE = Path(os.getenv("STATE_DB_FILE", "./mirror_state.sqlite3"))
+COORD_CHECK_INTERVAL = float(os.getenv("COORD_CHECK_INTERVAL", "10"))
+COORD_HEARTBEAT_TIMEOUT = float(os.getenv("COORD_HEARTBEAT_TIMEOUT", "90"))
+COORD_STARTUP_GRACE = float(os.getenv("COORD_STARTUP_GRACE", "600"))
+COORD_RESTART_BACKOFF_MAX = float(os.getenv("COORD_RESTART_BACKOFF_MAX", "300"))
+COORD_STOP_TIMEOUT = float(os.getenv("COORD_STOP_TIMEOUT", "30"))
+ENV_FILE = Path(os.getenv("COORD_ENV_FILE", ".env"))
+MAIN_SCRIPT = Path(__file__).resolve().with_name("main.py")
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger("xoster.coordinator")
+
+
+def read_sources() -> list[str]:
+    raw = os.getenv("SOURCE_CHANNELS", "")
+    if ENV_FILE.exists():
+        raw = dotenv_values(ENV_FILE).get("SOURCE_CHANNELS") or raw
+    return [ch.strip() for ch in raw.split(",") if ch.strip()]
+
+
+class Shard:
+    def __init__(self, index: int):
+        self.index = index
+        self.sources: list[str] = []
+        self.proc: subprocess.Popen | None = None
+        self.started = 0.0
+        self.grace_until = 0.0  # до этого момента шард считается стартующим
+        self.restarts = 0
+        self.next_start = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self, all_sources: list[str]) -> None:
+        env = {
+            **os.environ,
+            "SHARD_COUNT": str(SHARD_COUNT),
+            "SHARD_INDEX": str(self.index),
+            # полный список: шард сам выбирает свои источники тем же кольцом
+            "SOURCE_CHANNELS": ",".join(all_sources),
+        }
+        self.proc = subprocess.Popen([sys.executable, str(MAIN_SCRIPT)], env=env)
+        self.started = time.time()
+        self.grace_until = self.started + COORD_STARTUP_GRACE
+        log.info(f"▶️ Шард {self.index} запущен (pid {self.proc.pid}): {', '.join(self.sources)}")
+
+    def stop(self) -> None:
+        if not self.running:
+            self.proc = None
+            return
+        # SIGINT — штатная остановка main.py: состояние сбрасывается в finally
+        self.proc.send_signal(signal.SIGINT)
+        try:
+            self.proc.wait(COORD_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            log.warning(f"⚠️ Шард {self.index} не остановился за {COORD_STOP_TIMEOUT:.0f}s, убиваем")
+            self.proc.kill()
+            self.proc.wait()
+        log.info(f"⏹ Шард {self.index} остановлен")
+        self.proc = None
+
+
+def schedule_restart(shard: Shard, now: float) -> float:
+    """Пауза перезапуска нарастает с числом перезапусков подряд."""
+    shard.restarts += 1
+    delay = min(COORD_RESTART_BACKOFF_MAX, 5 * 2 ** min(shard.restarts - 1, 10))
+    shard.next_start = now + delay
+    return delay
+
+
+def check(shards: list[Shard], sources: list[str]) -> None:
+    now = time.time()
+    beats = read_heartbeats(STATE_DB_FILE)
+    for shard in shards:
+        if not shard.sources:
+            continue
+        if shard.proc is not None and not shard.running:
+            code = shard.proc.returncode
+            shard.proc = None
+            delay = schedule_restart(shard, now)
+            log.warning(f"⚠️ Шард {shard.index} завершился с кодом {code}, перезапуск через {delay:.0f}s")
+        elif shard.running and now - shard.started > COORD_HEARTBEAT_TIMEOUT:
+            beat = beats.get(shard.index, {})
+            if beat.get("pid") != shard.proc.pid or beat.get("phase") == "starting":
+                # ещё подключается и резолвит каналы: ждём до конца льготного срока
+                expired = now > shard.grace_until
+            else:
+                expired = now - beat.get("ts", 0) > COORD_HEARTBEAT_TIMEOUT
+            if expired:
+                shard.stop()
+                delay = schedule_restart(shard, now)
+                log.warning(f"⚠️ Шард {shard.index} без пульса, перезапуск через {delay:.0f}s")
+            elif now - shard.started > 10 * COORD_HEARTBEAT_TIMEOUT:
+                shard.restarts = 0  # долго живёт — пауза перезапуска снова минимальная
+
+        if shard.proc is None and now >= shard.next_start:
+            shard.start(sources)
+
+
+def rebalance(shards: list[Shard], sources: list[str]) -> None:
+    assignment = HashRing(SHARD_COUNT).assign(sources)
+    for shard in shards:
+        new = assignment[shard.index]
+        if new == shard.sources:
+            continue
+        log.info(f"🔀 Шард {shard.index}: {', '.join(shard.sources) or '-'} -> {', '.join(new) or '-'}")
+        shard.stop()
+        shard.sources = new
+        shard.next_start = 0.0
+
+
+def main() -> None:
+    if SHARD_COUNT < 2:
+        raise RuntimeError("SHARD_COUNT должен быть >= 2 (один процесс — просто python main.py)")
+
+    shards = [Shard(i) for i in range(SHARD_COUNT)]
+    stopping = False
+
+    def on_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    sources: list[str] = []
+    log.info(f"🚀 Координатор: {SHARD_COUNT} шардов, состояние {STATE_DB_FILE}")
+    while not stopping:
+        current = read_sources()
+        if current != sources:
+            sources = current
+            rebalance(shards, sources)
+        check(shards, sources)
+
+        deadline = time.monotonic() + COORD_CHECK_INTERVAL
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(0.5)
+
+    log.info("🛑 Останавливаем шарды")
+    for shard in shards:
+        shard.stop()
+    for shard in shards:
+        log.info(f"📊 Шард {shard.index}: {len(shard.sources)} источников, перезапусков {shard.restarts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+import bisect
+import hashlib
+import logging
+import math
+import operator
+import os
+import struct
+import time
+from array import array
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Iterable, Optional
+
+log = logging.getLogger(__name__)
+
+_MAX_HASH = (1 << 32) - 1
+_MAGIC = b"XDIX"
+_VERSION = 2
+
+
+def get_trigrams(text: str) -> set:
+    text = text.lower().replace(" ", "")
+    if len(text) < 3:
+        return set()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def calculate_similarity(text1: str, text2: str) -> float:
+    trigrams1 = get_trigrams(text1)
+    trigrams2 = get_trigrams(text2)
+    if not trigrams1 or not trigrams2:
+        return 0.0
+    inter = len(trigrams1 & trigrams2)
+    union = len(trigrams1 | trigrams2)
+    return inter / union if union > 0 else 0.0
+
+
+def _integrate(f, a: float, b: float, steps: int = 100) -> float:
+    h = (b - a) / steps
+    return sum(f(a + (i + 0.5) * h) for i in range(steps)) * h
+
+
+def optimal_bands(threshold: float, num_perm: int, fn_weight: float = 1.0) -> tuple[int, int]:
+    """
+    Подбор (bands, rows) для LSH: минимизируем взвешенную сумму вероятностей
+    ложноположительных и ложноотрицательных кандидатов вокруг threshold.
+    Если кандидаты потом проверяются точно, ложноположительный стоит только
+    времени, а пропущенный — дубликата: тогда fn_weight > 1.
+    """
+    best = None
+    for b in range(1, num_perm + 1):
+        r = num_perm // b
+        fp = _integrate(lambda s: 1 - (1 - s ** r) ** b, 0.0, threshold)
+        fn = _integrate(lambda s: (1 - s ** r) ** b, threshold, 1.0)
+        err = fp + fn_weight * fn
+        if best is None or err < best[0]:
+            best = (err, b, r)
+    return best[1], best[2]
+
+
+class _Band:
+    """
+    Один LSH-бэнд: отсортированные массивы (ключ, id) + небольшой буфер
+    свежих вставок. Буфер периодически вливается в массивы, заодно
+    выбрасываются id, уже вытесненные из индекса.
+    """
+
+    __slots__ = ("keys", "ids", "recent")
+
+    def __init__(self):
+        self.keys = array("q")
+        self.ids = array("q")
+        self.recent: dict[int, list[int]] = {}
+
+    def add(self, key: int, entry_id: int) -> None:
+        self.recent.setdefault(key, []).append(entry_id)
+
+    def get(self, key: int) -> Iterable[int]:
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        yield from self.ids[lo:hi]
+        yield from self.recent.get(key, ())
+
+    def merge(self, alive) -> None:
+        pairs = [(k, i) for k, i in zip(self.keys, self.ids) if i in alive]
+        for k, ids in self.recent.items():
+            pairs.extend((k, i) for i in ids if i in alive)
+        pairs.sort()
+        self.keys = array("q", (k for k, _ in pairs))
+        self.ids = array("q", (i for _, i in pairs))
+        self.recent = {}
+
+
+class DedupFileStore:
+    """
+    Хранилище подписей в бинарном файле: заголовок + записи (id, ts, число
+    шинглов, подпись, хэши шинглов). Запись — только дописыванием в конец.
+    Файл версии 1 (записи без шинглов) читается и сразу переписывается.
+    """
+
+    def __init__(self, path: Path, num_perm: int, seed: int):
+        self.path = Path(path)
+        self.num_perm = num_perm
+        self.seed = seed
+        self.records = 0
+        self._rec = struct.Struct(f"<qdI{num_perm}I")
+        self._fh = None
+
+    def _header(self, version: int = _VERSION) -> bytes:
+        return _MAGIC + struct.pack("<HHQ", version, self.num_perm, self.seed)
+
+    def _pack(self, entry_id: int, ts: float, sig: array, shingles: Optional[array]) -> bytes:
+        shingles = shingles if shingles is not None else array("I")
+        return self._rec.pack(entry_id, ts, len(shingles), *sig) + shingles.tobytes()
+
+    def load(self, limit: int) -> list[tuple[int, float, array, Optional[array]]]:
+        header = self._header()
+        if not self.path.exists():
+            self.path.write_bytes(header)
+            return []
+        data = self.path.read_bytes()
+        if data[:len(header)] == self._header(version=1):
+            return self._load_v1(memoryview(data)[len(header):], limit)
+        if data[:len(header)] != header:
+            log.warning(f"⚠️ Индекс дедупликации {self.path} несовместим с текущими параметрами, создаём заново")
+            self.path.write_bytes(header)
+            return []
+        body = memoryview(data)[len(header):]
+        entries = deque(maxlen=limit)
+        offset = 0
+        self.records = 0
+        while offset + self._rec.size <= len(body):
+            entry_id, ts, count, *values = self._rec.unpack_from(body, offset)
+            offset += self._rec.size
+            end = offset + 4 * count
+            if end > len(body):
+                break  # недописанная запись
+            shingles = array("I")
+            shingles.frombytes(body[offset:end])
+            offset = end
+            entries.append((entry_id, ts, array("I", values), shingles or None))
+            self.records += 1
+        return list(entries)
+
+    def _load_v1(self, body: memoryview, limit: int) -> list[tuple[int, float, array, Optional[array]]]:
+        rec = struct.Struct(f"<qd{self.num_perm}I")
+        total = len(body) // rec.size
+        entries = []
+        for i in range(max(0, total - limit), total):
+            entry_id, ts, *values = rec.unpack_from(body, i * rec.size)
+            entries.append((entry_id, ts, array("I", values), None))
+        self.compact(entries)
+        log.info(f"🔁 Индекс дедупликации {self.path} переведён на формат с шинглами ({len(entries)} подписей)")
+        return entries
+
+    def append(self, entry_id: int, ts: float, sig: array, shingles: Optional[array] = None) -> None:
+        if self._fh is None:
+            self._fh = open(self.path, "ab")
+        self._fh.write(self._pack(entry_id, ts, sig, shingles))
+        self._fh.flush()
+        self.records += 1
+
+    def compact(self, entries: Iterable[tuple[int, float, array, Optional[array]]]) -> None:
+        """Переписываем файл только живыми записями (атомарно через tmp)."""
+        self.close()
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        count = 0
+        with open(tmp, "wb") as f:
+            f.write(self._header())
+            for entry_id, ts, sig, shingles in entries:
+                f.write(self._pack(entry_id, ts, sig, shingles))
+                count += 1
+        os.replace(tmp, self.path)
+        self.records = count
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class DedupIndex:
+    """
+    Индекс почти-дубликатов: MinHash-подпись по тем же триграммам, что и
+    calculate_similarity (one permutation hashing с уплотнением пустых
+    корзин — один хэш на триграмму вместо num_perm), + LSH-бэнды. Поиск — O(bands) обращений к бэндам,
+    отбор кандидатов по оценке Жаккара из подписей и точная проверка
+    лучших из них по сохранённым 32-битным хэшам триграмм —
+    вместо построения множеств для всей истории.
+    Память ограничена capacity записями (старые вытесняются).
+    Подписи и хэши триграмм дописываются в store (файл или таблица
+    бэкенда состояния) и переживают рестарт.
+    """
+
+    def __init__(
+            self,
+            threshold: float,
+            capacity: int,
+            num_perm: int = 128,
+            store=None,
+            seed: int = 1,
+            max_candidates: int = 256,
+    ):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.num_perm = num_perm
+        self.store = store
+        self.seed = seed
+        self.max_candidates = max_candidates
+        # кандидаты проверяются точно: пропуск дубликата дороже лишней проверки
+        self.bands, self.rows = optimal_bands(threshold, num_perm, fn_weight=4.0)
+        # запас на шум оценки: 3 сигмы биномиального разброса на пороге
+        self.margin = 3 * math.sqrt(threshold * (1 - threshold) / num_perm)
+
+        self._salt = seed.to_bytes(8, "little")
+
+        self._sigs: OrderedDict[int, tuple[float, array, Optional[array]]] = OrderedDict()
+        self._bands = [_Band() for _ in range(self.bands)]
+        self._pending = 0
+        self._next_id = 1
+
+        self.exact_checks = 0
+
+        if self.store is not None:
+            for entry_id, ts, sig, shingles in self.store.load(capacity):
+                if len(sig) == num_perm:
+                    self._insert(sig, ts, shingles, entry_id)
+            self.compact_memory()
+            self._maybe_compact_store()
+
+    # --- подписи ---
+
+    def _shingles(self, text: str) -> list[int]:
+        return [
+            int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8, salt=self._salt).digest(), "little")
+            for t in get_trigrams(text)
+        ]
+
+    def fingerprint(self, text: str) -> tuple[Optional[array], Optional[array]]:
+        """
+        (MinHash-подпись, отсортированные 32-битные хэши триграмм) или
+        (None, None) для текста короче триграммы.
+        """
+        shingles = self._shingles(text)
+        if not shingles:
+            return None, None
+        k = self.num_perm
+        empty = _MAX_HASH + 1
+        bins = [empty] * k
+        for h in shingles:
+            b = h % k
+            v = (h // k) & _MAX_HASH
+            if v < bins[b]:
+                bins[b] = v
+        # пустые корзины берут значение ближайшей непустой справа (со сдвигом по расстоянию)
+        if empty in bins:
+            filled = [i for i in range(k) if bins[i] != empty]
+            for i in range(k):
+                if bins[i] == empty:
+                    j = filled[bisect.bisect_left(filled, i) % len(filled)]
+                    bins[i] = (bins[j] + (j - i) % k * 0x9E3779B1) & _MAX_HASH
+        # старшие биты для точной проверки: младшие уже разложены по корзинам
+        return array("I", bins), array("I", sorted({h >> 32 for h in shingles}))
+
+    def signature(self, text: str) -> Optional[array]:
+        return self.fingerprint(text)[0]
+
+    def _band_keys(self, sig: array) -> list[int]:
+        r = self.rows
+        return [hash(tuple(sig[i * r:(i + 1) * r])) for i in range(self.bands)]
+
+    @staticmethod
+    def estimate(sig1: array, sig2: array) -> float:
+        return sum(map(operator.eq, sig1, sig2)) / len(sig1)
+
+    @staticmethod
+    def jaccard(shingles: set, other: array) -> float:
+        inter = len(shingles.intersection(other))
+        union = len(shingles) + len(other) - inter
+        return inter / union if union else 0.0
+
+    # --- поиск / вставка ---
+
+    def query(self, text: str) -> float:
+        """
+        Максимальное сходство с историей, если оно превышает threshold, иначе 0.0.
+        LSH-кандидаты ранжируются по оценке Жаккара из подписей; те, чья
+        оценка не ниже порога за вычетом margin, проверяются точным Жаккаром
+        по хэшам триграмм (не больше max_candidates лучших — время поиска не
+        растёт вместе с фоновым сходством на большой истории). Максимум
+        шумных оценок по многим кандидатам иначе переваливал бы порог на
+        несвязанных текстах. Записи без хэшей (из старого формата)
+        решаются по оценке.
+        """
+        sig, shingles = self.fingerprint(text)
+        if sig is None:
+            return 0.0
+        candidates = set()
+        for band, key in zip(self._bands, self._band_keys(sig)):
+            candidates.update(band.get(key))
+        cutoff = self.threshold - self.margin
+        scored = []
+        for entry_id in candidates:
+            entry = self._sigs.get(entry_id)
+            if entry is None:
+                continue
+            est = self.estimate(sig, entry[1])
+            if est > cutoff:
+                scored.append((est, entry_id))
+        scored.sort(reverse=True)
+
+        query_set = set(shingles)
+        best = 0.0
+        for sim, entry_id in scored[:self.max_candidates]:
+            entry = self._sigs[entry_id]
+            if entry[2] is not None:
+                self.exact_checks += 1
+                sim = self.jaccard(query_set, entry[2])
+            if sim > best:
+                best = sim
+        return best if best > self.threshold else 0.0
+
+    def add(self, text: str, ts: Optional[float] = None) -> Optional[int]:
+        sig, shingles = self.fingerprint(text)
+        if sig is None:
+            return None
+        ts = ts or time.time()
+        entry_id = self._insert(sig, ts, shingles)
+        if self.store is not None:
+            self.store.append(entry_id, ts, sig, shingles)
+            self._maybe_compact_store()
+        return entry_id
+
+    def _insert(self, sig: array, ts: float, shingles: Optional[array], entry_id: Optional[int] = None) -> int:
+        if entry_id is None:
+            entry_id = self._next_id
+        self._next_id = max(self._next_id, entry_id + 1)
+        self._sigs[entry_id] = (ts, sig, shingles)
+        for band, key in zip(self._bands, self._band_keys(sig)):
+            band.add(key, entry_id)
+
+        while len(self._sigs) > self.capacity:
+            self._sigs.popitem(last=False)
+
+        # буфер вливаем пропорционально размеру индекса: амортизированно O(1)
+        self._pending += 1
+        if self._pending >= max(1024, len(self._sigs) // 8):
+            self.compact_memory()
+        return entry_id
+
+    def sync(self) -> int:
+        """
+        Подтягивает подписи, дописанные в общий store другими процессами
+        (шардами). Вызывать под store.exclusive(), тогда и следующий id
+        после sync() ни с кем не пересечётся.
+        """
+        load_since = getattr(self.store, "load_since", None)
+        if load_since is None:
+            return 0
+        entries = load_since(self._next_id)
+        for entry_id, ts, sig, shingles in entries:
+            if len(sig) == self.num_perm:
+                self._insert(sig, ts, shingles, entry_id)
+        return len(entries)
+
+    def compact_memory(self) -> None:
+        for band in self._bands:
+            band.merge(self._sigs)
+        self._pending = 0
+
+    def __len__(self) -> int:
+        return len(self._sigs)
+
+    # --- персистентность ---
+
+    def _maybe_compact_store(self) -> None:
+        if self.store is not None and self.store.records > 2 * self.capacity:
+            self.store.compact((entry_id, *entry) for entry_id, entry in self._sigs.items())
+
+    def close(self) -> None:
+        if self.store is not None:
+            self.store.close()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._sigs),
+            "capacity": self.capacity,
+            "num_perm": self.num_perm,
+            "bands": self.bands,
+            "rows": self.rows,
+            "exact_checks": self.exact_checks,
+        }
@@ -1,21 +1,41 @@
 import os
 import re
 import json
-import shutil
-import subprocess
+import time
+import asyncio
+import contextlib
+import logging
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Optional
 
 from dotenv import load_dotenv
-from telethon import TelegramClient, events, functions
+from telethon import TelegramClient, errors, events
 from telethon.tl.types import (
     MessageEntityCustomEmoji,
     MessageEntityTextUrl,
-    MessageMediaDocument,
     DocumentAttributeVideo,
 )
-import httpx
 
+from ad_classifier import AdClassifier
+from ai_cache import AICache, prompt_version
+from ai_client import AIClient, backoff_delay
+from backfill import WatermarkTracker, fetch_missed
+from batcher import Debouncer, MicroBatcher
+from dedup_index import DedupIndex
+import metrics
+from media import MediaOptimizer, MediaPreparer, VideoMeta, has_ffmpeg
+from media_dedup import HASH_SIZE, MediaHashIndex, dhash, is_flat, phash
+from media_store import CachedMedia, MediaStore, file_digest
+from mirror_index import Mapping, MirrorIndex, text_hash
+from peer_cache import PeerCache
+from scheduler import FairScheduler
+from send_limiter import SendLimiter, flood_retry
+from sharding import HashRing
+from speculation import Speculation
+from storage import finish_migration, migrate_json, open_backend
+
+BOOT_T0 = time.monotonic()
 load_dotenv()
 
 # .env base
@@ -29,54 +49,323 @@ TARGET_CHANNEL_ID = int(os.getenv("TARGET_CHANNEL_ID", "0"))
 WORKDIR = Path(os.getenv("WORKDIR", "./_mirror_tmp"))
 MAP_FILE = Path(os.getenv("MAP_FILE", "./mirror_map.json"))
 
+# state backend: sqlite (по умолчанию) или json (старый mirror_map.json)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").strip().lower()
+STATE_DB_FILE = Path(os.getenv("STATE_DB_FILE", "./mirror_state.sqlite3"))
+STATE_BATCH_SIZE = int(os.getenv("STATE_BATCH_SIZE", "50"))
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "2"))
+STATE_RETENTION_DAYS = float(os.getenv("STATE_RETENTION_DAYS", "0"))
+
 # footer: clickable TITLE -> LINK
 TARGET_TITLE = os.getenv("TARGET_TITLE", "").strip()
 TARGET_LINK = os.getenv("TARGET_LINK", "").strip()
 
+# несколько целевых каналов: "id|title|link|@src1 @src2; id2|title2|link2|"
+# (пустые title/link — без подписи, пустой список источников — все источники);
+# не задано — один канал TARGET_CHANNEL_ID с TARGET_TITLE/TARGET_LINK
+TARGETS_RAW = os.getenv("TARGETS", "").strip()
+
 # DeepSeek
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
 DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 
+# AI http pool
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "10"))
+AI_MAX_KEEPALIVE = int(os.getenv("AI_MAX_KEEPALIVE", "10"))
+AI_KEEPALIVE_EXPIRY = float(os.getenv("AI_KEEPALIVE_EXPIRY", "60"))
+AI_MAX_IN_FLIGHT = int(os.getenv("AI_MAX_IN_FLIGHT", "4"))
+AI_HTTP2 = os.getenv("AI_HTTP2", "0").strip().lower() in ("1", "true", "yes")
+
+# AI resilience: повторы с backoff, circuit breaker, hedged-запросы, запасная модель
+AI_RETRIES = int(os.getenv("AI_RETRIES", "2"))
+AI_BACKOFF_BASE = float(os.getenv("AI_BACKOFF_BASE", "0.5"))
+AI_BACKOFF_MAX = float(os.getenv("AI_BACKOFF_MAX", "8"))
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_RESET = float(os.getenv("AI_BREAKER_RESET", "30"))
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "0"))  # 0 — без hedged-запросов, например 95
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "0.5"))
+AI_FALLBACK_MODEL = os.getenv("AI_FALLBACK_MODEL", "").strip()
+
+# AI cache
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+AI_CACHE_FILE = Path(os.getenv("AI_CACHE_FILE", "./ai_cache.sqlite3"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", str(7 * 24 * 3600)))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "50000"))
+
+# один запрос на классификацию и переписывание (JSON), при ошибке разбора — два запроса
+AI_COMBINED = os.getenv("AI_COMBINED", "0").strip().lower() in ("1", "true", "yes")
+
+# спекулятивно: после локальной проверки дубликата проверка рекламы, переписывание и
+# скачивание медиа идут одновременно (меньше задержка, но лишние запросы на отклонённых постах)
+SPECULATIVE_PIPELINE = os.getenv("SPECULATIVE_PIPELINE", "0").strip().lower() in ("1", "true", "yes")
+
+# батчинг проверки рекламы: до AD_BATCH_SIZE текстов за окно AD_BATCH_DELAY_MS (1 — выключено)
+AD_BATCH_SIZE = int(os.getenv("AD_BATCH_SIZE", "1"))
+AD_BATCH_DELAY_MS = float(os.getenv("AD_BATCH_DELAY_MS", "30"))
+
+# локальный предклассификатор рекламы (учится на вердиктах DeepSeek)
+AD_LOCAL_ENABLED = os.getenv("AD_LOCAL_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+AD_LOCAL_MODEL_FILE = Path(os.getenv("AD_LOCAL_MODEL_FILE", "./ad_model.bin"))
+AD_LOCAL_CONFIDENCE = float(os.getenv("AD_LOCAL_CONFIDENCE", "0.95"))
+AD_LOCAL_MIN_SAMPLES = int(os.getenv("AD_LOCAL_MIN_SAMPLES", "200"))
+AD_LOCAL_AUDIT_RATE = float(os.getenv("AD_LOCAL_AUDIT_RATE", "0.05"))
+AD_LOCAL_SAVE_INTERVAL = float(os.getenv("AD_LOCAL_SAVE_INTERVAL", "60"))  # секунд между записями весов на диск
+
 # dedup
 TRIGRAM_THRESHOLD = float(os.getenv("TRIGRAM_THRESHOLD", "0.15"))
 DEDUP_HISTORY_SIZE = int(os.getenv("DEDUP_HISTORY_SIZE", "100"))
+DEDUP_INDEX_FILE = Path(os.getenv("DEDUP_INDEX_FILE", "./dedup_index.bin"))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "128"))
+DEDUP_SEED = 1
+
+# дедупликация фото/видео по перцептивным хэшам превью (нужен ffmpeg)
+MEDIA_DEDUP_ENABLED = os.getenv("MEDIA_DEDUP_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+MEDIA_DEDUP_DISTANCE = int(os.getenv("MEDIA_DEDUP_DISTANCE", "8"))
+MEDIA_DEDUP_HISTORY = int(os.getenv("MEDIA_DEDUP_HISTORY", "5000"))
+
+# media (ffmpeg)
+MEDIA_CONCURRENCY = int(os.getenv("MEDIA_CONCURRENCY", "2"))
+MEDIA_PROBE_TIMEOUT = float(os.getenv("MEDIA_PROBE_TIMEOUT", "10"))
+MEDIA_THUMB_TIMEOUT = float(os.getenv("MEDIA_THUMB_TIMEOUT", "15"))
+
+# оптимизация медиа перед загрузкой (только при скачивании; нужен ffmpeg)
+MEDIA_OPTIMIZE = os.getenv("MEDIA_OPTIMIZE", "0").strip().lower() in ("1", "true", "yes")
+MEDIA_OPTIMIZE_CONCURRENCY = int(os.getenv("MEDIA_OPTIMIZE_CONCURRENCY", "1"))
+MEDIA_OPTIMIZE_TIMEOUT = float(os.getenv("MEDIA_OPTIMIZE_TIMEOUT", "900"))
+VIDEO_FASTSTART = os.getenv("VIDEO_FASTSTART", "1").strip().lower() in ("1", "true", "yes")
+VIDEO_REENCODE_ABOVE_MB = float(os.getenv("VIDEO_REENCODE_ABOVE_MB", "50"))
+VIDEO_MAX_HEIGHT = int(os.getenv("VIDEO_MAX_HEIGHT", "1080"))
+VIDEO_CRF = int(os.getenv("VIDEO_CRF", "26"))
+VIDEO_PRESET = os.getenv("VIDEO_PRESET", "veryfast").strip()
+PHOTO_RECOMPRESS_ABOVE_MB = float(os.getenv("PHOTO_RECOMPRESS_ABOVE_MB", "1"))
+PHOTO_MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE", "2560"))
+PHOTO_JPEG_QSCALE = int(os.getenv("PHOTO_JPEG_QSCALE", "4"))
+
+# кэш медиа в WORKDIR/cache: повторное медиа (тот же id или тот же файл) не качается и не готовится заново
+MEDIA_CACHE_MAX_MB = float(os.getenv("MEDIA_CACHE_MAX_MB", "2048"))  # 0 — файлы удаляются сразу после отправки
+
+# догон постов, пропущенных за время простоя (по отметке последнего id источника)
+BACKFILL_ENABLED = os.getenv("BACKFILL_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+BACKFILL_MAX_AGE_HOURS = float(os.getenv("BACKFILL_MAX_AGE_HOURS", "24"))  # 0 — без ограничения
+BACKFILL_MAX_MESSAGES = int(os.getenv("BACKFILL_MAX_MESSAGES", "300"))  # на источник
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "2"))  # источников одновременно
+BACKFILL_REQUEST_INTERVAL = float(os.getenv("BACKFILL_REQUEST_INTERVAL", "1"))  # пауза между запросами истории
+BACKFILL_RETRIES = int(os.getenv("BACKFILL_RETRIES", "3"))  # повторы чтения истории после ошибки
+
+# правки и удаления в источнике повторяются в целевых каналах
+MIRROR_EDITS = os.getenv("MIRROR_EDITS", "1").strip().lower() in ("1", "true", "yes")
+MIRROR_DELETES = os.getenv("MIRROR_DELETES", "1").strip().lower() in ("1", "true", "yes")
+EDIT_DEBOUNCE_SECONDS = float(os.getenv("EDIT_DEBOUNCE_SECONDS", "3"))  # серия правок -> одна
+
+# album pipeline
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "4"))
+ALBUM_DOWNLOAD_CONCURRENCY = int(os.getenv("ALBUM_DOWNLOAD_CONCURRENCY", "3"))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "3"))
+
+# scheduler
+SCHED_WORKERS = int(os.getenv("SCHED_WORKERS", "4"))
+SCHED_QUEUE_SIZE = int(os.getenv("SCHED_QUEUE_SIZE", "50"))
+SCHED_AI_WORKERS = int(os.getenv("SCHED_AI_WORKERS", "4"))
+# веса источников для round-robin: "@chan1=3, @chan2=1" (по умолчанию у всех 1)
+SCHED_WEIGHTS = {
+    k.strip(): int(v)
+    for k, _, v in (w.partition("=") for w in os.getenv("SCHED_WEIGHTS", "").split(",") if "=" in w)
+}
+
+# send limiter (целевой канал)
+SEND_RATE = float(os.getenv("SEND_RATE", "0.5"))
+SEND_BURST = int(os.getenv("SEND_BURST", "3"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+# FloodWait короче порога Telethon проспит сам и молча; 0 — все FloodWait обрабатываем мы
+TG_FLOOD_SLEEP_THRESHOLD = int(os.getenv("TG_FLOOD_SLEEP_THRESHOLD", "0"))
+
+# кэш пиров (username/id -> id + access_hash): на старте резолвятся только новые каналы
+PEER_CACHE_FILE = Path(os.getenv("PEER_CACHE_FILE", "./peer_cache.json"))
+PEER_CACHE_TTL_DAYS = float(os.getenv("PEER_CACHE_TTL_DAYS", "30"))
+PEER_RESOLVE_CONCURRENCY = int(os.getenv("PEER_RESOLVE_CONCURRENCY", "4"))
+PEER_RESOLVE_RATE = float(os.getenv("PEER_RESOLVE_RATE", "2"))  # резолвов в секунду
+
+# отправка медиа по ссылке на файл Telegram без скачивания/загрузки
+REUPLOAD_BY_REFERENCE = os.getenv("REUPLOAD_BY_REFERENCE", "1").strip().lower() in ("1", "true", "yes")
+
+# observability
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower()
+LOG_FILE = os.getenv("LOG_FILE", "").strip() or None
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — endpoint выключен
+
+# шардирование источников по процессам (процессы запускает coordinator.py)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+TG_SESSION = os.getenv("TG_SESSION", "mirror_reupload").strip()
 
 # premium emoji
 PREMIUM_EMOJI_ID = int(os.getenv("PREMIUM_EMOJI_ID", "0")) or 5323761960829862762
 
+@dataclass
+class Target:
+    channel_id: int
+    title: str = ""
+    link: str = ""
+    sources: Optional[set[str]] = None  # None — все источники
+    key: int = 0  # ключ соответствий в хранилище: 0 у основного канала, id у остальных
+    peer: Any = None  # input peer, выставим в main()
+
+
+def parse_targets(raw: str) -> list[Target]:
+    targets = []
+    for entry in raw.split(";"):
+        if not entry.strip():
+            continue
+        channel_id, title, link, sources = (entry.split("|") + ["", "", ""])[:4]
+        chats = {ch for ch in sources.replace(",", " ").split() if ch}
+        target = Target(int(channel_id), title.strip(), link.strip(), chats or None)
+        target.key = target.channel_id if targets else 0
+        targets.append(target)
+    return targets
+
+
+TARGETS = parse_targets(TARGETS_RAW)
+if TARGETS:
+    TARGET_CHANNEL_ID = TARGETS[0].channel_id
+elif TARGET_CHANNEL_ID:
+    TARGETS = [Target(TARGET_CHANNEL_ID, TARGET_TITLE, TARGET_LINK)]
+TARGETS_BY_KEY = {target.key: target for target in TARGETS}
+
 if not API_ID or not API_HASH or not PHONE or not SOURCE_CHANNELS or not TARGET_CHANNEL_ID:
-    raise RuntimeError("Проверь .env: API_ID, API_HASH, PHONE, SOURCE_CHANNELS, TARGET_CHANNEL_ID обязательны")
+    raise RuntimeError("Проверь .env: API_ID, API_HASH, PHONE, SOURCE_CHANNELS, TARGET_CHANNEL_ID (или TARGETS) обязательны")
 
 if not DEEPSEEK_API_KEY:
     raise RuntimeError("Проверь .env: DEEPSEEK_API_KEY обязателен для AI функционала")
 
-WORKDIR.mkdir(parents=True, exist_ok=True)
-client = TelegramClient("mirror_reupload", API_ID, API_HASH)
+SHARDED = SHARD_COUNT > 1
+if SHARDED:
+    if STATE_BACKEND != "sqlite":
+        raise RuntimeError("Шардирование требует STATE_BACKEND=sqlite: состояние и дедупликация общие для всех шардов")
+    # свои источники, сессия и временные файлы; состояние, дедуп и AI-кэш — общие
+    SOURCE_CHANNELS = HashRing(SHARD_COUNT).assign(SOURCE_CHANNELS)[SHARD_INDEX]
+    TG_SESSION = f"{TG_SESSION}_shard{SHARD_INDEX}"
+    WORKDIR = WORKDIR / f"shard{SHARD_INDEX}"
+    AD_LOCAL_MODEL_FILE = AD_LOCAL_MODEL_FILE.with_name(
+        f"{AD_LOCAL_MODEL_FILE.stem}.shard{SHARD_INDEX}{AD_LOCAL_MODEL_FILE.suffix}"
+    )
+    PEER_CACHE_FILE = PEER_CACHE_FILE.with_name(f"{PEER_CACHE_FILE.stem}.shard{SHARD_INDEX}{PEER_CACHE_FILE.suffix}")
+    if LOG_FILE:
+        LOG_FILE = f"{LOG_FILE}.shard{SHARD_INDEX}"
+    if METRICS_PORT:
+        METRICS_PORT += SHARD_INDEX
+    # открытая транзакция одного шарда блокирует запись остальных — коммитим сразу
+    STATE_BATCH_SIZE = 1
+    # FloodWait считается на аккаунт: делим скорость отправки между шардами
+    SEND_RATE /= SHARD_COUNT
+    SEND_BURST = max(1, SEND_BURST // SHARD_COUNT)
+
+log_listener = metrics.setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_FILE)
+log = logging.getLogger("xoster")
+
+media_store = MediaStore(WORKDIR, max_bytes=int(MEDIA_CACHE_MAX_MB * 1024 * 1024))
+client = TelegramClient(TG_SESSION, API_ID, API_HASH, flood_sleep_threshold=TG_FLOOD_SLEEP_THRESHOLD)
+
+limiter = SendLimiter(rate=SEND_RATE, burst=SEND_BURST, max_retries=SEND_MAX_RETRIES)
+
+ai = AIClient(
+    base_url=DEEPSEEK_BASE_URL,
+    api_key=DEEPSEEK_API_KEY,
+    max_connections=AI_MAX_CONNECTIONS,
+    max_keepalive=AI_MAX_KEEPALIVE,
+    keepalive_expiry=AI_KEEPALIVE_EXPIRY,
+    max_in_flight=AI_MAX_IN_FLIGHT,
+    http2=AI_HTTP2,
+    retries=AI_RETRIES,
+    backoff_base=AI_BACKOFF_BASE,
+    backoff_max=AI_BACKOFF_MAX,
+    breaker_failures=AI_BREAKER_FAILURES,
+    breaker_reset=AI_BREAKER_RESET,
+    hedge_percentile=AI_HEDGE_PERCENTILE,
+    hedge_min_delay=AI_HEDGE_MIN_DELAY,
+    fallback_model=AI_FALLBACK_MODEL,
+)
+
+media = MediaPreparer(
+    concurrency=MEDIA_CONCURRENCY,
+    probe_timeout=MEDIA_PROBE_TIMEOUT,
+    thumb_timeout=MEDIA_THUMB_TIMEOUT,
+)
+
+optimizer = MediaOptimizer(
+    concurrency=MEDIA_OPTIMIZE_CONCURRENCY,
+    timeout=MEDIA_OPTIMIZE_TIMEOUT,
+    faststart=VIDEO_FASTSTART,
+    video_max_bytes=int(VIDEO_REENCODE_ABOVE_MB * 1024 * 1024),
+    video_max_height=VIDEO_MAX_HEIGHT,
+    crf=VIDEO_CRF,
+    preset=VIDEO_PRESET,
+    photo_max_bytes=int(PHOTO_RECOMPRESS_ABOVE_MB * 1024 * 1024),
+    photo_max_side=PHOTO_MAX_SIDE,
+    photo_qscale=PHOTO_JPEG_QSCALE,
+) if MEDIA_OPTIMIZE else None
+
+scheduler = FairScheduler(
+    workers=SCHED_WORKERS,
+    queue_size=SCHED_QUEUE_SIZE,
+    weights=SCHED_WEIGHTS,
+    stage_limits={
+        "ai": SCHED_AI_WORKERS,
+        "download": DOWNLOAD_CONCURRENCY,
+        "upload": UPLOAD_CONCURRENCY,
+    },
+)
+
+ai_cache = AICache(AI_CACHE_FILE, ttl=AI_CACHE_TTL, max_entries=AI_CACHE_MAX_ENTRIES) if AI_CACHE_ENABLED else None
+
+ad_model = AdClassifier(
+    AD_LOCAL_MODEL_FILE,
+    confidence=AD_LOCAL_CONFIDENCE,
+    min_samples=AD_LOCAL_MIN_SAMPLES,
+    audit_rate=AD_LOCAL_AUDIT_RATE,
+    save_interval=AD_LOCAL_SAVE_INTERVAL,
+) if AD_LOCAL_ENABLED else None
 
 TARGET_PEER = None  # выставим в main()
 
+peers = PeerCache(
+    PEER_CACHE_FILE,
+    ttl=PEER_CACHE_TTL_DAYS * 24 * 3600,
+    concurrency=PEER_RESOLVE_CONCURRENCY,
+    rate=PEER_RESOLVE_RATE,
+)
+# источник -> input peer (после main(); без него Telethon резолвит строку сам)
+source_peers: dict[str, Any] = {}
+startup_seconds = 0.0
+
 
-def footer_text_and_entities(base_offset: int) -> tuple[str, list]:
+def targets_for(source_channel: str) -> list[Target]:
+    """Целевые каналы источника; первый из них получает пост первым (с загрузкой файлов)."""
+    return [t for t in TARGETS if t.sources is None or source_channel in t.sources]
+
+
+def footer_text_and_entities(base_offset: int, target: Target) -> tuple[str, list]:
     """
-    Делает кликабельный TITLE, ведущий на TARGET_LINK.
+    Делает кликабельный TITLE, ведущий на LINK целевого канала.
     base_offset — смещение (offset) в общем тексте сообщения, где начинается TITLE.
     """
-    if not TARGET_TITLE or not TARGET_LINK:
+    if not target.title or not target.link:
         return "", []
 
-    ft = TARGET_TITLE
+    ft = target.title
     ents = [
         MessageEntityTextUrl(
             offset=base_offset,
             length=len(ft),
-            url=TARGET_LINK
+            url=target.link
         )
     ]
     return ft, ents
 
 
-def safe_text_for_message(text: str | None) -> tuple[str, list]:
+def safe_text_for_message(text: str | None, target: Target) -> tuple[str, list]:
     text = text or ""
 
     # Удаляем упоминания, но сохраняем текст между ними
@@ -93,9 +382,9 @@ def safe_text_for_message(text: str | None) -> tuple[str, list]:
     base = f"⚡ {safe_text}" if safe_text else "⚡"
     entities = [MessageEntityCustomEmoji(offset=0, length=1, document_id=PREMIUM_EMOJI_ID)]
 
-    if TARGET_TITLE and TARGET_LINK:
+    if target.title and target.link:
         base_with_sep = base + "\n\n"
-        ft, fent = footer_text_and_entities(base_offset=len(base_with_sep))
+        ft, fent = footer_text_and_entities(base_offset=len(base_with_sep), target=target)
         result_text = base_with_sep + ft
         entities.extend(fent)
         return result_text, entities
@@ -103,145 +392,43 @@ def safe_text_for_message(text: str | None) -> tuple[str, list]:
     return base, entities
 
 
-def safe_caption_for_media(text: str | None) -> tuple[str, list]:
+def safe_caption_for_media(text: str | None, target: Target) -> tuple[str, list]:
     # Используем ту же логику, что и для текстовых сообщений
-    return safe_text_for_message(text)
-
-
-def get_trigrams(text: str) -> set:
-    text = text.lower().replace(" ", "")
-    if len(text) < 3:
-        return set()
-    return {text[i:i + 3] for i in range(len(text) - 2)}
-
-
-def calculate_similarity(text1: str, text2: str) -> float:
-    trigrams1 = get_trigrams(text1)
-    trigrams2 = get_trigrams(text2)
-    if not trigrams1 or not trigrams2:
-        return 0.0
-    inter = len(trigrams1 & trigrams2)
-    union = len(trigrams1 | trigrams2)
-    return inter / union if union > 0 else 0.0
-
-
-def load_map() -> dict:
-    if MAP_FILE.exists():
-        return json.loads(MAP_FILE.read_text("utf-8"))
-    return {"single": {}, "album": {}, "dedup_history": []}
+    return safe_text_for_message(text, target)
 
 
-def save_map(m: dict) -> None:
-    MAP_FILE.write_text(json.dumps(m, ensure_ascii=False, indent=2), "utf-8")
-
-
-def is_duplicate(text: str, history: list) -> bool:
+def is_duplicate(text: str) -> bool:
     if not text or len(text.strip()) < 20:
         return False
-    for hist_text in history[-DEDUP_HISTORY_SIZE:]:
-        sim = calculate_similarity(text, hist_text)
-        if sim > TRIGRAM_THRESHOLD:
-            print(f"⚠️  Дубликат! Сходство: {sim:.1%}")
-            return True
+    sim = dedup.query(text)
+    if sim:
+        log.warning(f"⚠️  Дубликат! Сходство: {sim:.1%}")
+        return True
     return False
 
 
-def add_to_history(text: str, history: list) -> None:
+def add_to_history(text: str) -> None:
     if text and len(text.strip()) > 20:
-        history.append(text)
-        if len(history) > DEDUP_HISTORY_SIZE:
-            history.pop(0)
-
-
-def cleanup_media(file_path: str | Path) -> None:
-    try:
-        p = Path(file_path)
-        if p.exists():
-            p.unlink()
-            print(f"🗑️ Удалён медиа файл: {p.name}")
-    except Exception as e:
-        print(f"⚠️ Ошибка при удалении файла {file_path}: {e}")
-
-
-def cleanup_workdir() -> None:
-    try:
-        if WORKDIR.exists():
-            for p in WORKDIR.glob("*"):
-                if p.is_file():
-                    p.unlink()
-                    print(f"🗑️ Очищен файл: {p.name}")
-    except Exception as e:
-        print(f"⚠️ Ошибка при очистке директории {WORKDIR}: {e}")
-
+        dedup.add(text)
 
-def has_ffmpeg() -> bool:
-    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
 
+def shared_state():
+    """Между шардами проверка-и-запись общих индексов идёт под блокировкой базы."""
+    return store.exclusive() if SHARDED else contextlib.nullcontext()
 
-def ffprobe_meta(path: str) -> tuple[int, int, int]:
-    """
-    duration(sec), width, height
-    Если ffprobe не доступен или что-то пошло не так — вернём нули (Telegram переживёт).
-    """
-    if not shutil.which("ffprobe"):
-        return 0, 0, 0
-    try:
-        cmd = [
-            "ffprobe", "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=width,height:format=duration",
-            "-of", "json",
-            path
-        ]
-        p = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-        data = json.loads(p.stdout or "{}")
-        streams = data.get("streams") or [{}]
-        fmt = data.get("format") or {}
-        w = int(streams[0].get("width") or 0)
-        h = int(streams[0].get("height") or 0)
-        dur = int(float(fmt.get("duration") or 0))
-        return dur, w, h
-    except Exception:
-        return 0, 0, 0
-
-
-def make_thumb(video_path: str, out_jpg: Path) -> Optional[Path]:
-    """
-    Делаем JPEG-превью (1 кадр).
-    Важно: в альбомах Telethon может игнорировать thumb, поэтому для видео в альбомах мы шлём по одному.
-    """
-    if not shutil.which("ffmpeg"):
-        return None
-    try:
-        cmd = [
-            "ffmpeg", "-y",
-            "-ss", "1",
-            "-i", video_path,
-            "-frames:v", "1",
-            "-vf", "scale=320:-1",
-            str(out_jpg)
-        ]
-        subprocess.run(cmd, capture_output=True, text=True, timeout=15)
-        return out_jpg if out_jpg.exists() else None
-    except Exception:
-        return None
 
+async def check_and_remember(text: str) -> bool:
+    """Проверка на дубликат и запись в историю одной операцией (вызывать под state_lock)."""
+    async with shared_state():
+        if SHARDED:
+            dedup.sync()
+        duplicate = is_duplicate(text)
+        if not duplicate:
+            add_to_history(text)
+    return duplicate
 
-async def is_advertisement(text: str) -> bool:
-    if not text or len(text.strip()) < 20:
-        return False
 
-    try:
-        async with httpx.AsyncClient(timeout=20.0) as client_http:
-            resp = await client_http.post(
-                f"{DEEPSEEK_BASE_URL}/chat/completions",
-                headers={"Authorization": f"Bearer {DEEPSEEK_API_KEY}", "Content-Type": "application/json"},
-                json={
-                    "model": DEEPSEEK_MODEL,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": """
+AD_SYSTEM_PROMPT = """
 Вы — классификатор текстов. 
 Определите, является ли предоставленный текст рекламой или новостью, используя строгие критерии.
 
@@ -265,121 +452,595 @@ async def is_advertisement(text: str) -> bool:
 7. Если текст носит исключительно информационный, аналитический или новостной характер без коммерческих призывов и продвижения — классифицируйте как НОВОСТЬ.
 
 Формат ответа:
-Отвечайте строго одним словом, без кавычек, точек и любых других пояснений: РЕКЛАМА или НОВОСТЬ.""",
-                        },
-                        {"role": "user", "content": f"Определи, что это - реклама или новость?\n\n{text}"},
-                    ],
-                    "temperature": 0.3,
-                    "max_tokens": 20,
-                },
+Отвечайте строго одним словом, без кавычек, точек и любых других пояснений: РЕКЛАМА или НОВОСТЬ."""
+AD_PROMPT_VERSION = prompt_version(AD_SYSTEM_PROMPT)
+
+REWRITE_SYSTEM_PROMPT = """
+Вы — редактор новостного Telegram-канала.
+Ваша задача — переработать исходный текст новости в лаконичный и динамичный пост.
+
+Критерии обработки текста:
+
+1. Стиль: Только сухие факты, изложенные энергично и кратко. Без вводных слов, оценок и рассуждений.
+2. Длина: Строго не более 600 символов, включая пробелы.
+3. Содержание: Извлекается и переформулируется исключительно суть события (кто, что, когда, где, основные обстоятельства). Все второстепенные детали, цитаты, контекст и «воду» — удалить.
+4. Форматирование: Все эмодзи, смайлики, лишние переносы строк и HTML-разметку — удалить.
+5. Любые упоминания источников («канал сообщает», «пишет РИА»), рекламные приписки и названия других каналов в начале или конце текста — удалить.
+6. Выходные данные: Ваш ответ должен содержать только итоговый текст новости для поста, без пояснений, подписей или тегов.
+7. Контекст: Учитывайте актуальность на 2026 год.
+8. Правовой аспект: Если в тексте прямо упоминается организация, признанная в РФ экстремистской или террористической, либо иной запрещенный материал, после основного текста добавьте абзацем: «[Упомянутая организация/материал] запрещены на территории РФ».
+
+Ваш ответ — это готовый к публикации пост, соответствующий всем пунктам выше."""
+REWRITE_PROMPT_VERSION = prompt_version(REWRITE_SYSTEM_PROMPT)
+
+
+COMBINED_SYSTEM_PROMPT = f"""
+Вы выполняете над одним текстом две задачи: классификацию и редактуру.
+
+ЗАДАЧА 1. {AD_SYSTEM_PROMPT.split("Формат ответа:")[0].strip()}
+
+ЗАДАЧА 2. Только если текст — НОВОСТЬ. {REWRITE_SYSTEM_PROMPT.split("Ваш ответ — это")[0].strip()}
+
+Формат ответа: строго один JSON-объект без markdown и пояснений, итоговый текст
+из задачи 2 — значение поля post:
+{{"verdict": "РЕКЛАМА" или "НОВОСТЬ", "post": "готовый пост; для рекламы пустая строка"}}"""
+COMBINED_PROMPT_VERSION = prompt_version(COMBINED_SYSTEM_PROMPT)
+
+
+def known_ad_verdict(text: str) -> tuple[Optional[bool], Optional[float]]:
+    """
+    Вердикт без обращения к DeepSeek: AI-кэш, затем локальная модель.
+    (None, prob) — надо спрашивать LLM, prob потом отдаётся в remember_ad_verdict.
+    """
+    if ai_cache:
+        cached = ai_cache.get(AICache.make_key("ad", text, DEEPSEEK_MODEL, AD_PROMPT_VERSION))
+        if cached is not None:
+            log.info("🚫 Это реклама (кэш) - пропускаем" if cached else "✓ Это новость (кэш) - обрабатываем")
+            return bool(cached), None
+
+    prob = None
+    if ad_model:
+        local, prob = ad_model.decide(text)
+        if local is not None:
+            log.info(
+                f"🚫 Это реклама (локально, {prob:.0%}) - пропускаем" if local
+                else f"✓ Это новость (локально, {1 - prob:.0%}) - обрабатываем"
             )
+            return local, prob
+    return None, prob
 
-            if resp.status_code != 200:
-                print(f"⚠ Ошибка при проверке рекламы: {resp.status_code}")
-                return False
 
-            data = resp.json()
-            classification = data["choices"][0]["message"]["content"].strip().upper()
-            is_ad = "РЕКЛАМА" in classification
+def remember_ad_verdict(text: str, is_ad: bool, prob: Optional[float]) -> None:
+    if ai_cache:
+        ai_cache.put(AICache.make_key("ad", text, DEEPSEEK_MODEL, AD_PROMPT_VERSION), "ad", is_ad)
+    if ad_model:
+        ad_model.learn(text, is_ad, prob)
 
-            print("🚫 Это реклама - пропускаем" if is_ad else "✓ Это новость - обрабатываем")
-            return is_ad
 
-    except Exception as e:
-        print(f"⚠ Ошибка при обращении к API для проверки рекламы: {e}")
+AD_BATCH_SYSTEM_PROMPT = f"""
+{AD_SYSTEM_PROMPT.split("Формат ответа:")[0].strip()}
+
+Вам дан нумерованный список текстов, классифицируйте каждый независимо.
+
+Формат ответа: строго один JSON-объект без markdown и пояснений, по одному
+вердикту на каждый текст в том же порядке:
+{{"verdicts": ["РЕКЛАМА" или "НОВОСТЬ", ...]}}"""
+
+
+def parse_ad_verdicts(content: str, count: int) -> Optional[list[bool]]:
+    """Строгий разбор ответа AD_BATCH_SYSTEM_PROMPT: ровно count вердиктов, иначе None."""
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return None
+    verdicts = data.get("verdicts") if isinstance(data, dict) else None
+    if not isinstance(verdicts, list) or len(verdicts) != count:
+        return None
+    result = []
+    for verdict in verdicts:
+        verdict = verdict.strip().upper() if isinstance(verdict, str) else ""
+        if verdict not in ("РЕКЛАМА", "НОВОСТЬ"):
+            return None
+        result.append(verdict == "РЕКЛАМА")
+    return result
+
+
+async def request_ad_verdicts(texts: list[str]) -> list[Optional[bool]]:
+    """
+    Функция батчера: одна пачка — один запрос (слот стадии ai берём здесь,
+    а не у вызывающих). Ошибка разбора — исключение, вызывающие перейдут
+    на одиночные запросы.
+    """
+    async with scheduler.stage("ai"):
+        if len(texts) == 1:
+            return [await request_ad_verdict(texts[0])]
+
+        numbered = "\n\n".join(f"### Текст {i}\n{text}" for i, text in enumerate(texts, 1))
+        resp = await ai.chat(
+            {
+                "model": DEEPSEEK_MODEL,
+                "messages": [
+                    {"role": "system", "content": AD_BATCH_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"Определи для каждого текста: реклама или новость?\n\n{numbered}"},
+                ],
+                "response_format": {"type": "json_object"},
+                "temperature": 0.3,
+                "max_tokens": 20 + 10 * len(texts),
+            },
+            timeout=20.0,
+        )
+    if resp.status_code != 200:
+        raise RuntimeError(f"HTTP {resp.status_code}")
+    verdicts = parse_ad_verdicts(resp.json()["choices"][0]["message"]["content"], len(texts))
+    if verdicts is None:
+        raise ValueError("ответ не по формату")
+    log.info(f"📦 Пачка из {len(texts)} текстов классифицирована одним запросом")
+    return verdicts
+
+
+ad_batcher = MicroBatcher(request_ad_verdicts, AD_BATCH_SIZE, AD_BATCH_DELAY_MS / 1000) if AD_BATCH_SIZE > 1 else None
+
+
+def ad_check_slot():
+    """Слот стадии ai для проверки рекламы; при батчинге его берёт сама пачка."""
+    return contextlib.nullcontext() if ad_batcher else scheduler.stage("ai")
+
+
+async def is_advertisement(text: str) -> bool:
+    if not text or len(text.strip()) < 20:
         return False
 
+    known, prob = known_ad_verdict(text)
+    if known is not None:
+        return known
+    return await ask_ad_verdict(text, prob)
+
+
+async def ask_ad_verdict(text: str, prob: Optional[float]) -> bool:
+    """
+    Вердикт DeepSeek, когда known_ad_verdict его не дал; prob — уже посчитанное
+    предсказание локальной модели (повторный decide() дважды учёл бы решение
+    и заново бросил бы жребий аудита).
+    """
+    if ad_batcher:
+        try:
+            is_ad = await ad_batcher.submit(text)
+        except Exception as e:
+            log.warning(f"⚠ Пачка проверки рекламы не удалась ({e}), проверяем отдельно")
+            metrics.stage_errors.inc(stage="ad_batch")
+            async with scheduler.stage("ai"):
+                is_ad = await request_ad_verdict(text)
+    else:
+        is_ad = await request_ad_verdict(text)
+
+    if is_ad is None:
+        # DeepSeek недоступен: лучше решение обученной локальной модели, чем пропуск всего подряд
+        if ad_model and ad_model.ready and prob is not None:
+            log.warning(f"⚠ Проверка рекламы по локальной модели ({prob:.0%}), DeepSeek недоступен")
+            metrics.retries_total.inc(op="ad_local_fallback")
+            return prob >= 0.5
+        return False
+    remember_ad_verdict(text, is_ad, prob)
+    log.info("🚫 Это реклама - пропускаем" if is_ad else "✓ Это новость - обрабатываем")
+    return is_ad
+
+
+async def request_ad_verdict(text: str) -> Optional[bool]:
+    """Один запрос классификации; None — ошибка API."""
+    try:
+        resp = await ai.chat(
+            {
+                "model": DEEPSEEK_MODEL,
+                "messages": [
+                    {"role": "system", "content": AD_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"Определи, что это - реклама или новость?\n\n{text}"},
+                ],
+                "temperature": 0.3,
+                "max_tokens": 20,
+            },
+            timeout=20.0,
+        )
+
+        if resp.status_code != 200:
+            log.warning(f"⚠ Ошибка при проверке рекламы: {resp.status_code}")
+            metrics.stage_errors.inc(stage="ad_check")
+            return None
+
+        data = resp.json()
+        classification = data["choices"][0]["message"]["content"].strip().upper()
+        return "РЕКЛАМА" in classification
+
+    except Exception as e:
+        log.warning(f"⚠ Ошибка при обращении к API для проверки рекламы: {e}")
+        metrics.stage_errors.inc(stage="ad_check")
+        return None
+
 
 async def rewrite_text_with_ai(text: str, max_retries: int = 3) -> Optional[str]:
     """
     Переписывает текст с помощью AI с гарантией непустого результата.
     Делает до max_retries попыток, если API возвращает пустой текст.
+    Сетевые ошибки и 429/5xx повторяет AIClient (backoff, breaker), поэтому
+    здесь после них сразу возвращаем исходный текст.
     """
     if not text or len(text.strip()) < 10:
         return text
 
     original_text = text
 
+    cache_key = AICache.make_key("rewrite", text, DEEPSEEK_MODEL, REWRITE_PROMPT_VERSION) if ai_cache else None
+    if ai_cache:
+        cached = ai_cache.get(cache_key)
+        if cached:
+            log.info(f"✓ AI переработка из кэша ({len(original_text)} -> {len(cached)} символов)")
+            return cached
+
     for attempt in range(max_retries):
+        if attempt:
+            metrics.retries_total.inc(op="rewrite")
+            await asyncio.sleep(backoff_delay(attempt - 1, AI_BACKOFF_BASE, AI_BACKOFF_MAX))
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client_http:
-                resp = await client_http.post(
-                    f"{DEEPSEEK_BASE_URL}/chat/completions",
-                    headers={"Authorization": f"Bearer {DEEPSEEK_API_KEY}", "Content-Type": "application/json"},
-                    json={
-                        "model": DEEPSEEK_MODEL,
-                        "messages": [
-                            {
-                                "role": "system",
-                                "content": """
-Вы — редактор новостного Telegram-канала.
-Ваша задача — переработать исходный текст новости в лаконичный и динамичный пост.
+            resp = await ai.chat(
+                {
+                    "model": DEEPSEEK_MODEL,
+                    "messages": [
+                        {"role": "system", "content": REWRITE_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"Переписать в стиль Telegram поста:\n\n{text}"},
+                    ],
+                    "temperature": 0.6,
+                    "max_tokens": 150,
+                },
+                timeout=30.0,
+            )
 
-Критерии обработки текста:
+            if resp.status_code != 200:
+                log.warning(f"⚠ DeepSeek API ошибка: {resp.status_code}, оставляем исходный текст")
+                metrics.stage_errors.inc(stage="rewrite")
+                return original_text
 
-1. Стиль: Только сухие факты, изложенные энергично и кратко. Без вводных слов, оценок и рассуждений.
-2. Длина: Строго не более 600 символов, включая пробелы.
-3. Содержание: Извлекается и переформулируется исключительно суть события (кто, что, когда, где, основные обстоятельства). Все второстепенные детали, цитаты, контекст и «воду» — удалить.
-4. Форматирование: Все эмодзи, смайлики, лишние переносы строк и HTML-разметку — удалить.
-5. Любые упоминания источников («канал сообщает», «пишет РИА»), рекламные приписки и названия других каналов в начале или конце текста — удалить.
-6. Выходные данные: Ваш ответ должен содержать только итоговый текст новости для поста, без пояснений, подписей или тегов.
-7. Контекст: Учитывайте актуальность на 2026 год.
-8. Правовой аспект: Если в тексте прямо упоминается организация, признанная в РФ экстремистской или террористической, либо иной запрещенный материал, после основного текста добавьте абзацем: «[Упомянутая организация/материал] запрещены на территории РФ».
+            data = resp.json()
+            rewritten = data["choices"][0]["message"]["content"].strip()
+
+            # Проверяем, что результат не пустой
+            if rewritten and len(rewritten.strip()) > 0:
+                log.info(f"✓ AI переработала ({len(original_text)} -> {len(rewritten)} символов)")
+                if ai_cache:
+                    ai_cache.put(cache_key, "rewrite", rewritten)
+                return rewritten
+            else:
+                log.warning(f"⚠ AI вернула пустой текст (попытка {attempt + 1}/{max_retries})")
+                if attempt < max_retries - 1:
+                    continue
+                # Если после всех попыток пусто, возвращаем исходный текст
+                return original_text
 
-Ваш ответ — это готовый к публикации пост, соответствующий всем пунктам выше.""",
-                            },
-                            {"role": "user", "content": f"Переписать в стиль Telegram поста:\n\n{text}"},
-                        ],
-                        "temperature": 0.6,
-                        "max_tokens": 150,
-                    },
-                )
+        except Exception as e:
+            log.warning(f"⚠ Ошибка при обращении к AI: {e!r}, оставляем исходный текст")
+            metrics.stage_errors.inc(stage="rewrite")
+            return original_text
 
-                if resp.status_code != 200:
-                    print(f"⚠ DeepSeek API ошибка (попытка {attempt + 1}/{max_retries}): {resp.status_code}")
-                    if attempt < max_retries - 1:
-                        continue
-                    return original_text
+    # Если все попытки не удались, возвращаем исходный текст
+    return original_text
 
-                data = resp.json()
-                rewritten = data["choices"][0]["message"]["content"].strip()
 
-                # Проверяем, что результат не пустой
-                if rewritten and len(rewritten.strip()) > 0:
-                    print(f"✓ AI переработала ({len(original_text)} -> {len(rewritten)} символов)")
-                    return rewritten
-                else:
-                    print(f"⚠ AI вернула пустой текст (попытка {attempt + 1}/{max_retries})")
-                    if attempt < max_retries - 1:
-                        continue
-                    # Если после всех попыток пусто, возвращаем исходный текст
-                    return original_text
+def parse_combined(content: str) -> Optional[tuple[bool, str]]:
+    """
+    Строгий разбор ответа COMBINED_SYSTEM_PROMPT: ровно JSON-объект с verdict
+    РЕКЛАМА/НОВОСТЬ и строкой post, для новости — непустой. Иначе None.
+    """
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    verdict, post = data.get("verdict"), data.get("post")
+    if not isinstance(verdict, str) or not isinstance(post, str):
+        return None
+    verdict = verdict.strip().upper()
+    if verdict == "РЕКЛАМА":
+        return True, ""
+    if verdict == "НОВОСТЬ" and post.strip():
+        return False, post.strip()
+    return None
 
+
+async def classify_and_rewrite(text: str) -> tuple[bool, Optional[str]]:
+    """
+    (реклама?, переписанный текст). В режиме AI_COMBINED один JSON-запрос
+    вместо двух последовательных; переписанный текст None — значит его надо
+    получить отдельно через rewrite_text_with_ai (обычный путь и все откаты).
+    """
+    if not AI_COMBINED or not text or len(text.strip()) < 20:
+        return await is_advertisement(text), None
+
+    cache_key = AICache.make_key("combined", text, DEEPSEEK_MODEL, COMBINED_PROMPT_VERSION) if ai_cache else None
+    if ai_cache:
+        cached = ai_cache.get(cache_key)
+        if cached:
+            log.info("✓ Классификация и переработка из кэша")
+            return False, cached
+
+    known, prob = known_ad_verdict(text)
+    if known is not None:
+        return known, None
+
+    try:
+        resp = await ai.chat(
+            {
+                "model": DEEPSEEK_MODEL,
+                "messages": [
+                    {"role": "system", "content": COMBINED_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"Классифицируй и, если это новость, перепиши:\n\n{text}"},
+                ],
+                "response_format": {"type": "json_object"},
+                "temperature": 0.5,
+                "max_tokens": 250,
+            },
+            timeout=30.0,
+        )
+        parsed = None
+        if resp.status_code == 200:
+            parsed = parse_combined(resp.json()["choices"][0]["message"]["content"])
+        else:
+            log.warning(f"⚠ Ошибка объединённого запроса: {resp.status_code}")
+    except Exception as e:
+        log.warning(f"⚠ Ошибка при обращении к API (объединённый запрос): {e}")
+        parsed = None
+
+    if parsed is None:
+        # откат на два отдельных запроса
+        metrics.stage_errors.inc(stage="combined")
+        return await ask_ad_verdict(text, prob), None
+
+    is_ad, rewritten = parsed
+    remember_ad_verdict(text, is_ad, prob)
+    if is_ad:
+        log.info("🚫 Это реклама - пропускаем")
+        return True, None
+    log.info(f"✓ Это новость, AI переработала одним запросом ({len(text)} -> {len(rewritten)} символов)")
+    if ai_cache:
+        ai_cache.put(cache_key, "combined", rewritten)
+    return False, rewritten
+
+
+store = open_backend(STATE_BACKEND, STATE_DB_FILE, MAP_FILE, DEDUP_INDEX_FILE, batch_size=STATE_BATCH_SIZE)
+
+# разовая миграция mirror_map.json / dedup_index.bin в SQLite
+legacy_texts = []
+if STATE_BACKEND == "sqlite":
+    legacy_texts = migrate_json(store, MAP_FILE, DEDUP_INDEX_FILE, DEDUP_NUM_PERM, DEDUP_SEED)
+else:
+    legacy_texts = store.state.pop("dedup_history", None) or []
+
+dedup = DedupIndex(
+    threshold=TRIGRAM_THRESHOLD,
+    capacity=DEDUP_HISTORY_SIZE,
+    num_perm=DEDUP_NUM_PERM,
+    store=store.dedup_store(DEDUP_NUM_PERM, DEDUP_SEED),
+    seed=DEDUP_SEED,
+)
+
+media_index = None
+if MEDIA_DEDUP_ENABLED and media.ffmpeg:
+    media_index = MediaHashIndex(MEDIA_DEDUP_DISTANCE, MEDIA_DEDUP_HISTORY, store=store.media_hash_store())
+elif MEDIA_DEDUP_ENABLED:
+    log.warning("⚠️ ffmpeg не найден: дедупликация медиа по превью выключена")
+
+# сырые тексты старого формата dedup_history переезжают в индекс подписей
+if legacy_texts:
+    for hist_text in legacy_texts:
+        add_to_history(hist_text)
+    log.info(f"🔁 Перенесено в индекс дедупликации: {len(legacy_texts)} текстов")
+store.flush()
+if STATE_BACKEND == "sqlite":
+    finish_migration(store, MAP_FILE)
+
+mirror_index = MirrorIndex(store)
+
+watermarks = WatermarkTracker(store)
+# (источник, id) сообщений постов, которые ещё обрабатываются: их правки ждут соответствий
+inflight_msgs: set[tuple[str, int]] = set()
+# источник -> живые посты, пришедшие во время догона (отправляются после него, по порядку id)
+backfill_buffers: dict[str, list[list]] = {}
+
+
+def heartbeat(phase: str) -> None:
+    """Пульс для координатора; пока phase == "starting", он ждёт дольше (COORD_STARTUP_GRACE)."""
+    store.heartbeat(SHARD_INDEX, {
+        "pid": os.getpid(),
+        "phase": phase,
+        "sources": SOURCE_CHANNELS,
+        "queued": sum(scheduler.queue_depth().values()),
+        "sent": metrics.posts_total.get(result="sent"),
+    })
+    store.flush()
+
+
+async def flush_state_periodically():
+    """
+    Батч-коммит состояния раз в STATE_FLUSH_INTERVAL секунд
+    и компактация по сроку хранения раз в сутки.
+    """
+    last_compact = 0.0
+    while True:
+        await asyncio.sleep(STATE_FLUSH_INTERVAL)
+        try:
+            with metrics.stage("state_flush"):
+                store.flush()
+                if ai_cache:
+                    ai_cache.flush()
+                if ad_model:
+                    # 2 МБ весов — не чаще раза в AD_LOCAL_SAVE_INTERVAL и не в цикле событий
+                    snapshot = ad_model.snapshot()
+                    if snapshot is not None:
+                        await asyncio.to_thread(ad_model.write, snapshot)
+                media_store.save()
+                if SHARDED:
+                    heartbeat("running")
+            if STATE_RETENTION_DAYS and time.monotonic() - last_compact > 24 * 3600:
+                removed = mirror_index.compact(STATE_RETENTION_DAYS * 24 * 3600)
+                last_compact = time.monotonic()
+                if removed:
+                    log.info(f"🧹 Компактация состояния: удалено {removed} старых соответствий")
         except Exception as e:
-            print(f"⚠ Ошибка при обращении к AI (попытка {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                continue
-            return original_text
+            log.warning(f"⚠️ Ошибка при сохранении состояния: {e}")
 
-    # Если все попытки не удались, возвращаем исходный текст
-    return original_text
 
+def pick_thumb(m):
+    """
+    Превью для хэша: наименьшее не меньше 90px (скачивается за один маленький
+    запрос), иначе встроенное в сообщение stripped-превью (thumb=0, без сети).
+    """
+    if m.photo:
+        sizes = getattr(m.photo, "sizes", None)
+    else:
+        sizes = getattr(getattr(m, "document", None), "thumbs", None)
+    if not sizes:
+        return None
+    sized = [s for s in sizes if getattr(s, "w", 0) >= 90]
+    return min(sized, key=lambda s: s.w) if sized else 0
 
-state = load_map()
-if "dedup_history" not in state:
-    state["dedup_history"] = []
-    save_map(state)
+
+async def media_hashes(m) -> Optional[tuple[int, int]]:
+    thumb = pick_thumb(m)
+    if thumb is None:
+        return None
+    try:
+        data = await flood_retry(client.download_media, m, file=bytes, thumb=thumb)
+    except Exception as e:
+        log.warning(f"⚠️ Не удалось получить превью #{m.id}: {e!r}")
+        return None
+    gray = await media.decode_gray(data, HASH_SIZE) if data else None
+    if not gray or is_flat(gray):
+        return None
+    return phash(gray), dhash(gray)
+
+
+async def is_media_duplicate(msgs: list) -> bool:
+    """
+    Все фото/видео поста уже публиковались — сравнение pHash/dHash превью
+    до скачивания файлов и до AI. Хэши новых медиа сразу попадают в индекс
+    (проверка и запись атомарны, как у текстового дедупа).
+    """
+    items = [m for m in msgs if m.photo or m.video]
+    if not media_index or not items:
+        return False
+    with metrics.stage("media_dedup"):
+        hashes = [h for h in await asyncio.gather(*(media_hashes(m) for m in items)) if h]
+        if not hashes:
+            return False
+        async with scheduler.state_lock:
+            async with shared_state():
+                if SHARDED:
+                    media_index.sync()
+                dists = [media_index.query(ph, dh) for ph, dh in hashes]
+                duplicate = len(hashes) == len(items) and all(d is not None for d in dists)
+                if not duplicate:
+                    for (ph, dh), dist in zip(hashes, dists):
+                        if dist is None:
+                            media_index.add(ph, dh)
+    if duplicate:
+        log.warning(f"⚠️  Дубликат медиа! Расстояние Хэмминга: {max(dists)}")
+    return duplicate
+
+
+async def send_to_target(target: Target, func, *args, **kwargs):
+    """Все отправки в целевые каналы: через SendLimiter и с замером стадии send."""
+    with metrics.stage("send"):
+        return await limiter.send(func, target.peer or target.channel_id, *args, **kwargs)
+
+
+async def download_to_workdir(m, job: Path) -> Optional[str]:
+    with metrics.stage("download"):
+        async with scheduler.stage("download"):
+            file_path = await flood_retry(client.download_media, m, file=str(job))
+    if file_path:
+        metrics.bytes_total.inc(os.path.getsize(file_path), direction="download")
+    return file_path
+
+
+async def upload_to_telegram(file_path: str):
+    with metrics.stage("upload"):
+        async with scheduler.stage("upload"):
+            uploaded = await flood_retry(client.upload_file, file_path)
+    metrics.bytes_total.inc(os.path.getsize(file_path), direction="upload")
+    return uploaded
+
+
+async def prepare_video(file_path: str, job: Path) -> VideoMeta:
+    with metrics.stage("media_prep"):
+        return await media.prepare_video(file_path, job / f"thumb_{Path(file_path).stem}.jpg")
+
+
+async def optimize_media(file_path: str, is_video: bool, meta: Optional[VideoMeta] = None) -> str:
+    """
+    Путь к файлу, который стоит загружать: исходный или уменьшенный.
+    Для видео meta должна быть уже подготовлена (превью снимается с исходника).
+    """
+    if not optimizer:
+        return file_path
+    before = os.path.getsize(file_path)
+    with metrics.stage("optimize"):
+        if is_video:
+            file_path = await optimizer.optimize_video(file_path, meta)
+        elif file_path.lower().endswith((".jpg", ".jpeg", ".png")):
+            file_path = await optimizer.optimize_photo(file_path)
+    saved = before - os.path.getsize(file_path)
+    if saved > 0:
+        metrics.bytes_total.inc(saved, direction="optimized")
+    return file_path
+
+
+media_cache_total = metrics.REGISTRY.counter(
+    "xoster_media_cache_total", "Кэш медиа по результату (hit — по id, digest — по хэшу, miss)"
+)
+
+
+async def fetch_media(m, job: Path) -> Optional[CachedMedia]:
+    """
+    Готовый к загрузке файл медиа (после превью и оптимизации) из кэша.
+    Запись возвращается со ссылкой — после отправки её нужно отдать
+    через media_store.release, до этого файл не вытесняется.
+    Повтор по id Telegram не качается вовсе; тот же файл, перезалитый
+    под другим id, находится по sha256 — без повторных ffmpeg.
+    """
+    key = media_store.media_key(m)
+    entry = media_store.lookup(key)
+    if entry is not None:
+        media_cache_total.inc(result="hit")
+        metrics.bytes_total.inc(entry.size, direction="avoided")
+        return entry
+
+    file_path = await download_to_workdir(m, job)
+    if not file_path:
+        return None
+    digest = await asyncio.to_thread(file_digest, file_path)
+    entry = media_store.lookup_digest(digest, key)
+    if entry is not None:
+        media_cache_total.inc(result="digest")
+        return entry
+
+    media_cache_total.inc(result="miss")
+    meta = await prepare_video(file_path, job) if m.video else None
+    file_path = await optimize_media(file_path, bool(m.video), meta)
+    return media_store.put(digest, file_path, meta, key)
 
 
 async def send_media_file(
+        target: Target,
         file_path: str,
         caption_text: str,
         caption_entities: list,
         is_video: bool,
+        meta: Optional[VideoMeta] = None,
+        uploaded: Any = None,
 ):
     """
     Единая отправка файла (single). Для видео добавляем attrs + thumb.
     supports_streaming должен быть и параметром send_file, и флагом в DocumentAttributeVideo.
+    Важно: в альбомах Telethon может игнорировать thumb, поэтому для видео в альбомах мы шлём по одному.
+    meta/uploaded — уже подготовленные конвейером альбома превью и загруженный файл.
     """
     send_kwargs = dict(
         caption=caption_text,
@@ -389,231 +1050,992 @@ async def send_media_file(
     )
 
     if is_video:
-        dur, w, h = ffprobe_meta(file_path)
+        if meta is None:
+            meta = await prepare_video(file_path, Path(file_path).parent)
         send_kwargs["attributes"] = [DocumentAttributeVideo(
-            duration=dur,
-            w=w,
-            h=h,
+            duration=meta.duration,
+            w=meta.width,
+            h=meta.height,
             supports_streaming=True
         )]  # ключевой момент для streamable видео
 
-        if has_ffmpeg():
-            thumb_path = make_thumb(file_path, WORKDIR / f"thumb_{Path(file_path).stem}.jpg")
-            if thumb_path:
-                send_kwargs["thumb"] = str(thumb_path)
+        if meta.thumb:
+            send_kwargs["thumb"] = str(meta.thumb)
 
-    return await client.send_file(TARGET_CHANNEL_ID, file_path, **send_kwargs)
+        timings = ", ".join(f"{stage} {value:.2f}s" for stage, value in meta.timings.items())
+        log.info(f"🎞 Видео подготовлено: {meta.width}x{meta.height}, {meta.duration}s ({timings})")
 
+    # байты грузим до очереди отправок, чтобы не держать её на время upload
+    if uploaded is None:
+        uploaded = await upload_to_telegram(file_path)
 
-async def reupload_single(msg, source_channel: str):
-    text = msg.message or ""
+    return await send_to_target(target, client.send_file, uploaded, **send_kwargs)
 
-    if text and await is_advertisement(text):
-        print(f"❌ Пропускаем рекламу из {source_channel}")
-        return None
 
-    if is_duplicate(text, state["dedup_history"]):
-        print(f"❌ Пропускаем дубликат из {source_channel}")
-        return None
+media_path_total = metrics.REGISTRY.counter(
+    "xoster_media_path_total", "Каким путём ушли медиа-посты (reference, download, fanout)"
+)
 
-    add_to_history(text, state["dedup_history"])
-    save_map(state)
 
-    if text:
-        text = await rewrite_text_with_ai(text) or ""
+def can_send_by_reference(msgs: list) -> bool:
+    """
+    Фото/видео можно переслать по file reference, если источник не запрещает
+    сохранение контента (noforwards на сообщении или канале).
+    """
+    if not REUPLOAD_BY_REFERENCE or not msgs:
+        return False
+    for m in msgs:
+        if getattr(m, "noforwards", False) or getattr(m.chat, "noforwards", False):
+            return False
+        if not (m.photo or m.video):
+            return False
+    return True
+
+
+async def send_by_reference(target: Target, msgs: list, caption_text: str, caption_entities: list):
+    """
+    Отправка InputMedia, собранных из msg.media, с нашей подписью.
+    Протухший file reference обновляем перезапросом сообщений (один раз).
+    None — значит надо идти обычным путём через скачивание.
+    """
+    input_media = [m.media for m in msgs]
+    for attempt in range(2):
+        try:
+            sent = await send_to_target(
+                target,
+                client.send_file,
+                input_media if len(input_media) > 1 else input_media[0],
+                caption=caption_text,
+                force_document=False,
+                formatting_entities=caption_entities,
+            )
+        except errors.FileReferenceExpiredError:
+            if attempt:
+                break
+            try:
+                fresh = await flood_retry(client.get_messages, msgs[0].chat_id, ids=[m.id for m in msgs])
+            except errors.RPCError as e:
+                log.warning(f"⚠️ Не удалось обновить file reference ({e.__class__.__name__}), качаем файл")
+                break
+            input_media = [f.media for f in fresh if f and f.media]
+            if len(input_media) != len(msgs):
+                break
+            continue
+        except errors.RPCError as e:
+            log.warning(f"⚠️ Отправка по ссылке не удалась ({e.__class__.__name__}), качаем файл")
+            break
+
+        avoided = sum((m.file.size or 0) for m in msgs if m.file)
+        media_path_total.inc(path="reference")
+        metrics.bytes_total.inc(avoided, direction="avoided")
+        log.info(f"🔗 Отправлено по ссылке без скачивания (сэкономлено {avoided / 1024 / 1024:.1f} МБ x2)")
+        return sent
+
+    return None
+
+
+async def fan_out(sent_msgs: list, targets: list[Target], text: str) -> list[tuple[Target, list]]:
+    """
+    Рассылка уже отправленного поста в остальные целевые каналы: медиа берутся
+    из нашего же сообщения (file reference), без повторных скачивания и загрузки.
+    Подпись у каждого канала своя; ошибка одного канала не мешает остальным.
+    """
+    if not targets:
+        return []
+    media_refs = [m.media for m in sent_msgs if m.photo or m.document]
+    results = []
+    for target in targets:
+        try:
+            if media_refs:
+                caption_text, caption_entities = safe_caption_for_media(text, target)
+                sent = await send_to_target(
+                    target,
+                    client.send_file,
+                    media_refs if len(media_refs) > 1 else media_refs[0],
+                    caption=caption_text,
+                    force_document=False,
+                    formatting_entities=caption_entities,
+                )
+                media_path_total.inc(path="fanout")
+            else:
+                message_text, entities = safe_text_for_message(text, target)
+                sent = await send_to_target(
+                    target, client.send_message, message_text, formatting_entities=entities, link_preview=False
+                )
+        except Exception as e:
+            log.warning(f"⚠️ Не удалось отправить в {target.channel_id}: {e}")
+            continue
+        results.append((target, sent if isinstance(sent, list) else [sent]))
+    return results
+
+
+@dataclass
+class AlbumItem:
+    msg: Any
+    file_path: Optional[str] = None
+    meta: Optional[VideoMeta] = None
+    uploaded: Any = None
+    entry: Optional[CachedMedia] = None
+
+
+async def prepare_album_item(m, album_sem: asyncio.Semaphore, job: Path, items: list) -> AlbumItem:
+    """
+    Конвейер одного элемента альбома: скачивание -> превью (для видео) ->
+    оптимизация (или всё это из кэша) -> загрузка.
+    Скачивания ограничены и на альбом (album_sem), и глобально (стадия download),
+    поэтому элементы альбома идут параллельно, не забивая канал целиком.
+    Элемент сразу попадает в items, чтобы ссылку на кэш отпустили и при отмене.
+    """
+    item = AlbumItem(msg=m)
+    items.append(item)
+    async with album_sem:
+        item.entry = await fetch_media(m, job)
+    if item.entry is None:
+        return item
+    item.file_path = str(item.entry.path)
+    item.meta = item.entry.meta
+
+    try:
+        item.uploaded = await upload_to_telegram(item.file_path)
+    except Exception as e:
+        # не страшно: send_file загрузит файл сам
+        log.warning(f"⚠️ Ошибка предзагрузки {Path(item.file_path).name}: {e}")
+    return item
+
+
+speculative_total = metrics.REGISTRY.counter(
+    "xoster_speculative_total", "Работа, начатая до вердикта (work: rewrite, download; result: used, wasted)"
+)
+speculative_saved = metrics.REGISTRY.histogram(
+    "xoster_speculative_saved_seconds", "На сколько раньше ушёл пост благодаря спекулятивной работе"
+)
+
+
+def settle_speculation(spec: Optional[Speculation], accepted: bool) -> None:
+    if spec is None or spec.settled:
+        return
+    overlap, counts = spec.settle(accepted)
+    result = "used" if accepted else "wasted"
+    for kind, count in counts.items():
+        speculative_total.inc(count, work=kind, result=result)
+    if accepted and overlap:
+        saved = sum(overlap.values())
+        speculative_saved.observe(saved)
+        log.info(f"⚡ Спекулятивно выиграно {saved:.2f}s ({', '.join(f'{k} {v:.2f}s' for k, v in overlap.items())})")
+
+
+async def rewrite_stage(text: str) -> str:
+    with metrics.stage("rewrite"):
+        async with scheduler.stage("ai"):
+            return await rewrite_text_with_ai(text) or ""
+
+
+async def screen_post(
+        text: str,
+        source_channel: str,
+        what: str,
+        spec: Optional[Speculation] = None,
+        prefetch: Optional[Callable[[], None]] = None,
+) -> Optional[str]:
+    """
+    Проверки и переписывание текста поста: реклама -> дубликат -> AI.
+    Итоговый текст или None, если пост отклонён (лог и метрика — здесь же).
+
+    spec — режим SPECULATIVE_PIPELINE: сначала дешёвая локальная проверка
+    дубликата, затем проверка рекламы, переписывание и скачивание медиа
+    (prefetch запускает его в spec) идут одновременно, и пост ждёт самую
+    долгую стадию, а не их сумму. При отказе начатое отменяется.
+    """
+    def reject(result: str) -> None:
+        reason = {"ad": "рекламу", "duplicate": "дубликат"}[result]
+        log.info(f"❌ Пропускаем {reason} ({what}) из {source_channel}")
+        metrics.posts_total.inc(result=result)
+        settle_speculation(spec, accepted=False)
+
+    rewrite_task = None
+    if spec is not None:
+        with metrics.stage("dedup"):
+            async with scheduler.state_lock:
+                async with shared_state():
+                    if SHARDED:
+                        dedup.sync()
+                    duplicate = is_duplicate(text)
+        if duplicate:
+            return reject("duplicate")
+        if prefetch:
+            prefetch()
+        if text and not AI_COMBINED:
+            rewrite_task = spec.spawn("rewrite", rewrite_stage(text))
+
+    try:
+        rewritten = None
+        if text:
+            with metrics.stage("ad_check"):
+                async with ad_check_slot():
+                    is_ad, rewritten = await classify_and_rewrite(text)
+            if is_ad:
+                return reject("ad")
+
+        # проверка и запись в историю — одна атомарная операция над общим состоянием
+        # (в спекулятивном режиме повторная: за время AI мог пройти такой же пост)
+        with metrics.stage("dedup"):
+            async with scheduler.state_lock:
+                duplicate = await check_and_remember(text)
+        if duplicate:
+            return reject("duplicate")
+        settle_speculation(spec, accepted=True)
+
+        if rewritten:
+            text = rewritten
+        elif rewrite_task:
+            text = await rewrite_task
+        elif text:
+            text = await rewrite_stage(text)
+    finally:
+        # не принятая (отказ, ошибка, отмена) работа отменяется и дожидается здесь
+        if spec is not None and not spec.accepted:
+            await spec.cancel()
 
     # Гарантируем, что текст не пустой после обработки
     if not text or len(text.strip()) == 0:
-        print(f"⚠️ Предупреждение: текст пустой после обработки, используем заглушку")
-        return
+        log.warning(f"⚠️ Предупреждение: текст ({what}) пустой после обработки, используем заглушку")
+        metrics.posts_total.inc(result="empty")
+        return None
+    return text
+
+
+async def reupload_single(msg, source_channel: str) -> list[tuple[Target, list]]:
+    """
+    Фильтры и AI — один раз на пост, затем отправка в первый целевой канал
+    и рассылка по остальным. Возвращает [(канал, отправленные сообщения)].
+    """
+    targets = targets_for(source_channel)
+    if not targets:
+        return []
+
+    if msg.media and await is_media_duplicate([msg]):
+        log.info(f"❌ Пропускаем дубликат медиа из {source_channel}")
+        metrics.posts_total.inc(result="duplicate")
+        return []
+
+    spec = Speculation() if SPECULATIVE_PIPELINE else None
+    # по ссылке медиа не качается, спекулировать нечем
+    speculate_media = bool(spec and msg.media and not can_send_by_reference([msg]))
+    prefetched: list[asyncio.Task] = []
+
+    with media_store.job_dir() if speculate_media else contextlib.nullcontext() as job:
+        def start_prefetch():
+            if speculate_media:
+                prefetched.append(spec.spawn("download", fetch_media(msg, job)))
 
+        try:
+            text = await screen_post(msg.message or "", source_channel, "пост", spec, start_prefetch)
+            if text is None:
+                return []
+
+            entry = None
+            if prefetched:
+                try:
+                    entry = await prefetched[0]
+                except Exception as e:
+                    log.warning(f"⚠️ Ошибка предварительного скачивания #{msg.id}: {e!r}")
+            sent = await send_single(msg, text, targets[0], entry)
+        finally:
+            # дожидаемся отменённых скачиваний до удаления каталога задачи;
+            # успевшие завершиться держат ссылку на запись кэша — отпускаем
+            for task in prefetched:
+                task.cancel()
+            for result in await asyncio.gather(*prefetched, return_exceptions=True):
+                if isinstance(result, CachedMedia):
+                    media_store.release(result)
+
+    if not sent:
+        return []
+    return [(targets[0], [sent])] + await fan_out([sent], targets[1:], text)
+
+
+async def send_single(msg, text: str, target: Target, entry: Optional[CachedMedia] = None):
+    """entry — медиа, уже скачанное спекулятивно (ссылку на него отпускает вызывающий)."""
     if msg.media:
-        file_path = await client.download_media(msg, file=str(WORKDIR))
-        if not file_path:
-            message_text, entities = safe_text_for_message(text)
-            return await client.send_message(
-                TARGET_CHANNEL_ID,
+        if entry is None and can_send_by_reference([msg]):
+            caption_text, caption_entities = safe_caption_for_media(text, target)
+            sent = await send_by_reference(target, [msg], caption_text, caption_entities)
+            if sent:
+                return sent
+
+        owned = entry is None
+        if owned:
+            with media_store.job_dir() as job:
+                entry = await fetch_media(msg, job)
+        if entry is None:
+            message_text, entities = safe_text_for_message(text, target)
+            return await send_to_target(
+                target,
+                client.send_message,
                 message_text,
                 formatting_entities=entities,
                 link_preview=False
             )
 
-        caption_text, caption_entities = safe_caption_for_media(text)
-
-        sent = await send_media_file(
-            file_path=file_path,
-            caption_text=caption_text,
-            caption_entities=caption_entities,
-            is_video=bool(msg.video),
-        )
+        caption_text, caption_entities = safe_caption_for_media(text, target)
+        try:
+            sent = await send_media_file(
+                target,
+                file_path=str(entry.path),
+                caption_text=caption_text,
+                caption_entities=caption_entities,
+                is_video=bool(msg.video),
+                meta=entry.meta,
+            )
+        finally:
+            if owned:
+                media_store.release(entry)
 
         if sent:
-            cleanup_media(file_path)
+            media_path_total.inc(path="download")
+            log.info("⬇️ Отправлено через скачивание и повторную загрузку")
         return sent
 
-    message_text, entities = safe_text_for_message(text)
-    return await client.send_message(TARGET_CHANNEL_ID, message_text, formatting_entities=entities, link_preview=False)
+    message_text, entities = safe_text_for_message(text, target)
+    return await send_to_target(target, client.send_message, message_text, formatting_entities=entities, link_preview=False)
+
+
+async def process_single(msg, source_channel: str):
+    log.info(f"📩 Новое сообщение #{msg.id} из {source_channel}")
+    results = await reupload_single(msg, source_channel)
+    digest = text_hash(msg.message)
+    for target, sent in results:
+        mirror_index.set_single(source_channel, msg.id, sent[0].id, target=target.key, text_hash=digest)
+    if results:
+        metrics.posts_total.inc(result="sent")
+        log.info(f"✅ Отправлено в {len(results)} канал(ов), #{results[0][1][0].id}")
+
+
+async def finish_album(
+        source_channel: str,
+        grouped_id: int,
+        targets: list[Target],
+        sent_msgs: list,
+        text: str,
+        source_msgs: list,
+) -> None:
+    """Соответствия альбома для первого канала и рассылка по остальным."""
+    source_ids = [m.id for m in source_msgs if m.media]
+    digest = text_hash(next((m.message for m in source_msgs if m.message), ""))
+    target_ids = [m.id for m in sent_msgs if m]
+    mirror_index.set_album(
+        source_channel, grouped_id, target_ids, target_ids[0] if target_ids else None,
+        target=targets[0].key, source_msg_ids=source_ids, text_hash=digest,
+    )
+    for target, sent in await fan_out([m for m in sent_msgs if m], targets[1:], text):
+        ids = [m.id for m in sent if m]
+        mirror_index.set_album(
+            source_channel, grouped_id, ids, ids[0] if ids else None,
+            target=target.key, source_msg_ids=source_ids, text_hash=digest,
+        )
+    metrics.posts_total.inc(result="sent")
 
 
-def register_handlers_for_source(source_channel: str):
-    @client.on(events.NewMessage(chats=source_channel))
-    async def on_new_message(event):
-        msg = event.message
-        if msg.grouped_id:
-            return
+async def reupload_album(msgs: list, source_channel: str):
+    if not msgs:
+        return
 
-        print(f"📩 Новое сообщение #{msg.id} из {source_channel}")
-        sent = await reupload_single(msg, source_channel)
-        if sent:
-            state["single"][f"{source_channel}:{msg.id}"] = sent.id
-            save_map(state)
-            print(f"✅ Отправлено в приватный канал #{sent.id}")
+    targets = targets_for(source_channel)
+    if not targets:
+        return
+    target = targets[0]
 
-    @client.on(events.Album(chats=source_channel))
-    async def on_album(event):
-        msgs = list(event.messages)
-        if not msgs:
-            return
+    grouped_id = next((m.grouped_id for m in msgs if m.grouped_id), None)
+    if not grouped_id:
+        return
 
-        grouped_id = next((m.grouped_id for m in msgs if m.grouped_id), None)
-        if not grouped_id:
-            return
+    if await is_media_duplicate(msgs):
+        log.info(f"❌ Пропускаем дубликат альбома (медиа) из {source_channel}")
+        metrics.posts_total.inc(result="duplicate")
+        return
 
-        caption_src = next((m.message for m in msgs if m.message), "") or ""
+    caption_src = next((m.message for m in msgs if m.message), "") or ""
+    media_msgs = [m for m in msgs if m.media]
+    spec = Speculation() if SPECULATIVE_PIPELINE else None
 
-        if caption_src and await is_advertisement(caption_src):
-            print(f"❌ Пропускаем рекламный альбом из {source_channel}")
-            return
+    # скачиваем, готовим превью и загружаем элементы параллельно;
+    # порядок элементов сохраняется, т.к. результаты собираются по индексу
+    album_sem = asyncio.Semaphore(ALBUM_DOWNLOAD_CONCURRENCY)
+    prepared: list[AlbumItem] = []
+    tasks: list[asyncio.Task] = []
 
-        if is_duplicate(caption_src, state["dedup_history"]):
-            print(f"❌ Пропускаем дубликат альбома из {source_channel}")
-            return
+    with media_store.job_dir() as job:
+        def start_downloads(speculative: bool = False):
+            for m in media_msgs:
+                coro = prepare_album_item(m, album_sem, job, prepared)
+                tasks.append(spec.spawn("download", coro) if speculative else asyncio.create_task(coro))
 
-        add_to_history(caption_src, state["dedup_history"])
-        save_map(state)
+        try:
+            # по ссылке медиа не качается, спекулировать нечем
+            prefetch = None if can_send_by_reference(media_msgs) else lambda: start_downloads(speculative=True)
+            caption_src = await screen_post(caption_src, source_channel, "альбом", spec, prefetch)
+            if caption_src is None:
+                return
+
+            if store.get_album(source_channel, grouped_id, target=target.key):
+                return
+
+            log.info(f"📷 Новый альбом #{grouped_id} из {source_channel}")
+
+            caption_text, caption_entities = safe_caption_for_media(caption_src, target)
+
+            # по ссылкам альбом уходит одной группой: превью и атрибуты видео уже в документе
+            if not tasks and can_send_by_reference(media_msgs):
+                sent_messages = await send_by_reference(target, media_msgs, caption_text, caption_entities)
+                if sent_messages:
+                    sent_list = sent_messages if isinstance(sent_messages, list) else [sent_messages]
+                    await finish_album(source_channel, grouped_id, targets, sent_list, caption_src, msgs)
+                    log.info(f"✅ Альбом отправлен по ссылкам ({len(sent_list)} сообщений)")
+                    return
+
+            if not tasks:
+                start_downloads()
+            media_path_total.inc(path="download")
+
+            # Важный фикс: если в альбоме есть видео — отправляем по одному,
+            # потому что с thumb/атрибутами в альбомах у Telethon бывают проблемы. [web:17]
+            if any(m.video for m in media_msgs):
+                log.info("🎬 В альбоме есть видео -> отправляем по одному (fix preview/streaming)")
+                sent_list = []
+
+                # элемент отправляется, как только готов он и все предыдущие,
+                # пока следующие ещё качаются
+                for task in tasks:
+                    item = await task
+                    if not item.file_path:
+                        continue
+                    first = not sent_list
+                    sent = await send_media_file(
+                        target,
+                        file_path=item.file_path,
+                        caption_text=caption_text if first else "",
+                        caption_entities=caption_entities if first else [],
+                        is_video=bool(item.msg.video),
+                        meta=item.meta,
+                        uploaded=item.uploaded,
+                    )
+                    if sent:
+                        sent_list.append(sent)
+
+                if not sent_list:
+                    sent = await send_to_target(
+                        target,
+                        client.send_message,
+                        caption_text,
+                        formatting_entities=caption_entities,
+                        link_preview=False
+                    )
+                    sent_list = [sent]
+
+                # в остальные каналы — одной группой: превью и атрибуты уже в отправленных документах
+                await finish_album(source_channel, grouped_id, targets, sent_list, caption_src, msgs)
+                log.info(f"✅ Альбом отправлен по одному ({len(sent_list)} сообщений)")
+                return
+
+            items = [item for item in await asyncio.gather(*tasks) if item.file_path]
+
+            if not items:
+                sent = await send_to_target(
+                    target,
+                    client.send_message,
+                    caption_text,
+                    formatting_entities=caption_entities,
+                    link_preview=False
+                )
+                await finish_album(source_channel, grouped_id, targets, [sent], caption_src, msgs)
+                return
+
+            # Если видео нет — можно слать настоящим альбомом (быстрее)
+            sent_messages = await send_to_target(
+                target,
+                client.send_file,
+                [item.uploaded or item.file_path for item in items],
+                caption=caption_text,
+                force_document=False,
+                formatting_entities=caption_entities,
+                supports_streaming=False,
+            )
 
-        if caption_src:
-            caption_src = await rewrite_text_with_ai(caption_src) or ""
+            sent_list = sent_messages if isinstance(sent_messages, list) else [sent_messages]
+            await finish_album(source_channel, grouped_id, targets, sent_list, caption_src, msgs)
+            log.info(f"✅ Альбом отправлен ({len(sent_list)} сообщений)")
+        finally:
+            # элементы дописываются в prepared до конца задачи — сначала дождаться
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for item in prepared:
+                media_store.release(item.entry)
+
+
+async def run_post(job) -> None:
+    """Задача планировщика: полное время поста и счётчик ошибок."""
+    t0 = time.monotonic()
+    try:
+        await job
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        metrics.posts_total.inc(result="error")
+        raise
+    finally:
+        metrics.post_seconds.observe(time.monotonic() - t0)
+
+
+def register_metrics() -> None:
+    """Gauge-метрики снимаются со stats() компонентов в момент запроса /metrics."""
+    reg = metrics.REGISTRY
+    reg.gauge("xoster_queue_depth", "Постов в очередях планировщика", lambda: sum(scheduler.queue_depth().values()))
+    reg.gauge("xoster_workers_busy", "Занятые воркеры планировщика", lambda: scheduler.stats()["busy"])
+    reg.gauge("xoster_send_rate", "Текущая скорость отправки (постов/с)", lambda: limiter.rate)
+    reg.gauge("xoster_send_flood_waits_total", "FloodWait на отправке", lambda: limiter.flood_waits, "counter")
+    reg.gauge("xoster_send_throttled_seconds_total", "Время ожидания лимитера", lambda: limiter.throttled_time, "counter")
+    reg.gauge("xoster_ai_requests_total", "Запросы к DeepSeek", lambda: ai.requests, "counter")
+    reg.gauge("xoster_ai_new_connections_total", "Новые соединения к DeepSeek", lambda: ai.new_connections, "counter")
+    reg.gauge("xoster_ai_in_flight", "Запросы к DeepSeek в полёте", lambda: ai.in_flight)
+    reg.gauge("xoster_ai_retries_total", "Повторы запросов к DeepSeek", lambda: ai.retried, "counter")
+    reg.gauge("xoster_ai_hedges_total", "Hedged-запросы к DeepSeek", lambda: ai.hedges, "counter")
+    reg.gauge("xoster_ai_short_circuits_total", "Запросы, отклонённые circuit breaker", lambda: ai.short_circuits, "counter")
+    reg.gauge("xoster_ai_fallbacks_total", "Переключения на запасную модель", lambda: ai.fallbacks, "counter")
+    reg.gauge(
+        "xoster_ai_breaker_open", "Открыт ли circuit breaker основной модели",
+        lambda: ai.breaker(DEEPSEEK_MODEL).state != "closed",
+    )
+    reg.gauge("xoster_dedup_entries", "Записей в индексе дедупликации", lambda: dedup.stats()["entries"])
+    reg.gauge("xoster_startup_seconds", "Время старта до приёма постов", lambda: startup_seconds)
+    reg.gauge("xoster_mirror_index_entries", "Соответствий source -> target в памяти", lambda: len(mirror_index))
+    if media_index:
+        reg.gauge("xoster_media_dedup_entries", "Хэшей в индексе медиа", lambda: len(media_index))
+        reg.gauge("xoster_media_dedup_matches_total", "Дубликаты медиа по превью", lambda: media_index.matches, "counter")
+    reg.gauge("xoster_media_cache_bytes", "Объём кэша медиа на диске", lambda: media_store.total)
+    reg.gauge("xoster_media_cache_evictions_total", "Вытесненные из кэша медиа файлы", lambda: media_store.evictions, "counter")
+    if ai_cache:
+        reg.gauge("xoster_ai_cache_hits_total", "Попадания в AI-кэш", lambda: ai_cache.hits, "counter")
+        reg.gauge("xoster_ai_cache_misses_total", "Промахи AI-кэша", lambda: ai_cache.misses, "counter")
+    if ad_batcher:
+        reg.gauge("xoster_ad_batches_total", "Пачки проверки рекламы", lambda: ad_batcher.batches, "counter")
+        reg.gauge("xoster_ad_batch_items_total", "Тексты, проверенные пачками", lambda: ad_batcher.items, "counter")
+    if ad_model:
+        reg.gauge("xoster_ad_local_total", "Решения о рекламе без DeepSeek", lambda: ad_model.local_decisions, "counter")
+        reg.gauge("xoster_ad_llm_total", "Вердикты DeepSeek, на которых училась модель", lambda: ad_model.llm_checks, "counter")
+        reg.gauge("xoster_ad_local_agreement", "Согласие модели с DeepSeek", lambda: ad_model.stats()["agreement"])
+
+
+async def submit_post(source_channel: str, msgs: list) -> None:
+    """Пост (одиночное сообщение или альбом) в планировщик с учётом отметки источника."""
+    ids = [m.id for m in msgs]
+    if msgs[0].grouped_id:
+        make_job, name = (lambda: reupload_album(msgs, source_channel)), f"album #{msgs[0].grouped_id}"
+    else:
+        make_job, name = (lambda: process_single(msgs[0], source_channel)), f"#{msgs[0].id}"
+
+    async def job():
+        try:
+            await run_post(make_job())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            watermarks.done(source_channel, ids)
+            raise
+        finally:
+            inflight_msgs.difference_update((source_channel, i) for i in ids)
+        watermarks.done(source_channel, ids)
 
-        # Гарантируем, что текст не пустой после обработки
-        if not caption_src or len(caption_src.strip()) == 0:
-            print(f"⚠️ Предупреждение: текст альбома пустой после обработки, используем заглушку")
-            return
+    watermarks.begin(source_channel, ids)
+    inflight_msgs.update((source_channel, i) for i in ids)
+    await scheduler.submit(source_channel, job, name)
 
-        album_key = f"{source_channel}:{grouped_id}"
-        if album_key in state["album"]:
-            caption_msg_id = state["album"][album_key].get("caption_msg_id")
-            if caption_msg_id:
-                pass
-            return
 
-        print(f"📷 Новый альбом #{grouped_id} из {source_channel}")
+def already_mirrored(source_channel: str, msgs: list) -> bool:
+    targets = targets_for(source_channel)
+    if not targets:
+        return True
+    if msgs[0].grouped_id:
+        return store.get_album(source_channel, msgs[0].grouped_id, target=targets[0].key) is not None
+    return store.get_single(source_channel, msgs[0].id, target=targets[0].key) is not None
 
-        # скачиваем файлы
-        media_msgs = [m for m in msgs if m.media]
-        files: list[str] = []
-        for m in media_msgs:
-            fp = await client.download_media(m, file=str(WORKDIR))
-            if fp:
-                files.append(fp)
 
-        caption_text, caption_entities = safe_caption_for_media(caption_src)
+async def backfill_source(source_channel: str, sem: asyncio.Semaphore) -> int:
+    """
+    Догон одного источника: история новее отметки, затем живые посты,
+    накопленные за это время, — всё одним потоком по возрастанию id.
+    Чтение истории повторяется (FloodWait — после указанной паузы, прочие
+    ошибки — с нарастающей); если оно так и не удалось, живые посты всё
+    равно уходят, но отметка остаётся на месте до перезапуска.
+    """
+    posts = []
+    peer = source_peers.get(source_channel, source_channel)
+    async with sem:
+        after_id = store.get_watermark(source_channel)
+        for attempt in range(BACKFILL_RETRIES + 1):
+            try:
+                if after_id is None:
+                    # первый запуск: историю не зеркалим, только ставим отметку
+                    latest = await flood_retry(client.get_messages, peer, limit=1)
+                    if latest:
+                        store.set_watermark(source_channel, latest[0].id)
+                else:
+                    since = time.time() - BACKFILL_MAX_AGE_HOURS * 3600 if BACKFILL_MAX_AGE_HOURS else None
+                    posts = await flood_retry(
+                        fetch_missed,
+                        client,
+                        peer,
+                        after_id,
+                        BACKFILL_MAX_MESSAGES,
+                        since,
+                        BACKFILL_REQUEST_INTERVAL,
+                    )
+                break
+            except Exception as e:
+                if attempt < BACKFILL_RETRIES:
+                    delay = 5 * 2 ** attempt
+                    log.warning(f"⚠️ Не удалось догнать {source_channel}: {e}, повтор через {delay}s")
+                    await asyncio.sleep(delay)
+                    continue
+                log.warning(
+                    f"⚠️ Не удалось догнать {source_channel}: {e}. "
+                    f"Отметка остаётся на #{after_id}, пропущенное догоним после перезапуска"
+                )
+                if after_id is not None:
+                    watermarks.hold(source_channel, after_id)
+
+    submitted: set[int] = set()
+    count = 0
+    buffer = backfill_buffers.setdefault(source_channel, [])
+    # пока идут submit (очередь может быть полна), живые посты продолжают копиться в буфере
+    while posts or buffer:
+        pending = sorted(posts + buffer, key=lambda p: p[0].id)
+        posts = []
+        buffer.clear()
+        for post in pending:
+            ids = {m.id for m in post}
+            if ids & submitted:
+                continue
+            submitted |= ids
+            if already_mirrored(source_channel, post):
+                continue
+            await submit_post(source_channel, post)
+            count += 1
+    backfill_buffers.pop(source_channel, None)
+    return count
 
-        if not files:
-            sent = await client.send_message(
-                TARGET_CHANNEL_ID,
-                caption_text,
-                formatting_entities=caption_entities,
-                link_preview=False
-            )
-            state["album"][album_key] = {"target_msg_ids": [sent.id], "caption_msg_id": sent.id}
-            save_map(state)
-            return
 
-        # Важный фикс: если в альбоме есть видео — отправляем по одному,
-        # потому что с thumb/атрибутами в альбомах у Telethon бывают проблемы. [web:17]
-        if any(m.video for m in media_msgs):
-            print("🎬 В альбоме есть видео -> отправляем по одному (fix preview/streaming)")
-            target_ids: list[int] = []
-            caption_msg_id = None
-
-            for idx, (m, fp) in enumerate(zip(media_msgs, files)):
-                sent = await send_media_file(
-                    file_path=fp,
-                    caption_text=caption_text if idx == 0 else "",
-                    caption_entities=caption_entities if idx == 0 else [],
-                    is_video=bool(m.video),
-                )
-                if sent:
-                    target_ids.append(sent.id)
-                    if caption_msg_id is None:
-                        caption_msg_id = sent.id
+async def run_backfill() -> None:
+    t0 = time.monotonic()
+    sem = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+    counts = await asyncio.gather(*(backfill_source(ch, sem) for ch in SOURCE_CHANNELS))
+    log.info(f"⏪ Догон завершён за {time.monotonic() - t0:.1f}s: {sum(counts)} постов в очереди")
+
+
+edits_total = metrics.REGISTRY.counter(
+    "xoster_edits_total", "Правки постов источника (edited, unchanged, unknown, failed, ad)"
+)
+deletes_total = metrics.REGISTRY.counter("xoster_deletes_total", "Сообщения, удалённые в целевых каналах вслед за источником")
 
-                cleanup_media(fp)
 
-            state["album"][album_key] = {"target_msg_ids": target_ids, "caption_msg_id": caption_msg_id}
-            save_map(state)
-            cleanup_workdir()
-            print(f"✅ Альбом отправлен по одному ({len(target_ids)} сообщений)")
+async def propagate_edit(key: tuple[str, int], msg) -> None:
+    """
+    Последняя правка из серии (см. Debouncer): новый текст один раз проходит
+    переписывание и одной правкой уходит в каждый целевой канал.
+    Если текст не изменился (правили медиа, кнопки, форматирование), AI не зовём.
+    Изменённый текст заново проходит проверку на рекламу: если правка сделала
+    пост рекламой, копии в целевых каналах удаляются.
+    Пока идёт переписывание, пост могут удалить: перед каждой правкой
+    проверяем, что соответствие ещё в индексе.
+    """
+    source_channel, msg_id = key
+    if key in inflight_msgs:
+        # пост ещё обрабатывается, соответствий пока нет — подождём
+        edit_debouncer.requeue(key, msg)
+        return
+
+    mappings = mirror_index.lookup(source_channel, msg_id, msg.grouped_id)
+    if not mappings:
+        # пост не зеркалили (реклама, дубликат) или соответствие уже удалено
+        edits_total.inc(result="unknown")
+        return
+
+    text = msg.message or ""
+    digest = text_hash(text)
+    # у альбома подпись одна, правки элементов без текста её не меняют
+    if all(m.text_hash == digest for m in mappings) or (msg.grouped_id and not text):
+        log.info(f"✏️ Правка #{msg_id} из {source_channel} без изменения текста — пропускаем")
+        edits_total.inc(result="unchanged")
+        return
+
+    new_text = ""
+    if text:
+        # правкой новость можно превратить в рекламу — проверяем, как новый пост
+        with metrics.stage("ad_check"):
+            async with ad_check_slot():
+                is_ad, rewritten = await classify_and_rewrite(text)
+        if is_ad:
+            log.info(f"🚫 Правка #{msg_id} из {source_channel} сделала пост рекламой — удаляем копии")
+            edits_total.inc(result="ad")
+            await delete_in_targets(source_channel, [(m, mirror_index.drop(m)) for m in mappings])
             return
+        new_text = rewritten or await rewrite_stage(text)
+
+    edited = failed = 0
+    for m in mappings:
+        target = TARGETS_BY_KEY.get(m.target)
+        if target is None or m.caption_msg_id is None or not mirror_index.contains(m):
+            continue
+        if m.kind == "single" and not msg.media:
+            body, entities = safe_text_for_message(new_text, target)
+        else:
+            body, entities = safe_caption_for_media(new_text, target)
+        try:
+            await send_to_target(
+                target,
+                client.edit_message,
+                m.caption_msg_id,
+                text=body,
+                formatting_entities=entities,
+                link_preview=False,
+            )
+        except errors.MessageNotModifiedError:
+            pass
+        except Exception as e:
+            log.warning(f"⚠️ Не удалось отредактировать #{m.caption_msg_id} в {target.channel_id}: {e}")
+            failed += 1
+            continue
+        edited += 1
+        mirror_index.set_text_hash(m, digest)
+
+    if edited:
+        edits_total.inc(result="edited")
+        log.info(f"✏️ Правка #{msg_id} из {source_channel} отражена в {edited} канал(ах)")
+    elif failed:
+        edits_total.inc(result="failed")
+    else:
+        # все соответствия удалили, пока шло переписывание
+        edits_total.inc(result="unknown")
+
+
+edit_debouncer = Debouncer(propagate_edit, EDIT_DEBOUNCE_SECONDS)
+
+
+async def propagate_delete(source_channel: str, msg_ids: list[int]) -> None:
+    """Удалённые в источнике сообщения удаляются и во всех целевых каналах."""
+    for msg_id in msg_ids:
+        edit_debouncer.cancel((source_channel, msg_id))
+    await delete_in_targets(source_channel, mirror_index.remove(source_channel, msg_ids))
+
+
+async def delete_in_targets(source_channel: str, removed: list[tuple[Mapping, list[int]]]) -> None:
+    """Удаление id в целевых каналах одним запросом на канал."""
+    by_target: dict[int, list[int]] = {}
+    for m, ids in removed:
+        by_target.setdefault(m.target, []).extend(ids)
+
+    for key, ids in by_target.items():
+        target = TARGETS_BY_KEY.get(key)
+        if target is None or not ids:
+            continue
+        try:
+            await send_to_target(target, client.delete_messages, ids)
+        except Exception as e:
+            log.warning(f"⚠️ Не удалось удалить {ids} в {target.channel_id}: {e}")
+            continue
+        deletes_total.inc(len(ids))
+        log.info(f"🗑️ Удалено в {target.channel_id}: {len(ids)} сообщ. поста из {source_channel}")
 
-        # Если видео нет — можно слать настоящим альбомом (быстрее)
-        sent_messages = await client.send_file(
-            TARGET_CHANNEL_ID,
-            files,
-            caption=caption_text,
-            force_document=False,
-            formatting_entities=caption_entities,
-            supports_streaming=False,
-        )
 
-        sent_list = sent_messages if isinstance(sent_messages, list) else [sent_messages]
-        target_ids = [m.id for m in sent_list if m]
-        caption_msg_id = target_ids[0] if target_ids else None
+def register_handlers_for_source(source_channel: str, peer: Any = None):
+    """
+    Обработчики только ставят задачу в общий планировщик;
+    сама цепочка classify -> dedup -> rewrite -> download -> send идёт в воркерах.
+    Во время догона живые посты ждут в backfill_buffers, чтобы не обогнать историю.
+    peer — уже найденный input peer: тогда Telethon не резолвит username заново.
+    """
+    scheduler.add_source(source_channel)
+    chats = peer or source_channel
 
-        state["album"][album_key] = {"target_msg_ids": target_ids, "caption_msg_id": caption_msg_id}
-        save_map(state)
-        print(f"✅ Альбом отправлен ({len(target_ids)} сообщений)")
+    @client.on(events.NewMessage(chats=chats))
+    async def on_new_message(event):
+        msg = event.message
+        if msg.grouped_id:
+            return
+        if source_channel in backfill_buffers:
+            backfill_buffers[source_channel].append([msg])
+            return
+        await submit_post(source_channel, [msg])
 
-        for fp in files:
-            cleanup_media(fp)
-        cleanup_workdir()
+    @client.on(events.Album(chats=chats))
+    async def on_album(event):
+        msgs = list(event.messages)
+        if source_channel in backfill_buffers:
+            backfill_buffers[source_channel].append(msgs)
+            return
+        await submit_post(source_channel, msgs)
 
+    if MIRROR_EDITS:
+        @client.on(events.MessageEdited(chats=chats))
+        async def on_edit(event):
+            edit_debouncer.push((source_channel, event.message.id), event.message)
 
-for ch in SOURCE_CHANNELS:
-    register_handlers_for_source(ch)
+    if MIRROR_DELETES:
+        @client.on(events.MessageDeleted(chats=chats))
+        async def on_delete(event):
+            await propagate_delete(source_channel, list(event.deleted_ids))
 
 
 async def main():
+    t_init = time.monotonic() - BOOT_T0
+    if SHARDED:
+        # первый пульс до подключения: резолв каналов на холодном старте бывает долгим
+        heartbeat("starting")
+    if BACKFILL_ENABLED:
+        # буферы до подключения: апдейты могут прийти сразу после client.start
+        for ch in SOURCE_CHANNELS:
+            backfill_buffers[ch] = []
+    t0 = time.monotonic()
     await client.start(phone=PHONE)
+    t_connect = time.monotonic() - t0
+
+    # каналы из кэша пиров — без сети, остальные параллельно в пределах PEER_RESOLVE_RATE;
+    # апдейты до регистрации обработчиков подберёт догон (они новее отметки)
+    t0 = time.monotonic()
+    resolved = await peers.resolve_all(client, [target.channel_id for target in TARGETS] + SOURCE_CHANNELS)
+    t_resolve = time.monotonic() - t0
 
     global TARGET_PEER
-    TARGET_PEER = await client.get_input_entity(TARGET_CHANNEL_ID)
+    for target in TARGETS:
+        target.peer = resolved.get(target.channel_id)
+        if target.peer is None:
+            raise RuntimeError(f"Целевой канал {target.channel_id} не найден: аккаунт должен в нём состоять")
+    TARGET_PEER = TARGETS[0].peer
 
-    # проверим источники (не обязательно, но удобно)
     for ch in SOURCE_CHANNELS:
-        try:
-            await client.get_entity(ch)
-        except Exception:
-            pass
-
-    await client.get_entity(TARGET_CHANNEL_ID)
-
-    print("\n🚀 Mirror started (PRIVATE TARGET + clickable TITLE footer + dedup + AI + AD FILTER + VIDEO FIX)")
-    print(f"   Sources: {', '.join(SOURCE_CHANNELS)}")
-    print(f"   Target (private id): {TARGET_CHANNEL_ID}")
-    print(f"   Footer title: {TARGET_TITLE or '-'}")
-    print(f"   Footer link: {TARGET_LINK or '-'}")
-    print(f"   Dedup threshold: {TRIGRAM_THRESHOLD:.0%}")
-    print(f"   AI Model: {DEEPSEEK_MODEL}")
-    print(f"   Premium emoji ID: {PREMIUM_EMOJI_ID}")
-    print(f"   ffmpeg available: {'yes' if has_ffmpeg() else 'no'}")
-    print(f"   AI retries: 3 (гарантия непустого текста)\n")
-
-    await client.run_until_disconnected()
+        if ch in resolved:
+            source_peers[ch] = resolved[ch]
+        register_handlers_for_source(ch, resolved.get(ch))
+
+    log.info("🚀 Mirror started (PRIVATE TARGET + clickable TITLE footer + dedup + AI + AD FILTER + VIDEO FIX)")
+    log.info(f"   Sources: {', '.join(SOURCE_CHANNELS) or '-'}")
+    if SHARDED:
+        log.info(f"   Shard: {SHARD_INDEX + 1}/{SHARD_COUNT}, session {TG_SESSION}")
+    for target in TARGETS:
+        log.info(
+            f"   Target (private id): {target.channel_id}, footer {target.title or '-'} -> {target.link or '-'}, "
+            f"sources {', '.join(sorted(target.sources)) if target.sources else 'all'}"
+        )
+    log.info(f"   Dedup threshold: {TRIGRAM_THRESHOLD:.0%}")
+    log.info(f"   Dedup index: {dedup.stats()}")
+    log.info(f"   Media dedup: {media_index.stats() if media_index else 'off'}")
+    log.info(f"   State backend: {STATE_BACKEND} ({STATE_DB_FILE if STATE_BACKEND == 'sqlite' else MAP_FILE})")
+    log.info(f"   AI Model: {DEEPSEEK_MODEL}")
+    log.info(f"   Premium emoji ID: {PREMIUM_EMOJI_ID}")
+    log.info(f"   Scheduler: {SCHED_WORKERS} workers, queue {SCHED_QUEUE_SIZE}/source, ai {SCHED_AI_WORKERS}")
+    log.info(f"   Send rate: {SEND_RATE}/s, burst {SEND_BURST}")
+    log.info(f"   Reupload by reference: {'on' if REUPLOAD_BY_REFERENCE else 'off'}")
+    log.info(
+        "   Backfill: "
+        + (f"<= {BACKFILL_MAX_MESSAGES} msgs/source, max age "
+           f"{f'{BACKFILL_MAX_AGE_HOURS:g} h' if BACKFILL_MAX_AGE_HOURS else 'unlimited'}"
+           if BACKFILL_ENABLED else "off")
+    )
+    log.info(f"   ffmpeg available: {'yes' if has_ffmpeg() else 'no'} (concurrency {MEDIA_CONCURRENCY})")
+    log.info(
+        "   Media optimize: "
+        + (f"video > {VIDEO_REENCODE_ABOVE_MB:.0f} MB or > {VIDEO_MAX_HEIGHT}p -> crf {VIDEO_CRF}, "
+           f"faststart {'on' if VIDEO_FASTSTART else 'off'}, photo > {PHOTO_RECOMPRESS_ABOVE_MB:g} MB"
+           if optimizer else "off")
+    )
+    log.info(f"   Media cache: {media_store.stats()}")
+    log.info(f"   Ad check batching: {f'{AD_BATCH_SIZE} texts / {AD_BATCH_DELAY_MS:.0f} ms' if ad_batcher else 'off'}")
+    log.info(f"   AI combined classify+rewrite: {'on' if AI_COMBINED else 'off'}")
+    log.info(f"   Speculative pipeline: {'on' if SPECULATIVE_PIPELINE else 'off'}")
+    log.info(
+        f"   Edits: {f'on (debounce {EDIT_DEBOUNCE_SECONDS:g}s)' if MIRROR_EDITS else 'off'}, "
+        f"deletes: {'on' if MIRROR_DELETES else 'off'}, mappings in memory: {len(mirror_index)}"
+    )
+    log.info(
+        f"   AI resilience: {AI_RETRIES} retries, breaker {AI_BREAKER_FAILURES}/{AI_BREAKER_RESET:.0f}s, "
+        f"hedge {f'p{AI_HEDGE_PERCENTILE:.0f}' if AI_HEDGE_PERCENTILE else 'off'}, "
+        f"fallback model {AI_FALLBACK_MODEL or '-'}"
+    )
+    log.info(f"   AI cache: {ai_cache.stats() if ai_cache else 'off'}")
+    log.info(f"   Local ad model: {ad_model.stats() if ad_model else 'off'}")
+    log.info(f"   AI pool: {AI_MAX_CONNECTIONS} conn, {AI_MAX_IN_FLIGHT} in-flight, http2={'on' if AI_HTTP2 else 'off'}")
+    log.info(f"   Peer cache: {peers.stats()}")
+    log.info(f"   Metrics: {f'http://{METRICS_HOST}:{METRICS_PORT}/metrics' if METRICS_PORT else 'off'}")
+
+    register_metrics()
+    metrics_server = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
+    flusher = asyncio.create_task(flush_state_periodically())
+    scheduler.start()
+    backfill = asyncio.create_task(run_backfill()) if BACKFILL_ENABLED else None
+
+    global startup_seconds
+    startup_seconds = time.monotonic() - BOOT_T0
+    log.info(
+        f"⏱ Старт за {startup_seconds:.1f}s: инициализация {t_init:.1f}s, подключение {t_connect:.1f}s, "
+        f"каналы {t_resolve:.1f}s ({peers.hits} из кэша, {peers.resolved} найдено, {peers.failed} ошибок)"
+    )
+    try:
+        await client.run_until_disconnected()
+    finally:
+        if backfill:
+            backfill.cancel()
+        flusher.cancel()
+        await edit_debouncer.close()
+        await scheduler.stop()
+        log.info(f"📊 Scheduler stats: {scheduler.stats()}")
+        log.info(f"📊 Send limiter stats: {limiter.stats()}")
+        log.info(
+            f"📊 Edits: {edit_debouncer.stats()}, "
+            + ", ".join(f"{r}={edits_total.get(result=r):.0f}" for r in ("edited", "unchanged", "unknown", "failed", "ad"))
+            + f", deleted={deletes_total.get():.0f}"
+        )
+        log.info(f"📊 AI pool stats: {ai.stats()}")
+        if ad_batcher:
+            await ad_batcher.close()
+            log.info(f"📊 Ad batch stats: {ad_batcher.stats()}")
+        if SPECULATIVE_PIPELINE:
+            saved = speculative_saved.values.get((), [None, 0, 0.0])
+            log.info(
+                f"📊 Speculative: saved {saved[2]:.1f}s over {saved[1]} posts, "
+                + ", ".join(
+                    f"{work} used={speculative_total.get(work=work, result='used'):.0f} "
+                    f"wasted={speculative_total.get(work=work, result='wasted'):.0f}"
+                    for work in ("rewrite", "download")
+                )
+            )
+        log.info(f"📊 Media stats: {media.stats()}")
+        log.info(
+            f"📊 Media paths: reference={media_path_total.get(path='reference'):.0f}, "
+            f"download={media_path_total.get(path='download'):.0f}, "
+            f"fanout={media_path_total.get(path='fanout'):.0f}, "
+            f"bytes avoided={metrics.bytes_total.get(direction='avoided'):.0f}"
+        )
+        if optimizer:
+            log.info(f"📊 Media optimize stats: {optimizer.stats()}")
+        log.info(f"📊 Media cache stats: {media_store.stats()}")
+        media_store.close()
+        if metrics_server:
+            metrics_server.close()
+        await ai.aclose()
+        dedup.close()
+        if media_index:
+            log.info(f"📊 Media dedup stats: {media_index.stats()}")
+            media_index.close()
+        store.close()
+        if ai_cache:
+            log.info(f"📊 AI cache stats: {ai_cache.stats()}")
+            ai_cache.close()
+        if ad_model:
+            log.info(f"📊 Local ad model stats: {ad_model.stats()}")
+            ad_model.close()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
-    import asyncio
-
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,347 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_VIDEO_SIZE_RE = re.compile(r"Stream #\d+:\d+.*?: Video:.*?(\d{2,5})x(\d{2,5})")
+
+
+def has_ffmpeg() -> bool:
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+
+@dataclass
+class VideoMeta:
+    duration: int = 0
+    width: int = 0
+    height: int = 0
+    thumb: Optional[Path] = None
+    timings: dict = field(default_factory=dict)
+
+
+async def run_process(cmd: list[str], timeout: float, input: Optional[bytes] = None) -> tuple[int, bytes, bytes]:
+    """
+    Асинхронный subprocess с таймаутом: event loop не блокируется,
+    процесс убивается по таймауту и при отмене задачи — иначе ffmpeg
+    дорабатывал бы до таймаута в уже удалённом каталоге задачи.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE if input is not None else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(input), timeout=timeout)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    return proc.returncode, stdout, stderr
+
+
+def parse_ffmpeg_info(stderr: str) -> tuple[int, int, int]:
+    """duration(sec), width, height из вывода `ffmpeg -i` (stderr)."""
+    dur = w = h = 0
+    m = _DURATION_RE.search(stderr)
+    if m:
+        dur = int(int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3)))
+    m = _VIDEO_SIZE_RE.search(stderr)
+    if m:
+        w, h = int(m.group(1)), int(m.group(2))
+    return dur, w, h
+
+
+def is_faststart(path: str) -> bool:
+    """
+    moov-атом MP4 лежит до mdat — плеер может начать воспроизведение
+    до полной загрузки. Читаем только заголовки атомов верхнего уровня.
+    """
+    try:
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return False
+                size = int.from_bytes(header[:4], "big")
+                kind = header[4:8]
+                if kind == b"moov":
+                    return True
+                if kind == b"mdat":
+                    return False
+                if size == 1:
+                    size = int.from_bytes(f.read(8), "big") - 8
+                elif size == 0:
+                    return False
+                f.seek(size - 8, os.SEEK_CUR)
+    except OSError:
+        return False
+
+
+class MediaPreparer:
+    """
+    Подготовка видео к отправке вне event loop: один проход ffmpeg читает
+    длительность/размер из заголовка и сразу снимает JPEG-превью.
+    Число одновременных ffmpeg ограничено concurrency.
+    """
+
+    def __init__(self, concurrency: int = 2, probe_timeout: float = 10.0, thumb_timeout: float = 15.0):
+        self.concurrency = concurrency
+        self.probe_timeout = probe_timeout
+        self.thumb_timeout = thumb_timeout
+        self._sem = asyncio.Semaphore(concurrency)
+        self.ffmpeg = shutil.which("ffmpeg") is not None
+        self.ffprobe = shutil.which("ffprobe") is not None
+
+        self.prepared = 0
+        self.failures = 0
+        self.total_timings: dict[str, float] = {}
+
+    async def prepare_video(self, path: str, thumb_path: Path) -> VideoMeta:
+        """
+        Если ffmpeg/ffprobe недоступны или что-то пошло не так —
+        вернём нули и без превью (Telegram переживёт).
+        """
+        meta = VideoMeta()
+        t0 = time.monotonic()
+        async with self._sem:
+            meta.timings["wait"] = time.monotonic() - t0
+            t1 = time.monotonic()
+            try:
+                if self.ffmpeg:
+                    await self._probe_and_thumb(path, thumb_path, meta)
+                elif self.ffprobe:
+                    await self._probe_only(path, meta)
+            except Exception as e:
+                self.failures += 1
+                log.warning(f"⚠️ Ошибка подготовки видео {Path(path).name}: {e!r}")
+            meta.timings["ffmpeg"] = time.monotonic() - t1
+
+        self.prepared += 1
+        for stage, value in meta.timings.items():
+            self.total_timings[stage] = self.total_timings.get(stage, 0.0) + value
+        return meta
+
+    async def _probe_and_thumb(self, path: str, thumb_path: Path, meta: VideoMeta) -> None:
+        cmd = [
+            "ffmpeg", "-hide_banner", "-y",
+            "-ss", "1",
+            "-i", path,
+            "-frames:v", "1",
+            "-vf", "scale=320:-1",
+            str(thumb_path)
+        ]
+        _, _, stderr = await run_process(cmd, timeout=self.thumb_timeout)
+        meta.duration, meta.width, meta.height = parse_ffmpeg_info(stderr.decode("utf-8", "replace"))
+        if thumb_path.exists():
+            meta.thumb = thumb_path
+
+    async def _probe_only(self, path: str, meta: VideoMeta) -> None:
+        cmd = [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=width,height:format=duration",
+            "-of", "json",
+            path
+        ]
+        _, stdout, _ = await run_process(cmd, timeout=self.probe_timeout)
+        data = json.loads(stdout or b"{}")
+        streams = data.get("streams") or [{}]
+        fmt = data.get("format") or {}
+        meta.width = int(streams[0].get("width") or 0)
+        meta.height = int(streams[0].get("height") or 0)
+        meta.duration = int(float(fmt.get("duration") or 0))
+
+    async def decode_gray(self, data: bytes, size: int) -> Optional[bytes]:
+        """Картинка (JPEG превью) -> size x size байт оттенков серого; None, если не вышло."""
+        if not self.ffmpeg:
+            return None
+        cmd = [
+            "ffmpeg", "-hide_banner", "-v", "error",
+            "-i", "pipe:0",
+            "-frames:v", "1",
+            "-vf", f"scale={size}:{size}:flags=area,format=gray",
+            "-f", "rawvideo", "pipe:1",
+        ]
+        async with self._sem:
+            try:
+                code, stdout, _ = await run_process(cmd, timeout=self.probe_timeout, input=data)
+            except Exception as e:
+                log.warning(f"⚠️ Ошибка декодирования превью: {e!r}")
+                return None
+        if code != 0 or len(stdout) != size * size:
+            return None
+        return stdout
+
+    def stats(self) -> dict:
+        return {
+            "prepared": self.prepared,
+            "failures": self.failures,
+            "concurrency": self.concurrency,
+            "avg_timings": {
+                stage: round(total / self.prepared, 3) for stage, total in self.total_timings.items()
+            } if self.prepared else {},
+        }
+
+
+class MediaOptimizer:
+    """
+    Уменьшение файлов перед загрузкой в Telegram: CPU в обмен на канал.
+    - MP4 без faststart перепаковывается (-c copy -movflags +faststart);
+    - видео больше video_max_bytes или выше video_max_height
+      перекодируется в H.264 с CRF и уменьшением до video_max_height;
+    - фото больше photo_max_bytes или со стороной больше photo_max_side
+      пережимаются в JPEG.
+    Если результат не меньше исходника — остаётся исходник. Исходник
+    после удачной оптимизации удаляется.
+    """
+
+    def __init__(
+            self,
+            concurrency: int = 1,
+            timeout: float = 900.0,
+            faststart: bool = True,
+            video_max_bytes: int = 50 * 1024 * 1024,
+            video_max_height: int = 1080,
+            crf: int = 26,
+            preset: str = "veryfast",
+            photo_max_bytes: int = 1024 * 1024,
+            photo_max_side: int = 2560,
+            photo_qscale: int = 4,
+    ):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.faststart = faststart
+        self.video_max_bytes = video_max_bytes
+        self.video_max_height = video_max_height
+        self.crf = crf
+        self.preset = preset
+        self.photo_max_bytes = photo_max_bytes
+        self.photo_max_side = photo_max_side
+        self.photo_qscale = photo_qscale
+        self._sem = asyncio.Semaphore(concurrency)
+        self.ffmpeg = shutil.which("ffmpeg") is not None
+
+        # action -> [файлов, байт до, байт после, секунд]
+        self.report: dict[str, list] = {}
+        self.failures = 0
+
+    async def _run(self, action: str, src: str, dst: Path, cmd: list[str]) -> Optional[str]:
+        t0 = time.monotonic()
+        async with self._sem:
+            try:
+                code, _, stderr = await run_process(cmd, timeout=self.timeout)
+            except Exception as e:
+                code, stderr = -1, repr(e).encode()
+        elapsed = time.monotonic() - t0
+
+        before = os.path.getsize(src)
+        after = dst.stat().st_size if code == 0 and dst.exists() else 0
+        if not after or after >= before:
+            if code != 0:
+                self.failures += 1
+                log.warning(f"⚠️ Оптимизация {action} {Path(src).name} не удалась: {stderr.decode('utf-8', 'replace')[-200:]}")
+            dst.unlink(missing_ok=True)
+            after = before
+            result = None
+        else:
+            os.unlink(src)
+            result = str(dst)
+
+        entry = self.report.setdefault(action, [0, 0, 0, 0.0])
+        entry[0] += 1
+        entry[1] += before
+        entry[2] += after
+        entry[3] += elapsed
+        if result:
+            log.info(
+                f"🗜 {action}: {Path(src).name} {before / 1024 / 1024:.1f} -> {after / 1024 / 1024:.1f} МБ "
+                f"за {elapsed:.1f}s"
+            )
+        return result
+
+    async def optimize_video(self, path: str, meta: VideoMeta) -> str:
+        """Путь к файлу для загрузки; meta.width/height обновляются при уменьшении."""
+        if not self.ffmpeg:
+            return path
+        size = os.path.getsize(path)
+        too_tall = self.video_max_height and meta.height > self.video_max_height
+        if (self.video_max_bytes and size > self.video_max_bytes) or too_tall:
+            dst = Path(path).with_suffix(".opt.mp4")
+            cmd = [
+                "ffmpeg", "-hide_banner", "-v", "error", "-y",
+                "-i", path,
+                "-vf", f"scale=-2:'min(ih,{self.video_max_height})'",
+                "-c:v", "libx264", "-crf", str(self.crf), "-preset", self.preset,
+                "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-b:a", "128k",
+                "-movflags", "+faststart",
+                str(dst),
+            ]
+            result = await self._run("video_reencode", path, dst, cmd)
+            if result:
+                if too_tall and meta.height:
+                    meta.width = round(meta.width * self.video_max_height / meta.height / 2) * 2
+                    meta.height = self.video_max_height
+                return result
+        if self.faststart and Path(path).suffix.lower() in (".mp4", ".mov", ".m4v") and not is_faststart(path):
+            dst = Path(path).with_suffix(".fs.mp4")
+            cmd = ["ffmpeg", "-hide_banner", "-v", "error", "-y", "-i", path, "-c", "copy", "-movflags", "+faststart", str(dst)]
+            # перепаковка не уменьшает файл: сравнение размеров тут не подходит
+            t0 = time.monotonic()
+            async with self._sem:
+                try:
+                    code, _, _ = await run_process(cmd, timeout=self.timeout)
+                except Exception:
+                    code = -1
+            entry = self.report.setdefault("faststart", [0, 0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += size
+            entry[3] += time.monotonic() - t0
+            if code == 0 and dst.exists():
+                entry[2] += dst.stat().st_size
+                os.unlink(path)
+                return str(dst)
+            entry[2] += size
+            self.failures += 1
+            dst.unlink(missing_ok=True)
+        return path
+
+    async def optimize_photo(self, path: str) -> str:
+        if not self.ffmpeg:
+            return path
+        size = os.path.getsize(path)
+        if not self.photo_max_bytes or size <= self.photo_max_bytes:
+            return path
+        side = self.photo_max_side
+        dst = Path(path).with_suffix(".opt.jpg")
+        cmd = [
+            "ffmpeg", "-hide_banner", "-v", "error", "-y",
+            "-i", path,
+            "-vf", f"scale='min(iw,{side})':'min(ih,{side})':force_original_aspect_ratio=decrease",
+            "-q:v", str(self.photo_qscale),
+            str(dst),
+        ]
+        return await self._run("photo_recompress", path, dst, cmd) or path
+
+    def stats(self) -> dict:
+        report = {
+            action: {
+                "files": files,
+                "bytes_saved": before - after,
+                "saved_ratio": round(1 - after / before, 3) if before else 0.0,
+                "seconds": round(seconds, 2),
+            }
+            for action, (files, before, after, seconds) in self.report.items()
+        }
+        return {"failures": self.failures, "actions": report}
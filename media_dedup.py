@@ -0,0 +1,236 @@
+import logging
+import math
+import os
+import struct
+import time
+from collections import OrderedDict
+from itertools import combinations
+from pathlib import Path
+from typing import Iterable, Optional
+
+log = logging.getLogger(__name__)
+
+HASH_SIZE = 32  # сторона серого кадра, из которого считаются хэши
+_MAGIC = b"XMHI"
+_VERSION = 1
+_REC = struct.Struct("<qdqq")
+
+# DCT-II по 32 точкам, нужны только 8 низших частот
+_DCT = [[math.cos(math.pi * (2 * x + 1) * u / (2 * HASH_SIZE)) for x in range(HASH_SIZE)] for u in range(8)]
+
+
+def _bits(values: list[float], threshold: float) -> int:
+    h = 0
+    for v in values:
+        h = (h << 1) | (v > threshold)
+    return h
+
+
+def phash(gray: bytes) -> int:
+    """pHash: DCT 32x32, 8x8 низших частот без DC, порог — медиана."""
+    n = HASH_SIZE
+    rows = [gray[y * n:(y + 1) * n] for y in range(n)]
+    # сначала строки (8 коэффициентов на строку), потом столбцы
+    row_dct = [[sum(c * p for c, p in zip(cu, row)) for cu in _DCT] for row in rows]
+    coeffs = []
+    for v in range(8):
+        cv = _DCT[v]
+        for u in range(8):
+            coeffs.append(sum(cv[y] * row_dct[y][u] for y in range(n)))
+    ac = coeffs[1:]
+    median = sorted(ac)[len(ac) // 2]
+    return _bits(coeffs[:1] + ac, median) & ((1 << 64) - 1)
+
+
+def dhash(gray: bytes) -> int:
+    """dHash: кадр сжат до 9x8 усреднением блоков, бит — ярче ли пиксель соседа справа."""
+    n = HASH_SIZE
+    cells = []
+    for y in range(8):
+        y0, y1 = y * n // 8, (y + 1) * n // 8
+        for x in range(9):
+            x0, x1 = x * n // 9, (x + 1) * n // 9
+            total = sum(sum(gray[yy * n + x0:yy * n + x1]) for yy in range(y0, y1))
+            cells.append(total / ((y1 - y0) * (x1 - x0)))
+    h = 0
+    for y in range(8):
+        for x in range(8):
+            h = (h << 1) | (cells[y * 9 + x] > cells[y * 9 + x + 1])
+    return h
+
+
+def is_flat(gray: bytes, min_std: float = 8.0) -> bool:
+    """Однотонные кадры (чёрный экран, заливка) дают одинаковые хэши — их не сравниваем."""
+    mean = sum(gray) / len(gray)
+    return math.sqrt(sum((p - mean) ** 2 for p in gray) / len(gray)) < min_std
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _to_signed(h: int) -> int:
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+def _to_unsigned(h: int) -> int:
+    return h + (1 << 64) if h < 0 else h
+
+
+class MediaHashFileStore:
+    """Хэши медиа в бинарном файле (для json-бэкенда): заголовок + записи (id, ts, phash, dhash)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.records = 0
+        self._fh = None
+
+    def load(self, limit: int) -> list[tuple[int, float, int, int]]:
+        if not self.path.exists():
+            self.path.write_bytes(_MAGIC + struct.pack("<H", _VERSION))
+            return []
+        data = self.path.read_bytes()
+        header = _MAGIC + struct.pack("<H", _VERSION)
+        if data[:len(header)] != header:
+            log.warning(f"⚠️ Индекс хэшей медиа {self.path} несовместим, создаём заново")
+            self.path.write_bytes(header)
+            return []
+        body = memoryview(data)[len(header):]
+        self.records = len(body) // _REC.size
+        return [_REC.unpack_from(body, i * _REC.size) for i in range(max(0, self.records - limit), self.records)]
+
+    def append(self, entry_id: int, ts: float, ph: int, dh: int) -> None:
+        if self._fh is None:
+            self._fh = open(self.path, "ab")
+        self._fh.write(_REC.pack(entry_id, ts, ph, dh))
+        self._fh.flush()
+        self.records += 1
+
+    def compact(self, entries: Iterable[tuple[int, float, int, int]]) -> None:
+        self.close()
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        count = 0
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC + struct.pack("<H", _VERSION))
+            for entry in entries:
+                f.write(_REC.pack(*entry))
+                count += 1
+        os.replace(tmp, self.path)
+        self.records = count
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class MediaHashIndex:
+    """
+    Поиск почти-одинаковых картинок по расстоянию Хэмминга (multi-index
+    hashing): pHash делится на 4 куска по 16 бит, при расстоянии <= d хотя бы
+    один кусок отличается не более чем на d // 4 бит — перебираем только
+    такие соседние значения кусков. Кандидат подтверждается по pHash и dHash.
+    """
+
+    def __init__(self, max_distance: int = 8, capacity: int = 5000, store=None):
+        self.max_distance = max_distance
+        self.capacity = capacity
+        self.store = store
+        self.radius = max_distance // 4
+        self._masks = [0] + [
+            sum(1 << b for b in bits) for r in range(1, self.radius + 1) for bits in combinations(range(16), r)
+        ]
+
+        self._entries: OrderedDict[int, tuple[float, int, int]] = OrderedDict()
+        self._chunks: list[dict[int, set[int]]] = [{} for _ in range(4)]
+        self._next_id = 1
+
+        self.queries = 0
+        self.matches = 0
+
+        if self.store is not None:
+            for entry_id, ts, ph, dh in self.store.load(capacity):
+                self._insert(_to_unsigned(ph), _to_unsigned(dh), ts, entry_id)
+            self._maybe_compact_store()
+
+    @staticmethod
+    def _split(ph: int) -> list[int]:
+        return [(ph >> (16 * i)) & 0xFFFF for i in range(4)]
+
+    def query(self, ph: int, dh: int) -> Optional[int]:
+        """Расстояние до ближайшего совпадения (<= max_distance) или None."""
+        self.queries += 1
+        seen: set[int] = set()
+        best = None
+        for chunk, index in zip(self._split(ph), self._chunks):
+            for mask in self._masks:
+                for entry_id in index.get(chunk ^ mask, ()):
+                    if entry_id in seen:
+                        continue
+                    seen.add(entry_id)
+                    _, eph, edh = self._entries[entry_id]
+                    dist = hamming(ph, eph)
+                    if dist <= self.max_distance and hamming(dh, edh) <= self.max_distance:
+                        if best is None or dist < best:
+                            best = dist
+        if best is not None:
+            self.matches += 1
+        return best
+
+    def add(self, ph: int, dh: int, ts: Optional[float] = None) -> int:
+        ts = ts or time.time()
+        entry_id = self._insert(ph, dh, ts)
+        if self.store is not None:
+            self.store.append(entry_id, ts, _to_signed(ph), _to_signed(dh))
+            self._maybe_compact_store()
+        return entry_id
+
+    def sync(self) -> int:
+        """Хэши, дописанные в общий store другими процессами (см. DedupIndex.sync)."""
+        load_since = getattr(self.store, "load_since", None)
+        if load_since is None:
+            return 0
+        entries = load_since(self._next_id)
+        for entry_id, ts, ph, dh in entries:
+            self._insert(_to_unsigned(ph), _to_unsigned(dh), ts, entry_id)
+        return len(entries)
+
+    def _insert(self, ph: int, dh: int, ts: float, entry_id: Optional[int] = None) -> int:
+        if entry_id is None:
+            entry_id = self._next_id
+        self._next_id = max(self._next_id, entry_id + 1)
+        self._entries[entry_id] = (ts, ph, dh)
+        for chunk, index in zip(self._split(ph), self._chunks):
+            index.setdefault(chunk, set()).add(entry_id)
+
+        while len(self._entries) > self.capacity:
+            old_id, (_, old_ph, _) = self._entries.popitem(last=False)
+            for chunk, index in zip(self._split(old_ph), self._chunks):
+                bucket = index.get(chunk)
+                if bucket is not None:
+                    bucket.discard(old_id)
+                    if not bucket:
+                        del index[chunk]
+        return entry_id
+
+    def _maybe_compact_store(self) -> None:
+        if self.store is not None and self.store.records > 2 * self.capacity:
+            self.store.compact(
+                (entry_id, ts, _to_signed(ph), _to_signed(dh)) for entry_id, (ts, ph, dh) in self._entries.items()
+            )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        if self.store is not None:
+            self.store.close()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "capacity": self.capacity,
+            "max_distance": self.max_distance,
+            "queries": self.queries,
+            "matches": self.matches,
+        }
@@ -0,0 +1,258 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from media import VideoMeta
+
+log = logging.getLogger(__name__)
+
+
+def file_digest(path: str | Path) -> str:
+    """sha256 содержимого (блокирующее чтение — вызывать через asyncio.to_thread)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass
+class CachedMedia:
+    digest: str
+    path: Path
+    size: int
+    meta: Optional[VideoMeta] = None  # для видео: размеры, длительность и превью
+    refs: int = 0
+    used: float = 0.0
+
+
+class MediaStore:
+    """
+    Кэш медиа на диске с адресацией по содержимому:
+    - запись — sha256 скачанного файла; в кэше лежит уже готовый к загрузке
+      файл (после оптимизации) вместе с превью и метаданными ffprobe;
+    - псевдонимы — id фото/документа Telegram: повтор того же медиа не
+      качается вовсе, а перезалитая копия находится по хэшу после скачивания;
+    - объём ограничен max_bytes, вытесняются давно не использованные записи,
+      но только без активных ссылок (refs) — файл, который сейчас грузится
+      или отправляется, не пропадёт;
+    - скачивание и подготовка идут в отдельном каталоге задачи (job_dir),
+      который удаляется по её завершении и не задевает соседние задачи.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.cache_dir = self.root / "cache"
+        self.jobs_dir = self.root / "jobs"
+        self.index_path = self.cache_dir / "index.json"
+        self.max_bytes = max_bytes
+
+        self._entries: OrderedDict[str, CachedMedia] = OrderedDict()  # LRU: давние в начале
+        self._aliases: dict[str, str] = {}
+        self.total = 0
+        self._dirty = False
+
+        self.hits = 0
+        self.digest_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # каталоги задач прошлого запуска (после падения) никому не нужны
+        shutil.rmtree(self.jobs_dir, ignore_errors=True)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    # --- персистентность ---
+
+    def _load(self) -> None:
+        if self.index_path.exists():
+            try:
+                data = json.loads(self.index_path.read_text("utf-8"))
+            except ValueError:
+                log.warning(f"⚠️ Индекс кэша медиа {self.index_path} повреждён, начинаем с пустого")
+                data = {}
+            for digest, e in sorted((data.get("entries") or {}).items(), key=lambda kv: kv[1]["used"]):
+                path = self.cache_dir / e["file"]
+                if not path.exists():
+                    continue
+                meta = None
+                if e.get("meta") is not None:
+                    thumb = self.cache_dir / e["meta"]["thumb"] if e["meta"].get("thumb") else None
+                    meta = VideoMeta(
+                        duration=e["meta"]["duration"],
+                        width=e["meta"]["width"],
+                        height=e["meta"]["height"],
+                        thumb=thumb if thumb and thumb.exists() else None,
+                    )
+                self._entries[digest] = CachedMedia(digest, path, e["size"], meta, used=e["used"])
+                self.total += e["size"]
+            self._aliases = {k: d for k, d in (data.get("aliases") or {}).items() if d in self._entries}
+
+        # файлы, которых нет в индексе, — остатки прерванной записи
+        known = {self.index_path.name}
+        for entry in self._entries.values():
+            known.add(entry.path.name)
+            if entry.meta and entry.meta.thumb:
+                known.add(entry.meta.thumb.name)
+        for p in self.cache_dir.iterdir():
+            if p.is_file() and p.name not in known:
+                p.unlink(missing_ok=True)
+        self._evict()
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        entries = {}
+        for digest, entry in self._entries.items():
+            meta = None
+            if entry.meta is not None:
+                meta = {
+                    "duration": entry.meta.duration,
+                    "width": entry.meta.width,
+                    "height": entry.meta.height,
+                    "thumb": entry.meta.thumb.name if entry.meta.thumb else None,
+                }
+            entries[digest] = {"file": entry.path.name, "size": entry.size, "used": entry.used, "meta": meta}
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"entries": entries, "aliases": self._aliases}), "utf-8")
+        os.replace(tmp, self.index_path)
+        self._dirty = False
+
+    # --- задачи ---
+
+    @contextlib.contextmanager
+    def job_dir(self):
+        """Временный каталог одной задачи; удаляется целиком при выходе."""
+        path = self.jobs_dir / uuid.uuid4().hex
+        path.mkdir(parents=True)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    # --- кэш ---
+
+    @staticmethod
+    def media_key(m) -> Optional[str]:
+        """Псевдоним по id фото/документа Telegram (None — не определить)."""
+        photo_id = getattr(getattr(m, "photo", None), "id", None)
+        if photo_id is not None:
+            return f"photo:{photo_id}"
+        doc_id = getattr(getattr(m, "document", None), "id", None)
+        if doc_id is not None:
+            return f"doc:{doc_id}"
+        return None
+
+    def _acquire(self, entry: CachedMedia) -> CachedMedia:
+        entry.refs += 1
+        entry.used = time.time()
+        self._entries.move_to_end(entry.digest)
+        self.bytes_saved += entry.size
+        self._dirty = True
+        return entry
+
+    def lookup(self, key: Optional[str]) -> Optional[CachedMedia]:
+        """Запись по id Telegram (со ссылкой — вернуть через release) или None."""
+        digest = self._aliases.get(key) if key else None
+        entry = self._entries.get(digest) if digest else None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._acquire(entry)
+
+    def lookup_digest(self, digest: str, key: Optional[str] = None) -> Optional[CachedMedia]:
+        """Запись по хэшу уже скачанного файла; key запоминается как псевдоним."""
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        self.digest_hits += 1
+        if key:
+            self._aliases[key] = digest
+        return self._acquire(entry)
+
+    def put(self, digest: str, path: str | Path, meta: Optional[VideoMeta] = None, key: Optional[str] = None) -> CachedMedia:
+        """
+        Переносит готовый файл (и превью из meta) из каталога задачи в кэш.
+        Возвращает запись со ссылкой.
+        """
+        existing = self._entries.get(digest)
+        if existing is not None:
+            if key:
+                self._aliases[key] = digest
+            return self._acquire(existing)
+
+        path = Path(path)
+        dst = self.cache_dir / f"{digest[:32]}{path.suffix}"
+        os.replace(path, dst)
+        size = dst.stat().st_size
+        if meta is not None and meta.thumb and Path(meta.thumb).exists():
+            thumb = self.cache_dir / f"{digest[:32]}.thumb.jpg"
+            os.replace(meta.thumb, thumb)
+            meta.thumb = thumb
+            size += thumb.stat().st_size
+        elif meta is not None:
+            meta.thumb = None
+
+        entry = CachedMedia(digest, dst, size, meta, refs=1, used=time.time())
+        self._entries[digest] = entry
+        if key:
+            self._aliases[key] = digest
+        self.total += size
+        self._dirty = True
+        self._evict()
+        return entry
+
+    def release(self, entry: Optional[CachedMedia]) -> None:
+        if entry is None:
+            return
+        entry.refs = max(0, entry.refs - 1)
+        if not entry.refs:
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.total <= self.max_bytes:
+            return
+        for digest in list(self._entries):
+            if self.total <= self.max_bytes:
+                break
+            entry = self._entries[digest]
+            if entry.refs:
+                continue
+            del self._entries[digest]
+            entry.path.unlink(missing_ok=True)
+            if entry.meta and entry.meta.thumb:
+                Path(entry.meta.thumb).unlink(missing_ok=True)
+            self.total -= entry.size
+            self.evictions += 1
+            self._dirty = True
+        if self._dirty:
+            self._aliases = {k: d for k, d in self._aliases.items() if d in self._entries}
+
+    def close(self) -> None:
+        self.save()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "digest_hits": self.digest_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.digest_hits) / lookups, 3) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, doc: str):
+        self.name = name
+        self.doc = doc
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_str(k)} {v}" for k, v in self.values.items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = buckets
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += 1
+        entry[2] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for key, (counts, count, total) in self.values.items():
+            for bound, c in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', bound),))} {c}")
+            lines.append(f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_count{_label_str(key)} {count}")
+            lines.append(f"{self.name}_sum{_label_str(key)} {total}")
+        return lines
+
+
+class Gauge:
+    """Значение снимается колбэком в момент запроса /metrics."""
+
+    def __init__(self, name: str, doc: str, func: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.doc = doc
+        self.func = func
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        try:
+            value = float(self.func())
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}", f"{self.name} {value}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, object] = {}
+
+    def counter(self, name: str, doc: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, doc))
+
+    def histogram(self, name: str, doc: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, doc, buckets))
+
+    def gauge(self, name: str, doc: str, func: Callable[[], float], kind: str = "gauge") -> Gauge:
+        self.metrics[name] = Gauge(name, doc, func, kind)
+        return self.metrics[name]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+stage_seconds = REGISTRY.histogram("xoster_stage_seconds", "Длительность стадий обработки поста")
+stage_errors = REGISTRY.counter("xoster_stage_errors_total", "Ошибки по стадиям")
+posts_total = REGISTRY.counter("xoster_posts_total", "Посты по результату (sent, ad, duplicate, empty, error)")
+post_seconds = REGISTRY.histogram("xoster_post_seconds", "Полное время обработки поста")
+bytes_total = REGISTRY.counter("xoster_bytes_total", "Байты медиа (download, upload, avoided, optimized)")
+retries_total = REGISTRY.counter("xoster_retries_total", "Повторы запросов по операциям")
+
+
+@contextmanager
+def stage(name: str):
+    """Замер стадии: гистограмма длительности + счётчик ошибок."""
+    t0 = time.monotonic()
+    try:
+        yield
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        stage_seconds.observe(time.monotonic() - t0, stage=name)
+
+
+async def start_metrics_server(host: str, port: int, registry: Registry = REGISTRY) -> asyncio.AbstractServer:
+    """Минимальный HTTP-сервер: GET /metrics в формате Prometheus."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                body = registry.render().encode("utf-8")
+                status, ctype = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                body, status, ctype = b"not found\n", "404 Not Found", "text/plain"
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1")
+                + body
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    log.info(f"📈 Метрики: http://{host}:{port}/metrics")
+    return server
+
+
+class JSONFormatter(logging.Formatter):
+    _skip = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._skip:
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = "INFO", fmt: str = "text", path: Optional[str] = None) -> logging.handlers.QueueListener:
+    """
+    Логи пишутся из отдельного потока: обработчики event loop только кладут
+    запись в очередь (QueueHandler), форматирование и вывод — в QueueListener.
+    """
+    if fmt == "json":
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    handlers = [logging.StreamHandler()]
+    if path:
+        handlers.append(logging.FileHandler(path, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(q)]
+    root.setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,175 @@
+import hashlib
+from dataclasses import dataclass, field
+from typing import Optional
+
+from ai_cache import normalize_text
+
+
+def text_hash(text: Optional[str]) -> str:
+    """Хэш исходного текста поста: пробелы и регистр правкой не считаются."""
+    return hashlib.sha256(normalize_text(text or "").encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class Mapping:
+    kind: str  # single | album
+    target: int  # ключ целевого канала (Target.key)
+    source: str
+    item_id: int  # id сообщения или grouped_id альбома
+    target_msg_ids: list[int]
+    caption_msg_id: Optional[int]
+    source_msg_ids: list[int] = field(default_factory=list)
+    text_hash: Optional[str] = None
+
+    @property
+    def aligned(self) -> bool:
+        """Элементы альбома ушли все и по порядку: i-й в источнике — i-й в канале."""
+        return len(self.source_msg_ids) == len(self.target_msg_ids)
+
+
+class MirrorIndex:
+    """
+    Соответствия source -> target в памяти поверх StateBackend: поиск по id
+    сообщения источника (и по grouped_id альбома) за O(1) для правок и
+    удалений. Запись сквозная — каждое изменение сразу уходит и в store.
+    Индекс строится из store на старте; у альбомов из старых баз нет id
+    сообщений источника — их правки находятся по grouped_id, а удаления
+    пропускаются.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._items: dict[tuple[str, str, int], list[Mapping]] = {}  # (kind, source, item_id)
+        self._members: dict[tuple[str, int], int] = {}  # (source, msg_id) -> grouped_id
+        self.reload()
+
+    def reload(self) -> None:
+        self._items.clear()
+        self._members.clear()
+        for row in self.store.iter_mappings():
+            self._index(Mapping(**row))
+
+    def _index(self, m: Mapping) -> None:
+        mappings = self._items.setdefault((m.kind, m.source, m.item_id), [])
+        mappings[:] = [old for old in mappings if old.target != m.target] + [m]
+        if m.kind == "album":
+            for msg_id in m.source_msg_ids:
+                self._members[(m.source, msg_id)] = m.item_id
+
+    def _persist(self, m: Mapping) -> None:
+        if m.kind == "single":
+            self.store.set_single(m.source, m.item_id, m.target_msg_ids[0], target=m.target, text_hash=m.text_hash)
+        else:
+            self.store.set_album(
+                m.source, m.item_id, m.target_msg_ids, m.caption_msg_id,
+                target=m.target, source_msg_ids=m.source_msg_ids, text_hash=m.text_hash,
+            )
+
+    def set_single(self, source: str, msg_id: int, target_id: int, target: int = 0, text_hash: Optional[str] = None):
+        m = Mapping("single", target, source, msg_id, [target_id], target_id, [msg_id], text_hash)
+        self._persist(m)
+        self._index(m)
+
+    def set_album(
+            self,
+            source: str,
+            grouped_id: int,
+            target_msg_ids: list[int],
+            caption_msg_id: Optional[int],
+            target: int = 0,
+            source_msg_ids: Optional[list[int]] = None,
+            text_hash: Optional[str] = None,
+    ) -> None:
+        # свои копии списков: remove() правит их на месте, а вызывающий передаёт
+        # один и тот же список source_msg_ids для всех целевых каналов
+        m = Mapping(
+            "album", target, source, grouped_id, list(target_msg_ids), caption_msg_id,
+            list(source_msg_ids or []), text_hash,
+        )
+        self._persist(m)
+        self._index(m)
+
+    def set_text_hash(self, m: Mapping, value: str) -> None:
+        """Хэш текста после правки; соответствие, удалённое тем временем, не воскрешается."""
+        m.text_hash = value
+        if self.contains(m):
+            self._persist(m)
+
+    def contains(self, m: Mapping) -> bool:
+        """Соответствие всё ещё в индексе (не удалено вслед за источником)."""
+        return any(old is m for old in self._items.get((m.kind, m.source, m.item_id), ()))
+
+    def lookup(self, source: str, msg_id: int, grouped_id: Optional[int] = None) -> list[Mapping]:
+        """Соответствия во всех целевых каналах для сообщения (или его альбома)."""
+        if grouped_id is None:
+            grouped_id = self._members.get((source, msg_id))
+        if grouped_id is not None:
+            return list(self._items.get(("album", source, grouped_id), ()))
+        return list(self._items.get(("single", source, msg_id), ()))
+
+    def remove(self, source: str, msg_ids: list[int]) -> list[tuple[Mapping, list[int]]]:
+        """
+        Забывает удалённые в источнике сообщения; возвращает [(соответствие,
+        id в канале, которые нужно удалить)]. Из альбома элементы удаляются
+        по одному, если порядок известен (aligned), иначе — весь альбом,
+        когда в источнике удалены все его сообщения.
+        """
+        result = []
+        for msg_id in msg_ids:
+            for m in self._items.pop(("single", source, msg_id), ()):
+                self.store.delete_single(source, msg_id, target=m.target)
+                result.append((m, m.target_msg_ids))
+
+            grouped_id = self._members.pop((source, msg_id), None)
+            if grouped_id is None:
+                continue
+            key = ("album", source, grouped_id)
+            for m in self._items.get(key, ()):
+                if msg_id not in m.source_msg_ids:
+                    continue
+                if m.aligned:
+                    i = m.source_msg_ids.index(msg_id)
+                    m.source_msg_ids.pop(i)
+                    result.append((m, [m.target_msg_ids.pop(i)]))
+                    if m.caption_msg_id not in m.target_msg_ids:
+                        m.caption_msg_id = m.target_msg_ids[0] if m.target_msg_ids else None
+                else:
+                    m.source_msg_ids.remove(msg_id)
+                    if not m.source_msg_ids:
+                        result.append((m, m.target_msg_ids))
+                if m.source_msg_ids:
+                    self._persist(m)
+                else:
+                    self.store.delete_album(source, grouped_id, target=m.target)
+            if not any(m.source_msg_ids for m in self._items.get(key, ())):
+                self._items.pop(key, None)
+        return result
+
+    def drop(self, m: Mapping) -> list[int]:
+        """
+        Забывает соответствие целиком (пост в канале удаляется не вслед за
+        источником, а по нашему решению); возвращает его id в канале.
+        """
+        key = (m.kind, m.source, m.item_id)
+        mappings = self._items.get(key, [])
+        if not any(old is m for old in mappings):
+            return []
+        mappings[:] = [old for old in mappings if old is not m]
+        if not mappings:
+            self._items.pop(key, None)
+            for msg_id in m.source_msg_ids if m.kind == "album" else ():
+                self._members.pop((m.source, msg_id), None)
+        if m.kind == "single":
+            self.store.delete_single(m.source, m.item_id, target=m.target)
+        else:
+            self.store.delete_album(m.source, m.item_id, target=m.target)
+        return list(m.target_msg_ids)
+
+    def compact(self, retention: float) -> int:
+        removed = self.store.compact(retention)
+        if removed:
+            self.reload()
+        return removed
+
+    def __len__(self) -> int:
+        return sum(len(mappings) for mappings in self._items.values())
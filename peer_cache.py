@@ -0,0 +1,148 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser
+
+from send_limiter import flood_retry
+
+log = logging.getLogger(__name__)
+
+
+def peer_key(ref) -> str:
+    """"@Chan", "chan" и "https://t.me/chan" — один ключ; числовые id — как есть."""
+    if isinstance(ref, int):
+        return str(ref)
+    ref = str(ref).strip()
+    for prefix in ("https://", "http://"):
+        if ref.startswith(prefix):
+            ref = ref[len(prefix):]
+    if ref.startswith(("t.me/", "telegram.me/")):
+        ref = ref.split("/", 1)[1]
+    return ref.lstrip("@").lower()
+
+
+def _dump(peer) -> Optional[dict]:
+    if isinstance(peer, InputPeerChannel):
+        return {"type": "channel", "id": peer.channel_id, "access_hash": peer.access_hash}
+    if isinstance(peer, InputPeerUser):
+        return {"type": "user", "id": peer.user_id, "access_hash": peer.access_hash}
+    if isinstance(peer, InputPeerChat):
+        return {"type": "chat", "id": peer.chat_id}
+    return None
+
+
+def _load(data: dict):
+    if data["type"] == "channel":
+        return InputPeerChannel(data["id"], data["access_hash"])
+    if data["type"] == "user":
+        return InputPeerUser(data["id"], data["access_hash"])
+    return InputPeerChat(data["id"])
+
+
+class PeerCache:
+    """
+    Кэш на диске: username или id канала -> input peer (id + access_hash).
+    На старте резолвятся только отсутствующие и устаревшие (старше ttl)
+    записи — параллельно, но не чаще rate запросов в секунду, чтобы не
+    упираться во FloodWait на ResolveUsername. Если повторный резолв
+    устаревшей записи не удался, используется старая.
+    """
+
+    def __init__(self, path: Path, ttl: float = 30 * 24 * 3600, concurrency: int = 4, rate: float = 2.0):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.rate = rate
+
+        self._entries: dict[str, dict] = {}
+        self._dirty = False
+        self._next_slot = 0.0
+
+        self.hits = 0
+        self.resolved = 0
+        self.failed = 0
+        self.resolve_seconds = 0.0
+
+        if self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text("utf-8"))
+            except ValueError:
+                log.warning(f"⚠️ Кэш пиров {self.path} повреждён, резолвим заново")
+
+    def get(self, ref) -> Any:
+        entry = self._entries.get(peer_key(ref))
+        return _load(entry) if entry else None
+
+    def put(self, ref, peer) -> None:
+        data = _dump(peer)
+        if data is None:
+            return
+        data["ts"] = time.time()
+        self._entries[peer_key(ref)] = data
+        self._dirty = True
+
+    async def _slot(self) -> None:
+        """Бюджет запросов: старты не чаще rate в секунду."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        start = max(now, self._next_slot)
+        self._next_slot = start + 1 / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def resolve_all(self, client, refs: list) -> dict:
+        """ref -> input peer; не найденные (и без старой записи) в результат не попадают."""
+        t0 = time.monotonic()
+        result = {}
+        missing = []
+        for ref in refs:
+            entry = self._entries.get(peer_key(ref))
+            if entry is not None:
+                result[ref] = _load(entry)
+                if time.time() - entry.get("ts", 0) <= self.ttl:
+                    self.hits += 1
+                    continue
+            missing.append(ref)
+
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def resolve(ref):
+            async with sem:
+                await self._slot()
+                try:
+                    peer = await flood_retry(client.get_input_entity, ref)
+                except Exception as e:
+                    self.failed += 1
+                    log.warning(f"⚠️ Не удалось найти {ref}: {e}")
+                    return
+            self.resolved += 1
+            self.put(ref, peer)
+            result[ref] = peer
+
+        await asyncio.gather(*(resolve(ref) for ref in missing))
+        self.resolve_seconds += time.monotonic() - t0
+        self.save()
+        return result
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps(self._entries, ensure_ascii=False, indent=1), "utf-8")
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "resolved": self.resolved,
+            "failed": self.failed,
+            "resolve_seconds": round(self.resolve_seconds, 2),
+        }
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class FairScheduler:
+    """
+    Центральная очередь задач постинга.
+    У каждого источника своя ограниченная очередь (submit ждёт, пока в ней
+    не освободится место — это и есть backpressure на обработчики событий),
+    воркеры выбирают источник по взвешенному round-robin, поэтому шумный
+    канал не может надолго занять все воркеры.
+    Для отдельных стадий (ai, download, upload, send) есть свои лимиты
+    параллелизма, а изменения общего состояния сериализуются через state_lock.
+    """
+
+    def __init__(
+            self,
+            workers: int = 4,
+            queue_size: int = 50,
+            weights: Optional[dict[str, int]] = None,
+            stage_limits: Optional[dict[str, int]] = None,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.weights = weights or {}
+        self.state_lock = asyncio.Lock()
+
+        self._queues: dict[str, deque] = {}
+        self._space: dict[str, asyncio.Semaphore] = {}
+        self._rotation: list[str] = []
+        self._rr = 0
+        self._available = asyncio.Semaphore(0)
+        self._stages = {name: asyncio.Semaphore(limit) for name, limit in (stage_limits or {}).items()}
+        self._tasks: list[asyncio.Task] = []
+
+        self.submitted = 0
+        self.started = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.stage_wait: dict[str, float] = {name: 0.0 for name in self._stages}
+
+    def add_source(self, source: str) -> None:
+        if source in self._queues:
+            return
+        self._queues[source] = deque()
+        self._space[source] = asyncio.Semaphore(self.queue_size)
+        self._rotation.extend([source] * max(1, self.weights.get(source, 1)))
+
+    async def submit(self, source: str, job: Callable[[], Awaitable], name: str = "") -> None:
+        self.add_source(source)
+        await self._space[source].acquire()
+        self._queues[source].append((time.monotonic(), job, name))
+        self.submitted += 1
+        self._available.release()
+
+    def _pick(self):
+        for _ in range(len(self._rotation)):
+            source = self._rotation[self._rr]
+            self._rr = (self._rr + 1) % len(self._rotation)
+            queue = self._queues[source]
+            if queue:
+                self._space[source].release()
+                return source, queue.popleft()
+        return None, None
+
+    async def _worker(self) -> None:
+        while True:
+            await self._available.acquire()
+            source, entry = self._pick()
+            if entry is None:
+                continue
+            enqueued, job, name = entry
+            wait = time.monotonic() - enqueued
+            self.started += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.busy += 1
+            try:
+                await job()
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                log.warning(f"⚠️ Ошибка задачи {name or '?'} из {source}: {e!r}")
+            finally:
+                self.busy -= 1
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        sem = self._stages.get(name)
+        if sem is None:
+            yield
+            return
+        t0 = time.monotonic()
+        async with sem:
+            self.stage_wait[name] += time.monotonic() - t0
+            yield
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def queue_depth(self) -> dict[str, int]:
+        return {source: len(queue) for source, queue in self._queues.items()}
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": sum(len(queue) for queue in self._queues.values()),
+            "per_source": self.queue_depth(),
+            "busy": self.busy,
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_avg": round(self.wait_total / self.started, 3) if self.started else 0.0,
+            "wait_max": round(self.wait_max, 3),
+            "stage_wait": {name: round(value, 3) for name, value in self.stage_wait.items()},
+        }
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from telethon import errors
+
+log = logging.getLogger(__name__)
+
+
+async def flood_retry(func: Callable[..., Awaitable], *args, max_retries: int = 3, **kwargs):
+    """
+    Вызов Telethon с повтором после FloodWait (для скачивания/загрузки,
+    которые не идут через SendLimiter).
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return await func(*args, **kwargs)
+        except errors.FloodWaitError as e:
+            if attempt >= max_retries:
+                raise
+            log.warning(f"⏳ FloodWait {e.seconds}s на {getattr(func, '__name__', 'call')}, ждём")
+            await asyncio.sleep(e.seconds + 1)
+
+
+class SendLimiter:
+    """
+    Исходящие отправки в целевой канал: token bucket + обработка FloodWait.
+    Отправки проходят строго по очереди (FIFO-лок), поэтому при FloodWait
+    мы спим и повторяем ту же отправку, а следующие ждут — порядок постов
+    сохраняется. После FloodWait скорость снижается (slowdown) и постепенно
+    восстанавливается после серии успешных отправок.
+    """
+
+    def __init__(
+            self,
+            rate: float = 0.5,
+            burst: int = 3,
+            max_retries: int = 5,
+            slowdown: float = 0.5,
+            min_rate: float = 0.05,
+            recover_after: int = 20,
+    ):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.slowdown = slowdown
+        self.min_rate = min_rate
+        self.recover_after = recover_after
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._streak = 0
+
+        self.sends = 0
+        self.errors = 0
+        self.flood_waits = 0
+        self.throttled_time = 0.0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    async def _take_token(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            delay = (1 - self._tokens) / self.rate
+            self.throttled_time += delay
+            await asyncio.sleep(delay)
+
+    def _on_flood(self, seconds: int) -> None:
+        self.flood_waits += 1
+        self.throttled_time += seconds
+        self._streak = 0
+        self._tokens = 0
+        self.rate = max(self.min_rate, self.rate * self.slowdown)
+        log.warning(f"⏳ FloodWait {seconds}s на отправке, скорость снижена до {self.rate:.2f}/с")
+
+    def _on_success(self) -> None:
+        self._streak += 1
+        if self.rate < self.base_rate and self._streak >= self.recover_after:
+            self.rate = min(self.base_rate, self.rate / self.slowdown)
+            self._streak = 0
+
+    async def send(self, func: Callable[..., Awaitable], *args, **kwargs):
+        t0 = time.monotonic()
+        async with self._lock:
+            for attempt in range(self.max_retries + 1):
+                await self._take_token()
+                try:
+                    result = await func(*args, **kwargs)
+                except errors.FloodWaitError as e:
+                    self._on_flood(e.seconds)
+                    if attempt >= self.max_retries:
+                        self.errors += 1
+                        raise
+                    await asyncio.sleep(e.seconds + 1)
+                    continue
+                except Exception:
+                    self.errors += 1
+                    raise
+                self._on_success()
+                break
+
+        latency = time.monotonic() - t0
+        self.sends += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "sends": self.sends,
+            "errors": self.errors,
+            "flood_waits": self.flood_waits,
+            "rate": round(self.rate, 3),
+            "throttled_time": round(self.throttled_time, 3),
+            "latency_avg": round(self.latency_total / self.sends, 3) if self.sends else 0.0,
+            "latency_max": round(self.latency_max, 3),
+        }
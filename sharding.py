@@ -0,0 +1,32 @@
+import bisect
+import hashlib
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Консистентное хэширование источников по шардам: у каждого шарда vnodes
+    точек на кольце, источник достаётся ближайшей точке по часовой стрелке.
+    При добавлении канала или шарда переезжает только малая часть источников.
+    """
+
+    def __init__(self, shards: int, vnodes: int = 64):
+        self.shards = shards
+        points = sorted((_point(f"shard-{s}#{v}"), s) for s in range(shards) for v in range(vnodes))
+        self._keys = [p for p, _ in points]
+        self._owners = [s for _, s in points]
+
+    def owner(self, source: str) -> int:
+        # регистр и @ не влияют: "@Chan" и "chan" — один и тот же канал
+        i = bisect.bisect(self._keys, _point(source.strip().lstrip("@").lower()))
+        return self._owners[i % len(self._keys)]
+
+    def assign(self, sources: list[str]) -> dict[int, list[str]]:
+        """шард -> его источники (шард без источников тоже в результате)."""
+        result: dict[int, list[str]] = {s: [] for s in range(self.shards)}
+        for source in sources:
+            result[self.owner(source)].append(source)
+        return result
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from typing import Coroutine
+
+
+class Speculation:
+    """
+    Работа над постом, начатая до вердикта о рекламе и дубликате
+    (переписывание, скачивание медиа), и её учёт.
+
+    Когда вердикт известен, settle() сообщает, сколько секунд каждая
+    работа успела сделать, пока шли проверки, — в последовательном
+    режиме она началась бы только после них, на столько же позже
+    уходит пост. При отказе незавершённая работа отменяется, а
+    запущенная — считается потраченной впустую. cancel() дожидается
+    отменённых задач: после него они уже не пишут в каталог задачи и
+    не держат подпроцессы.
+    """
+
+    def __init__(self):
+        self._tasks: list[tuple[str, float, asyncio.Task]] = []
+        self._finished: dict[asyncio.Task, float] = {}
+        self.settled = False
+        self.accepted = False
+
+    def spawn(self, kind: str, coro: Coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        task.add_done_callback(self._on_done)
+        self._tasks.append((kind, time.monotonic(), task))
+        return task
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._finished[task] = time.monotonic()
+
+    def settle(self, accepted: bool) -> tuple[dict[str, float], dict[str, int]]:
+        """
+        ({вид: секунд, сделанных до вердикта}, {вид: задач}).
+        Элементы альбома качаются параллельно и в обычном режиме, поэтому
+        для вида берётся самая долгая задача, а не сумма.
+        """
+        now = time.monotonic()
+        overlap: dict[str, float] = {}
+        counts: dict[str, int] = {}
+        for kind, started, task in self._tasks:
+            ran = min(self._finished.get(task, now), now) - started
+            overlap[kind] = max(overlap.get(kind, 0.0), ran)
+            counts[kind] = counts.get(kind, 0) + 1
+            if not accepted:
+                task.cancel()
+        self.settled = True
+        self.accepted = accepted
+        return overlap, counts
+
+    async def cancel(self) -> None:
+        tasks = [task for _, _, task in self._tasks]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
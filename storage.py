@@ -0,0 +1,683 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from array import array
+from pathlib import Path
+from typing import Iterable, Optional
+
+from dedup_index import DedupFileStore
+from media_dedup import MediaHashFileStore
+
+log = logging.getLogger(__name__)
+
+
+class StateBackend:
+    """
+    Хранилище состояния зеркала: соответствия source -> target для одиночных
+    сообщений и альбомов + подписи дедупликации.
+    target — ключ целевого канала: 0 у основного (так же хранились записи
+    до появления нескольких каналов), id канала у остальных.
+    Запись батчится: flush() вызывается периодически и при остановке.
+    """
+
+    def get_single(self, source: str, msg_id: int, target: int = 0) -> Optional[int]:
+        raise NotImplementedError
+
+    def set_single(
+            self,
+            source: str,
+            msg_id: int,
+            target_id: int,
+            target: int = 0,
+            text_hash: Optional[str] = None,
+    ) -> None:
+        """text_hash — хэш исходного текста: правка без изменения текста не трогает AI."""
+        raise NotImplementedError
+
+    def get_album(self, source: str, grouped_id: int, target: int = 0) -> Optional[dict]:
+        raise NotImplementedError
+
+    def set_album(
+            self,
+            source: str,
+            grouped_id: int,
+            target_msg_ids: list[int],
+            caption_msg_id: Optional[int],
+            target: int = 0,
+            source_msg_ids: Optional[list[int]] = None,
+            text_hash: Optional[str] = None,
+    ) -> None:
+        """source_msg_ids — id сообщений альбома в источнике (для удаления по id)."""
+        raise NotImplementedError
+
+    def delete_single(self, source: str, msg_id: int, target: int = 0) -> None:
+        raise NotImplementedError
+
+    def delete_album(self, source: str, grouped_id: int, target: int = 0) -> None:
+        raise NotImplementedError
+
+    def iter_mappings(self) -> Iterable[dict]:
+        """
+        Все соответствия для индекса в памяти: словари с kind (single/album),
+        target, source, item_id (id сообщения или grouped_id), target_msg_ids,
+        caption_msg_id, source_msg_ids, text_hash.
+        """
+        raise NotImplementedError
+
+    def get_watermark(self, source: str) -> Optional[int]:
+        """id последнего обработанного сообщения источника (для догона после простоя)."""
+        raise NotImplementedError
+
+    def set_watermark(self, source: str, msg_id: int) -> None:
+        raise NotImplementedError
+
+    def dedup_store(self, num_perm: int, seed: int):
+        """Объект с интерфейсом DedupFileStore для DedupIndex."""
+        raise NotImplementedError
+
+    def media_hash_store(self):
+        """Объект с интерфейсом MediaHashFileStore для MediaHashIndex."""
+        raise NotImplementedError
+
+    def compact(self, retention: float) -> int:
+        """Удаляет соответствия старше retention секунд, возвращает число удалённых."""
+        raise NotImplementedError
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self):
+        """
+        Контекст атомарной проверки-и-записи общих индексов между процессами
+        (шардами). Для однопроцессных бэкендов ничего не делает.
+        """
+        yield
+
+    def flush(self) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        self.flush()
+
+
+class JSONStateBackend(StateBackend):
+    """
+    Старый формат mirror_map.json. Файл переписывается целиком, но только
+    на flush(), а не после каждого сообщения.
+    """
+
+    def __init__(self, path: Path, dedup_path: Path):
+        self.path = Path(path)
+        self.dedup_path = Path(dedup_path)
+        self.state = {"single": {}, "album": {}}
+        if self.path.exists():
+            self.state.update(json.loads(self.path.read_text("utf-8")))
+        self.state.setdefault("created", {})
+        self.state.setdefault("watermark", {})
+        self.state.setdefault("text_hash", {})
+        self._dirty = False
+
+    @staticmethod
+    def _key(source: str, item_id: int, target: int) -> str:
+        # ключи основного канала — в старом формате "source:id"
+        return f"{source}:{item_id}" if not target else f"{target}/{source}:{item_id}"
+
+    def get_single(self, source: str, msg_id: int, target: int = 0) -> Optional[int]:
+        return self.state["single"].get(self._key(source, msg_id, target))
+
+    def set_single(
+            self,
+            source: str,
+            msg_id: int,
+            target_id: int,
+            target: int = 0,
+            text_hash: Optional[str] = None,
+    ) -> None:
+        key = self._key(source, msg_id, target)
+        self.state["single"][key] = target_id
+        self.state["created"][f"single:{key}"] = time.time()
+        if text_hash is not None:
+            self.state["text_hash"][f"single:{key}"] = text_hash
+        self._dirty = True
+
+    def get_album(self, source: str, grouped_id: int, target: int = 0) -> Optional[dict]:
+        return self.state["album"].get(self._key(source, grouped_id, target))
+
+    def set_album(
+            self,
+            source: str,
+            grouped_id: int,
+            target_msg_ids: list[int],
+            caption_msg_id: Optional[int],
+            target: int = 0,
+            source_msg_ids: Optional[list[int]] = None,
+            text_hash: Optional[str] = None,
+    ) -> None:
+        key = self._key(source, grouped_id, target)
+        entry = {"target_msg_ids": target_msg_ids, "caption_msg_id": caption_msg_id}
+        if source_msg_ids is not None:
+            entry["source_msg_ids"] = source_msg_ids
+        self.state["album"][key] = entry
+        self.state["created"][f"album:{key}"] = time.time()
+        if text_hash is not None:
+            self.state["text_hash"][f"album:{key}"] = text_hash
+        self._dirty = True
+
+    def _delete(self, kind: str, key: str) -> None:
+        if self.state[kind].pop(key, None) is not None:
+            self.state["created"].pop(f"{kind}:{key}", None)
+            self.state["text_hash"].pop(f"{kind}:{key}", None)
+            self._dirty = True
+
+    def delete_single(self, source: str, msg_id: int, target: int = 0) -> None:
+        self._delete("single", self._key(source, msg_id, target))
+
+    def delete_album(self, source: str, grouped_id: int, target: int = 0) -> None:
+        self._delete("album", self._key(source, grouped_id, target))
+
+    def iter_mappings(self) -> Iterable[dict]:
+        for key, target_id in self.state["single"].items():
+            target, source, msg_id = _split_json_key(key)
+            yield {
+                "kind": "single", "target": target, "source": source, "item_id": msg_id,
+                "target_msg_ids": [target_id], "caption_msg_id": target_id,
+                "source_msg_ids": [msg_id], "text_hash": self.state["text_hash"].get(f"single:{key}"),
+            }
+        for key, entry in self.state["album"].items():
+            target, source, grouped_id = _split_json_key(key)
+            yield {
+                "kind": "album", "target": target, "source": source, "item_id": grouped_id,
+                "target_msg_ids": entry.get("target_msg_ids") or [], "caption_msg_id": entry.get("caption_msg_id"),
+                "source_msg_ids": entry.get("source_msg_ids") or [],
+                "text_hash": self.state["text_hash"].get(f"album:{key}"),
+            }
+
+    def get_watermark(self, source: str) -> Optional[int]:
+        return self.state["watermark"].get(source)
+
+    def set_watermark(self, source: str, msg_id: int) -> None:
+        self.state["watermark"][source] = msg_id
+        self._dirty = True
+
+    def dedup_store(self, num_perm: int, seed: int):
+        return DedupFileStore(self.dedup_path, num_perm, seed)
+
+    def media_hash_store(self):
+        return MediaHashFileStore(self.dedup_path.with_name("media_hashes.bin"))
+
+    def compact(self, retention: float) -> int:
+        if not retention:
+            return 0
+        cutoff = time.time() - retention
+        removed = 0
+        for kind in ("single", "album"):
+            for key in list(self.state[kind]):
+                # записи без отметки времени (старый формат) считаем свежими
+                if self.state["created"].get(f"{kind}:{key}", cutoff + 1) < cutoff:
+                    self._delete(kind, key)
+                    removed += 1
+        if removed:
+            self._dirty = True
+        return removed
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps(self.state, ensure_ascii=False), "utf-8")
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+
+def _dedup_row(entry_id: int, ts: float, blob: bytes, shingles_blob: Optional[bytes]):
+    sig = array("I")
+    sig.frombytes(blob)
+    shingles = None
+    if shingles_blob:
+        shingles = array("I")
+        shingles.frombytes(shingles_blob)
+    return entry_id, ts, sig, shingles
+
+
+class SQLiteDedupStore:
+    """Подписи дедупликации и хэши триграмм в таблице dedup (только дописывание)."""
+
+    def __init__(self, backend: "SQLiteStateBackend", num_perm: int, seed: int):
+        self.backend = backend
+        self.db = backend.db
+        self.num_perm = num_perm
+        self.seed = seed
+        self.records = 0
+
+    def load(self, limit: int) -> list[tuple[int, float, array, Optional[array]]]:
+        params = f"{self.num_perm}:{self.seed}"
+        if self.backend.get_meta("dedup_params") != params:
+            self.db.execute("DELETE FROM dedup")
+            self.backend.set_meta("dedup_params", params)
+            self.db.commit()
+        (self.records,) = self.db.execute("SELECT COUNT(*) FROM dedup").fetchone()
+        rows = self.db.execute(
+            "SELECT id, ts, sig, shingles FROM dedup ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [_dedup_row(*row) for row in reversed(rows)]
+
+    def load_since(self, first_id: int) -> list[tuple[int, float, array, Optional[array]]]:
+        """Подписи, дописанные другими процессами: id >= first_id."""
+        rows = self.db.execute("SELECT id, ts, sig, shingles FROM dedup WHERE id >= ? ORDER BY id", (first_id,))
+        return [_dedup_row(*row) for row in rows]
+
+    def append(self, entry_id: int, ts: float, sig: array, shingles: Optional[array] = None) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO dedup(id, ts, sig, shingles) VALUES (?, ?, ?, ?)",
+            (entry_id, ts, sig.tobytes(), shingles.tobytes() if shingles is not None else None),
+        )
+        self.backend.touch()
+        self.records += 1
+
+    def compact(self, entries: Iterable[tuple[int, float, array, Optional[array]]]) -> None:
+        first = next(iter(entries), None)
+        if first is None:
+            return
+        self.db.execute("DELETE FROM dedup WHERE id < ?", (first[0],))
+        self.backend.touch()
+        (self.records,) = self.db.execute("SELECT COUNT(*) FROM dedup").fetchone()
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteMediaHashStore:
+    """Хэши медиа в таблице media_hash (только дописывание)."""
+
+    def __init__(self, backend: "SQLiteStateBackend"):
+        self.backend = backend
+        self.db = backend.db
+        self.records = 0
+
+    def load(self, limit: int) -> list[tuple[int, float, int, int]]:
+        (self.records,) = self.db.execute("SELECT COUNT(*) FROM media_hash").fetchone()
+        rows = self.db.execute(
+            "SELECT id, ts, phash, dhash FROM media_hash ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return list(reversed(rows))
+
+    def load_since(self, first_id: int) -> list[tuple[int, float, int, int]]:
+        return self.db.execute(
+            "SELECT id, ts, phash, dhash FROM media_hash WHERE id >= ? ORDER BY id", (first_id,)
+        ).fetchall()
+
+    def append(self, entry_id: int, ts: float, ph: int, dh: int) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO media_hash(id, ts, phash, dhash) VALUES (?, ?, ?, ?)", (entry_id, ts, ph, dh)
+        )
+        self.backend.touch()
+        self.records += 1
+
+    def compact(self, entries: Iterable[tuple[int, float, int, int]]) -> None:
+        first = next(iter(entries), None)
+        if first is None:
+            return
+        self.db.execute("DELETE FROM media_hash WHERE id < ?", (first[0],))
+        self.backend.touch()
+        (self.records,) = self.db.execute("SELECT COUNT(*) FROM media_hash").fetchone()
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    SQLite в режиме WAL: индексированные таблицы соответствий и дописываемая
+    таблица подписей. Стоимость записи одного сообщения не зависит от размера
+    истории; коммиты группируются (batch_size изменений или flush()).
+    """
+
+    def __init__(self, path: Path, batch_size: int = 50):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self._dirty = 0
+        self._exclusive = False
+
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        legacy = self._detach_legacy_tables()
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS single (
+                target INTEGER NOT NULL DEFAULT 0,
+                source TEXT NOT NULL,
+                msg_id INTEGER NOT NULL,
+                target_id INTEGER NOT NULL,
+                created REAL NOT NULL,
+                text_hash TEXT,
+                PRIMARY KEY (target, source, msg_id)
+            );
+            CREATE TABLE IF NOT EXISTS album (
+                target INTEGER NOT NULL DEFAULT 0,
+                source TEXT NOT NULL,
+                grouped_id INTEGER NOT NULL,
+                target_msg_ids TEXT NOT NULL,
+                caption_msg_id INTEGER,
+                created REAL NOT NULL,
+                source_msg_ids TEXT,
+                text_hash TEXT,
+                PRIMARY KEY (target, source, grouped_id)
+            );
+            CREATE TABLE IF NOT EXISTS dedup (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                sig BLOB NOT NULL,
+                shingles BLOB
+            );
+            CREATE TABLE IF NOT EXISTS media_hash (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                phash INTEGER NOT NULL,
+                dhash INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS single_created ON single(created);
+            CREATE INDEX IF NOT EXISTS album_created ON album(created);
+            """
+        )
+        for table in legacy:
+            columns = "source, msg_id, target_id, created" if table == "single" else \
+                "source, grouped_id, target_msg_ids, caption_msg_id, created"
+            self.db.execute(f"INSERT INTO {table}({columns}) SELECT {columns} FROM {table}_v0")
+            self.db.execute(f"DROP TABLE {table}_v0")
+        self._add_columns()
+        self.db.commit()
+        if legacy:
+            log.info(f"🔁 Таблицы соответствий в {self.path} переведены на схему с целевыми каналами")
+
+    def _detach_legacy_tables(self) -> list[str]:
+        """Таблицы соответствий без колонки target переименовываются в *_v0 для переноса."""
+        legacy = []
+        for table in ("single", "album"):
+            columns = [row[1] for row in self.db.execute(f"PRAGMA table_info({table})")]
+            if columns and "target" not in columns:
+                self.db.execute(f"DROP INDEX IF EXISTS {table}_created")
+                self.db.execute(f"ALTER TABLE {table} RENAME TO {table}_v0")
+                legacy.append(table)
+        return legacy
+
+    def _add_columns(self) -> None:
+        """Колонки, которых нет в старых базах: правки/удаления и хэши триграмм дедупликации."""
+        for table, column, kind in (
+                ("single", "text_hash", "TEXT"),
+                ("album", "source_msg_ids", "TEXT"),
+                ("album", "text_hash", "TEXT"),
+                ("dedup", "shingles", "BLOB"),
+        ):
+            columns = [row[1] for row in self.db.execute(f"PRAGMA table_info({table})")]
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+    def touch(self) -> None:
+        self._dirty += 1
+        if self._dirty >= self.batch_size and not self._exclusive:
+            self.flush()
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self, timeout: float = 30.0):
+        """
+        BEGIN IMMEDIATE: блокировка записи базы на время проверки-и-вставки.
+        Пока её держит другой процесс, ждём не внутри SQLite (busy timeout
+        остановил бы цикл событий), а повторами через asyncio.sleep.
+        Накопленные изменения коммитятся до входа, изменения внутри — при выходе.
+        """
+        self.flush()
+        await self._begin_immediate(timeout)
+        self._exclusive = True
+        try:
+            yield
+        except BaseException:
+            self.db.rollback()
+            raise
+        else:
+            self.db.commit()
+        finally:
+            self._exclusive = False
+            self._dirty = 0
+
+    async def _begin_immediate(self, timeout: float) -> None:
+        busy_ms = self.db.execute("PRAGMA busy_timeout").fetchone()[0]
+        self.db.execute("PRAGMA busy_timeout = 0")
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        try:
+            while True:
+                try:
+                    self.db.execute("BEGIN IMMEDIATE")
+                    return
+                except sqlite3.OperationalError as e:
+                    if "locked" not in str(e) or time.monotonic() >= deadline:
+                        raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.1)
+        finally:
+            self.db.execute(f"PRAGMA busy_timeout = {busy_ms}")
+
+    def heartbeat(self, shard: int, info: dict) -> None:
+        self.set_meta(f"heartbeat:{shard}", json.dumps({**info, "ts": time.time()}))
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, value))
+        self.touch()
+
+    def get_single(self, source: str, msg_id: int, target: int = 0) -> Optional[int]:
+        row = self.db.execute(
+            "SELECT target_id FROM single WHERE target = ? AND source = ? AND msg_id = ?",
+            (target, source, msg_id),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_single(
+            self,
+            source: str,
+            msg_id: int,
+            target_id: int,
+            target: int = 0,
+            text_hash: Optional[str] = None,
+    ) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO single(target, source, msg_id, target_id, created, text_hash) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (target, source, msg_id, target_id, time.time(), text_hash),
+        )
+        self.touch()
+
+    def get_album(self, source: str, grouped_id: int, target: int = 0) -> Optional[dict]:
+        row = self.db.execute(
+            "SELECT target_msg_ids, caption_msg_id FROM album WHERE target = ? AND source = ? AND grouped_id = ?",
+            (target, source, grouped_id),
+        ).fetchone()
+        if not row:
+            return None
+        return {"target_msg_ids": json.loads(row[0]), "caption_msg_id": row[1]}
+
+    def set_album(
+            self,
+            source: str,
+            grouped_id: int,
+            target_msg_ids: list[int],
+            caption_msg_id: Optional[int],
+            target: int = 0,
+            source_msg_ids: Optional[list[int]] = None,
+            text_hash: Optional[str] = None,
+    ) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO album(target, source, grouped_id, target_msg_ids, caption_msg_id, created, "
+            "source_msg_ids, text_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                target, source, grouped_id, json.dumps(target_msg_ids), caption_msg_id, time.time(),
+                json.dumps(source_msg_ids) if source_msg_ids is not None else None, text_hash,
+            ),
+        )
+        self.touch()
+
+    def delete_single(self, source: str, msg_id: int, target: int = 0) -> None:
+        self.db.execute("DELETE FROM single WHERE target = ? AND source = ? AND msg_id = ?", (target, source, msg_id))
+        self.touch()
+
+    def delete_album(self, source: str, grouped_id: int, target: int = 0) -> None:
+        self.db.execute(
+            "DELETE FROM album WHERE target = ? AND source = ? AND grouped_id = ?", (target, source, grouped_id)
+        )
+        self.touch()
+
+    def iter_mappings(self) -> Iterable[dict]:
+        for target, source, msg_id, target_id, text_hash in self.db.execute(
+                "SELECT target, source, msg_id, target_id, text_hash FROM single"
+        ):
+            yield {
+                "kind": "single", "target": target, "source": source, "item_id": msg_id,
+                "target_msg_ids": [target_id], "caption_msg_id": target_id,
+                "source_msg_ids": [msg_id], "text_hash": text_hash,
+            }
+        for target, source, grouped_id, target_msg_ids, caption_msg_id, source_msg_ids, text_hash in self.db.execute(
+                "SELECT target, source, grouped_id, target_msg_ids, caption_msg_id, source_msg_ids, text_hash FROM album"
+        ):
+            yield {
+                "kind": "album", "target": target, "source": source, "item_id": grouped_id,
+                "target_msg_ids": json.loads(target_msg_ids), "caption_msg_id": caption_msg_id,
+                "source_msg_ids": json.loads(source_msg_ids) if source_msg_ids else [], "text_hash": text_hash,
+            }
+
+    def get_watermark(self, source: str) -> Optional[int]:
+        value = self.get_meta(f"watermark:{source}")
+        return int(value) if value is not None else None
+
+    def set_watermark(self, source: str, msg_id: int) -> None:
+        self.set_meta(f"watermark:{source}", str(msg_id))
+
+    def dedup_store(self, num_perm: int, seed: int):
+        return SQLiteDedupStore(self, num_perm, seed)
+
+    def media_hash_store(self):
+        return SQLiteMediaHashStore(self)
+
+    def compact(self, retention: float) -> int:
+        if not retention:
+            return 0
+        cutoff = time.time() - retention
+        removed = self.db.execute("DELETE FROM single WHERE created < ?", (cutoff,)).rowcount
+        removed += self.db.execute("DELETE FROM album WHERE created < ?", (cutoff,)).rowcount
+        self.flush()
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+    def is_empty(self) -> bool:
+        for table in ("single", "album", "dedup"):
+            if self.db.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return False
+        return True
+
+    def flush(self) -> None:
+        self.db.commit()
+        self._dirty = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
+
+
+def read_heartbeats(path: Path) -> dict[int, dict]:
+    """Пульс шардов из общей базы (для координатора, только чтение)."""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=5)
+    try:
+        rows = db.execute("SELECT key, value FROM meta WHERE key LIKE 'heartbeat:%'").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        db.close()
+    return {int(key.split(":", 1)[1]): json.loads(value) for key, value in rows}
+
+
+def open_backend(kind: str, db_path: Path, json_path: Path, dedup_path: Path, batch_size: int = 50) -> StateBackend:
+    if kind == "json":
+        return JSONStateBackend(json_path, dedup_path)
+    if kind == "sqlite":
+        return SQLiteStateBackend(db_path, batch_size=batch_size)
+    raise RuntimeError(f"Неизвестный STATE_BACKEND: {kind} (ожидается sqlite или json)")
+
+
+def _split_json_key(key: str) -> tuple[int, str, int]:
+    """Ключ mirror_map.json: "source:id" или "target/source:id"."""
+    rest, _, item_id = key.rpartition(":")
+    target, sep, source = rest.partition("/")
+    if not sep or not target.lstrip("-").isdigit():
+        target, source = "0", rest
+    return int(target), source, int(item_id)
+
+
+def migrate_json(backend: SQLiteStateBackend, json_path: Path, dedup_path: Path, num_perm: int, seed: int) -> list[str]:
+    """
+    Разовый перенос mirror_map.json и dedup_index.bin в SQLite.
+    dedup_index.bin переименовывается в *.migrated сразу после коммита.
+    Возвращает сырые тексты dedup_history старого формата — их надо
+    пропустить через DedupIndex.add(), сбросить базу и только потом вызвать
+    finish_migration(): до этого mirror_map.json остаётся на месте, и после
+    падения посередине перенос повторится (соответствия вставляются через
+    INSERT OR IGNORE, повтор безопасен).
+    """
+    json_path = Path(json_path)
+    dedup_path = Path(dedup_path)
+    legacy_texts: list[str] = []
+
+    if json_path.exists():
+        data = json.loads(json_path.read_text("utf-8"))
+        now = time.time()
+        for key, target_id in (data.get("single") or {}).items():
+            target, source, msg_id = _split_json_key(key)
+            backend.db.execute(
+                "INSERT OR IGNORE INTO single(target, source, msg_id, target_id, created) VALUES (?, ?, ?, ?, ?)",
+                (target, source, msg_id, target_id, now),
+            )
+        for key, entry in (data.get("album") or {}).items():
+            target, source, grouped_id = _split_json_key(key)
+            backend.db.execute(
+                "INSERT OR IGNORE INTO album(target, source, grouped_id, target_msg_ids, caption_msg_id, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (target, source, grouped_id, json.dumps(entry.get("target_msg_ids") or []), entry.get("caption_msg_id"), now),
+            )
+        for source, msg_id in (data.get("watermark") or {}).items():
+            backend.set_watermark(source, msg_id)
+        legacy_texts = list(data.get("dedup_history") or [])
+        backend.flush()
+
+    if dedup_path.exists():
+        file_store = DedupFileStore(dedup_path, num_perm, seed)
+        entries = file_store.load(limit=1 << 62)
+        sqlite_store = backend.dedup_store(num_perm, seed)
+        sqlite_store.load(limit=0)
+        for entry_id, ts, sig, shingles in entries:
+            sqlite_store.append(entry_id, ts, sig, shingles)
+        backend.flush()
+        dedup_path.rename(dedup_path.with_suffix(dedup_path.suffix + ".migrated"))
+        log.info(f"🔁 {dedup_path} перенесён в {backend.path} ({len(entries)} подписей)")
+
+    return legacy_texts
+
+
+def finish_migration(backend: SQLiteStateBackend, json_path: Path) -> None:
+    """Завершение migrate_json: всё перенесено и закоммичено — mirror_map.json больше не нужен."""
+    json_path = Path(json_path)
+    if not json_path.exists():
+        return
+    backend.flush()
+    json_path.rename(json_path.with_suffix(json_path.suffix + ".migrated"))
+    log.info(f"🔁 {json_path} перенесён в {backend.path}")
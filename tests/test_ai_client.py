@@ -0,0 +1,116 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+httpx = pytest.importorskip("httpx")
+
+from ai_client import AIClient, CircuitBreaker, CircuitOpenError  # noqa: E402
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.failure()
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    breaker.failure()
+    breaker.failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.opens == 1
+
+
+def test_breaker_half_open_lets_one_probe(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    monkeypatch.setattr(time, "monotonic", lambda: breaker.opened_at + 31)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+    breaker.success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_breaker_failed_probe_reopens(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    now = breaker.opened_at + 31
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_released_probe_is_handed_out_again(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    monkeypatch.setattr(time, "monotonic", lambda: breaker.opened_at + 31)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_breaker_stale_probe_expires(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    now = [breaker.opened_at + 31]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    assert breaker.allow()
+    assert not breaker.allow()
+    now[0] += 31
+    assert breaker.allow()
+
+
+def test_cancelled_probe_does_not_wedge_breaker():
+    async def scenario():
+        client = AIClient("http://deepseek.invalid", "key", retries=0, breaker_failures=1, breaker_reset=0.05)
+        breaker = client.breaker("m")
+        breaker.failure()
+        await asyncio.sleep(0.06)
+
+        async def hang(body, timeout):
+            await asyncio.Event().wait()
+
+        client._send = hang
+        probe = asyncio.create_task(client.chat({"model": "m"}))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open"
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        async def ok(body, timeout):
+            return httpx.Response(200, json={})
+
+        client._send = ok
+        resp = await client.chat({"model": "m"})
+        assert resp.status_code == 200
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_open_breaker_short_circuits_without_sending():
+    async def scenario():
+        client = AIClient("http://deepseek.invalid", "key", retries=0, breaker_failures=1, breaker_reset=60)
+        client.breaker("m").failure()
+
+        async def never(body, timeout):
+            raise AssertionError("запрос не должен уходить")
+
+        client._send = never
+        with pytest.raises(CircuitOpenError):
+            await client.chat({"model": "m"})
+        assert client.short_circuits == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,128 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from batcher import Debouncer, MicroBatcher  # noqa: E402
+
+
+def test_debouncer_coalesces_rapid_edits():
+    async def scenario():
+        seen = []
+
+        async def handler(key, value):
+            seen.append((key, value))
+
+        debouncer = Debouncer(handler, delay=0.02)
+        for value in ("a", "b", "c"):
+            debouncer.push(1, value)
+            await asyncio.sleep(0.005)
+        debouncer.push(2, "x")
+        await asyncio.sleep(0.05)
+
+        assert sorted(seen) == [(1, "c"), (2, "x")]
+        assert debouncer.stats() == {"pushed": 4, "requeued": 0, "fired": 2, "coalesced": 2, "failures": 0}
+
+    asyncio.run(scenario())
+
+
+def test_debouncer_requeue_retries_and_yields_to_newer_value():
+    async def scenario():
+        seen = []
+
+        async def handler(key, value):
+            seen.append(value)
+            if value == "early":
+                debouncer.requeue(key, "early-retry")
+            elif value == "stale":
+                # пока шёл handler, пришла новая правка — повтор не нужен
+                debouncer.push(key, "fresh")
+                debouncer.requeue(key, "stale-retry")
+
+        debouncer = Debouncer(handler, delay=0.01)
+        debouncer.push(1, "early")
+        debouncer.push(2, "stale")
+        await asyncio.sleep(0.06)
+
+        assert sorted(seen) == ["early", "early-retry", "fresh", "stale"]
+        stats = debouncer.stats()
+        assert stats["pushed"] == 3 and stats["requeued"] == 1
+        assert stats["fired"] == 4 and stats["coalesced"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_debouncer_runs_one_handler_per_key_at_a_time():
+    async def scenario():
+        active = 0
+        peak = 0
+        seen = []
+
+        async def handler(key, value):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.03)
+            seen.append(value)
+            active -= 1
+
+        debouncer = Debouncer(handler, delay=0.01)
+        debouncer.push(1, "first")
+        await asyncio.sleep(0.015)
+        debouncer.push(1, "second")
+        await asyncio.sleep(0.08)
+
+        assert seen == ["first", "second"] and peak == 1
+
+    asyncio.run(scenario())
+
+
+def test_debouncer_cancel_and_failures():
+    async def scenario():
+        async def handler(key, value):
+            raise RuntimeError("boom")
+
+        debouncer = Debouncer(handler, delay=0.01)
+        debouncer.push(1, "dropped")
+        debouncer.cancel(1)
+        debouncer.push(2, "fails")
+        await asyncio.sleep(0.03)
+        await debouncer.close()
+
+        stats = debouncer.stats()
+        assert stats["fired"] == 1 and stats["failures"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_micro_batcher_groups_concurrent_items():
+    async def scenario():
+        batches = []
+
+        async def func(items):
+            batches.append(list(items))
+            return [item * 10 for item in items]
+
+        batcher = MicroBatcher(func, max_items=4, max_delay=0.01)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+
+        assert results == [i * 10 for i in range(6)]
+        assert batches == [[0, 1, 2, 3], [4, 5]]
+        await batcher.close()
+
+    asyncio.run(scenario())
+
+
+def test_micro_batcher_error_reaches_every_caller():
+    async def scenario():
+        async def func(items):
+            raise RuntimeError("boom")
+
+        batcher = MicroBatcher(func, max_items=8, max_delay=0.01)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+
+        assert all(isinstance(r, RuntimeError) for r in results)
+        await batcher.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,76 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dedup_index import DedupFileStore, DedupIndex, calculate_similarity  # noqa: E402
+
+WORDS = (
+    "канал новости курс рубль доллар биржа акции нефть газ погода москва "
+    "завтра сегодня скидка подписка выпуск обзор интервью эксперт рынок "
+    "прогноз рост падение индекс банк ставка кредит вклад налог закон"
+).split()
+
+
+def make_corpus(seed: int = 7, size: int = 60) -> tuple[list[str], list[str]]:
+    """Фиксированный корпус: тексты истории и запросы — правки части из них и новые тексты."""
+    rng = random.Random(seed)
+    history = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))) for _ in range(size)]
+    probes = []
+    for text in history[:size // 2]:
+        words = text.split()
+        for _ in range(rng.randint(1, 4)):
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+        probes.append(" ".join(words))
+    probes += [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))) for _ in range(size // 2)]
+    probes += ["ок", ""]
+    return history, probes
+
+
+def exact_best(text: str, history: list[str], threshold: float) -> float:
+    best = max((calculate_similarity(text, h) for h in history), default=0.0)
+    return best if best > threshold else 0.0
+
+
+@pytest.mark.parametrize("threshold", [0.15, 0.5, 0.8])
+def test_query_agrees_with_exact_jaccard(threshold):
+    history, probes = make_corpus()
+    index = DedupIndex(threshold=threshold, capacity=len(history))
+    for text in history:
+        index.add(text)
+
+    got = [index.query(text) for text in probes]
+    expected = [exact_best(text, history, threshold) for text in probes]
+
+    assert got == pytest.approx(expected)
+    assert any(expected) and not all(expected)
+
+
+def test_capacity_evicts_oldest():
+    history, _ = make_corpus()
+    index = DedupIndex(threshold=0.8, capacity=10)
+    for text in history:
+        index.add(text)
+
+    assert len(index) == 10
+    assert index.query(history[-1]) == pytest.approx(1.0)
+    assert index.query(history[0]) == exact_best(history[0], history[-10:], 0.8)
+
+
+def test_file_store_survives_restart(tmp_path):
+    history, probes = make_corpus(seed=11, size=20)
+    path = tmp_path / "dedup_index.bin"
+    index = DedupIndex(threshold=0.5, capacity=100, store=DedupFileStore(path, 128, 1))
+    for text in history:
+        index.add(text)
+    before = [index.query(text) for text in probes]
+    index.close()
+
+    reopened = DedupIndex(threshold=0.5, capacity=100, store=DedupFileStore(path, 128, 1))
+
+    assert len(reopened) == len(history)
+    assert [reopened.query(text) for text in probes] == before
+    reopened.close()
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from media import run_process  # noqa: E402
+
+
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+@pytest.mark.parametrize("cancel", [True, False])
+def test_child_is_killed_on_cancel_and_timeout(cancel, tmp_path):
+    pid_file = tmp_path / "pid"
+
+    async def scenario():
+        cmd = [sys.executable, "-c", f"import os, time; open({str(pid_file)!r}, 'w').write(str(os.getpid())); time.sleep(60)"]
+        task = asyncio.create_task(run_process(cmd, timeout=60 if cancel else 0.5))
+        while not pid_file.exists() or not pid_file.read_text():
+            await asyncio.sleep(0.02)
+        if cancel:
+            task.cancel()
+        with pytest.raises(asyncio.CancelledError if cancel else asyncio.TimeoutError):
+            await task
+
+    asyncio.run(scenario())
+    assert not alive(int(pid_file.read_text()))
@@ -0,0 +1,79 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mirror_index import MirrorIndex  # noqa: E402
+from storage import JSONStateBackend, SQLiteStateBackend  # noqa: E402
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def index(request, tmp_path):
+    if request.param == "json":
+        store = JSONStateBackend(tmp_path / "mirror_map.json", tmp_path / "dedup_index.bin")
+    else:
+        store = SQLiteStateBackend(tmp_path / "state.sqlite3")
+    return MirrorIndex(store)
+
+
+def test_album_item_delete_reaches_every_target(index):
+    # finish_album передаёт один и тот же список id источника для всех целевых каналов
+    source_ids = [11, 12, 13]
+    index.set_album("src", 900, [101, 102, 103], 101, target=0, source_msg_ids=source_ids)
+    index.set_album("src", 900, [201, 202, 203], 201, target=-1002, source_msg_ids=source_ids)
+
+    removed = sorted((m.target, ids) for m, ids in index.remove("src", [12]))
+
+    assert removed == [(-1002, [202]), (0, [102])]
+    assert source_ids == [11, 12, 13]
+    for m in index.lookup("src", 11):
+        assert m.source_msg_ids == [11, 13]
+
+
+def test_album_deleted_entirely_in_every_target(index):
+    source_ids = [21, 22]
+    index.set_album("src", 901, [301, 302], 301, target=0, source_msg_ids=source_ids)
+    index.set_album("src", 901, [401, 402], 401, target=-1003, source_msg_ids=source_ids)
+
+    removed = sorted((m.target, ids) for m, ids in index.remove("src", [21, 22]))
+
+    assert removed == [(-1003, [401]), (-1003, [402]), (0, [301]), (0, [302])]
+    assert index.lookup("src", 21) == []
+    assert len(index) == 0
+
+
+def test_edit_after_delete_does_not_restore_mapping(index):
+    index.set_single("src", 5, 505, target=0, text_hash="old")
+    (m,) = index.lookup("src", 5)
+
+    index.remove("src", [5])
+    index.set_text_hash(m, "new")
+    index.reload()
+
+    assert index.lookup("src", 5) == []
+
+
+def test_drop_forgets_post_turned_into_ad(index):
+    source_ids = [31, 32]
+    index.set_album("src", 902, [501, 502], 501, target=0, source_msg_ids=source_ids)
+    index.set_album("src", 902, [601, 602], 601, target=-1004, source_msg_ids=source_ids)
+    index.set_single("src", 40, 700, target=0)
+
+    dropped = sorted((m.target, index.drop(m)) for m in index.lookup("src", 31))
+
+    assert dropped == [(-1004, [601, 602]), (0, [501, 502])]
+    assert index.lookup("src", 31) == [] and index.lookup("src", 32, 902) == []
+    # удаление в источнике после этого ничего не удаляет повторно
+    assert index.remove("src", [31]) == []
+    index.reload()
+    assert index.lookup("src", 31, 902) == []
+    assert [m.item_id for m in index.lookup("src", 40)] == [40]
+
+
+def test_drop_of_stale_mapping_is_noop(index):
+    index.set_single("src", 41, 701, target=0)
+    (m,) = index.lookup("src", 41)
+    index.remove("src", [41])
+    assert index.drop(m) == []
@@ -0,0 +1,118 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+errors = pytest.importorskip("telethon.errors")
+
+import send_limiter  # noqa: E402
+from send_limiter import SendLimiter, flood_retry  # noqa: E402
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Сон FloodWait не ждём по-настоящему, а записываем."""
+    calls = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        calls.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(send_limiter.asyncio, "sleep", fake_sleep)
+    return calls
+
+
+def flaky(waits: list[int], result="ok"):
+    """Функция отправки: сначала FloodWait на каждое значение из waits, потом успех."""
+    calls = []
+
+    async def func(*args):
+        calls.append(args)
+        if len(calls) <= len(waits):
+            raise errors.FloodWaitError(request=None, capture=waits[len(calls) - 1])
+        return result
+
+    func.calls = calls
+    return func
+
+
+def test_flood_wait_is_retried_and_slows_down(sleeps):
+    async def scenario():
+        limiter = SendLimiter(rate=1000, burst=5, slowdown=0.5, min_rate=100)
+        func = flaky([7, 3])
+
+        assert await limiter.send(func, "post") == "ok"
+        assert func.calls == [("post",)] * 3
+        assert 8 in sleeps and 4 in sleeps
+        stats = limiter.stats()
+        assert stats["flood_waits"] == 2 and stats["sends"] == 1 and stats["errors"] == 0
+        assert limiter.rate == 250
+
+        func = flaky([1, 1, 1])
+        await limiter.send(func)
+        assert limiter.rate == 100
+
+    asyncio.run(scenario())
+
+
+def test_flood_wait_gives_up_after_max_retries(sleeps):
+    async def scenario():
+        limiter = SendLimiter(rate=1000, burst=5, max_retries=2)
+        func = flaky([5, 5, 5, 5])
+
+        with pytest.raises(errors.FloodWaitError):
+            await limiter.send(func)
+        assert len(func.calls) == 3
+        stats = limiter.stats()
+        assert stats["errors"] == 1 and stats["flood_waits"] == 3 and stats["sends"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_rate_recovers_after_successful_streak(sleeps):
+    async def scenario():
+        limiter = SendLimiter(rate=1000, burst=5, slowdown=0.5, recover_after=3)
+        await limiter.send(flaky([1]))
+        assert limiter.rate == 500
+
+        # удачный повтор после FloodWait уже входит в серию
+        ok = flaky([])
+        await limiter.send(ok)
+        assert limiter.rate == 500
+        await limiter.send(ok)
+        assert limiter.rate == 1000
+
+    asyncio.run(scenario())
+
+
+def test_sends_keep_order_across_flood_wait(sleeps):
+    async def scenario():
+        limiter = SendLimiter(rate=1000, burst=5)
+        sent = []
+        waited = False
+
+        async def func(n):
+            nonlocal waited
+            if n == 0 and not waited:
+                waited = True
+                raise errors.FloodWaitError(request=None, capture=2)
+            sent.append(n)
+
+        await asyncio.gather(*(limiter.send(func, n) for n in range(4)))
+        assert sent == [0, 1, 2, 3]
+
+    asyncio.run(scenario())
+
+
+def test_flood_retry_retries_then_raises(sleeps):
+    async def scenario():
+        assert await flood_retry(flaky([2, 2]), max_retries=2) == "ok"
+        assert sleeps == [3, 3]
+        with pytest.raises(errors.FloodWaitError):
+            await flood_retry(flaky([2, 2, 2]), max_retries=2)
+
+    asyncio.run(scenario())
@@ -0,0 +1,48 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from speculation import Speculation  # noqa: E402
+
+
+def test_cancel_waits_for_tasks_to_unwind():
+    async def scenario():
+        cleaned = []
+
+        async def work():
+            try:
+                await asyncio.sleep(60)
+            finally:
+                await asyncio.sleep(0.01)  # уборка после отмены тоже ждёт
+                cleaned.append(True)
+
+        spec = Speculation()
+        task = spec.spawn("download", work())
+        await asyncio.sleep(0)
+        await spec.cancel()
+        return task, cleaned
+
+    task, cleaned = asyncio.run(scenario())
+    assert task.cancelled()
+    assert cleaned == [True]
+
+
+def test_settle_rejected_cancels_and_accepted_keeps_running():
+    async def scenario():
+        rejected = Speculation()
+        lost = rejected.spawn("rewrite", asyncio.sleep(60))
+        await asyncio.sleep(0.01)
+        overlap, counts = rejected.settle(accepted=False)
+        await rejected.cancel()
+
+        accepted = Speculation()
+        kept = accepted.spawn("rewrite", asyncio.sleep(0.02, result="text"))
+        accepted.settle(accepted=True)
+        return lost, overlap, counts, accepted, await kept
+
+    lost, overlap, counts, accepted, result = asyncio.run(scenario())
+    assert lost.cancelled()
+    assert counts == {"rewrite": 1} and overlap["rewrite"] > 0
+    assert accepted.accepted and result == "text"
@@ -0,0 +1,60 @@
+import asyncio
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import SQLiteStateBackend  # noqa: E402
+
+
+def test_exclusive_waits_without_blocking_event_loop(tmp_path):
+    path = tmp_path / "state.sqlite3"
+    backend = SQLiteStateBackend(path)
+    other = sqlite3.connect(str(path), isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")  # запись держит другой шард
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        async def release():
+            await asyncio.sleep(0.3)
+            other.execute("COMMIT")
+
+        tick_task = asyncio.create_task(ticker())
+        release_task = asyncio.create_task(release())
+        t0 = time.monotonic()
+        async with backend.exclusive():
+            backend.set_watermark("src", 42)
+        waited = time.monotonic() - t0
+        tick_task.cancel()
+        await release_task
+        return ticks, waited
+
+    ticks, waited = asyncio.run(scenario())
+    assert waited >= 0.25
+    assert ticks >= 10  # цикл событий продолжал работать, пока ждали блокировку
+    assert backend.get_watermark("src") == 42
+    assert backend.db.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+
+def test_exclusive_rolls_back_on_error(tmp_path):
+    backend = SQLiteStateBackend(tmp_path / "state.sqlite3")
+
+    async def scenario():
+        try:
+            async with backend.exclusive():
+                backend.set_watermark("src", 7)
+                raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+
+    asyncio.run(scenario())
+    assert backend.get_watermark("src") is None